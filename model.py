@@ -19,9 +19,123 @@ from io import BytesIO
 from IPython.display import IFrame
 from IPython.display import display, Javascript
 from IPython.core.display import HTML
+from collections import namedtuple
+from collections.abc import MutableMapping
+import itertools
+import copy
+import os
+import glob
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
 pd.options.mode.chained_assignment = None  # default='warn'
 
 
+# pollutants accounted for every trip, with their units and vehicles_info columns (emissions per km driven). 
+# co2 is calculated from emissions_perTonKm and the vehicle's total weight instead 
+pollutants = ['co2', 'NOX', 'PM2.5', 'PM10', 'logistic movements']
+pollutant_units = ['tons', 'g', 'g', 'g', 'km']
+pollutant_columns = [None, 'emissions_perKm_gNOX', 'emissions_perKm_gPM2p5', 'emissions_perKm_gPM10', None]
+
+def trip_pollutants(pollutants_perKm, emissions_perTonKm, vehicle_weight, load, km): 
+    '''pollutants emitted by driving km with load tons on board, as (..., len(pollutants)) array 
+    pollutants_perKm = (..., len(pollutants)) factors per km, other arguments scalars or (...) arrays'''
+    load, km = np.broadcast_arrays(np.asarray(load, dtype=float), np.asarray(km, dtype=float))
+    factors = np.array(np.broadcast_to(pollutants_perKm, load.shape + (len(pollutants),)))
+    factors[..., 0] = emissions_perTonKm * (vehicle_weight + load)
+    return factors * km[..., None]
+
+
+def draw_demolition_sites(stocks, request_amount, rng): 
+    '''randomly draw demolition sites (with replacement, from Generator rng) until their stocks cover 
+    request_amount. Draws are made in batches and the cumulative stock tells how many draws are needed. 
+    returns positions of the drawn sites and tons collected from each draw'''
+    if stocks.sum() == 0: # nothing can be collected for this material
+        return np.empty(0, dtype=int), np.empty(0)
+    batch_size = int(request_amount / stocks.mean()) + 16
+    draws = []
+    total = 0
+    while True: 
+        batch = rng.integers(len(stocks), size=batch_size)
+        cumulative = total + np.cumsum(stocks[batch])
+        enough = np.flatnonzero(cumulative >= request_amount)
+        if enough.size: 
+            draws.append(batch[:enough[0] + 1])
+            break
+        draws.append(batch)
+        total = cumulative[-1]
+    sites = np.concatenate(draws)
+    available = stocks[sites]
+    collected_before = np.concatenate(([0], np.cumsum(available)[:-1]))
+    collected = np.minimum(available, request_amount - collected_before)
+    return sites, collected
+
+
+def get_vehicle_forClient(model, hub_inA10, hub_waterbound, client_inA10, client_waterbound): 
+    '''vehicle of a model bringing materials from a hub to a client (construction site or micro hub): 
+    a water vehicle if the model uses the water network and both are waterbound, otherwise a truck 
+    of the model's truck_type (for semi, electric if the hub or the client is in the A10)'''
+    if model.network_type == 'water' and hub_waterbound and client_waterbound: 
+        transportation_network = 'water'
+        vehicle_type = 'water'
+    else: # road network is used: 
+        transportation_network = 'road'
+        if model.truck_type == 'semi': 
+            vehicle_type = 'electric' if client_inA10 or hub_inA10 else 'diesel'
+        else: 
+            vehicle_type = model.truck_type 
+    return model.get_vehicle(None, transportation_network, vehicle_type)
+
+
+class Vehicle(namedtuple('Vehicle', ['region', 'transportation_network', 'vehicle_type', 'vehicle_weight', 
+                                     'emissions_perTonKm', 'nAxels', 'capacities', 'material_ids', 
+                                     'pollutants_perKm'])): 
+    '''one row of vehicles_info compiled for trip calculations, see Model.get_vehicle()
+    capacities = np.array of capacities, indexed by material_ids = {'timber': 0, ... }
+    pollutants_perKm = np.array of emissions per km driven, indexed like pollutants'''
+    __slots__ = ()
+    
+    def capacity(self, mat): 
+        return self.capacities[self.material_ids[mat]]
+    
+    def trip_pollutants(self, load, km): 
+        '''pollutants emitted by driving km loaded with load tons, see trip_pollutants()'''
+        return trip_pollutants(self.pollutants_perKm, self.emissions_perTonKm, self.vehicle_weight, load, km)
+
+
+class MaterialsView(MutableMapping): 
+    '''dict-like view {'timber': 123, ... } on one (site, strucType) row of a model state array, 
+    so agents keep their dictionary API when the model runs with array_state=True
+    values = 1d array indexed by mat_ids = {'timber': 0, ... }, mats = materials exposed as keys'''
+    def __init__(self, values, mat_ids, mats): 
+        self.array = values
+        self.mat_ids = mat_ids
+        self.mats = list(mats)
+    
+    def __getitem__(self, mat): 
+        if mat not in self.mats: 
+            raise KeyError(mat)
+        return self.array[self.mat_ids[mat]]
+    
+    def __setitem__(self, mat, amount): 
+        self.array[self.mat_ids[mat]] = amount
+        if mat not in self.mats: 
+            self.mats.append(mat)
+    
+    def __delitem__(self, mat): 
+        raise TypeError('materials cannot be removed from a MaterialsView')
+    
+    def __iter__(self): 
+        return iter(self.mats)
+    
+    def __len__(self): 
+        return len(self.mats)
+    
+    def __repr__(self): 
+        return repr(dict(self.items()))
+
 class ConstructionSite(Agent): 
     def __init__(self, unique_id, model, buildingType, coords, inA10, waterbound):
         super().__init__(unique_id, model)
@@ -29,6 +143,9 @@ class ConstructionSite(Agent):
         self.coords = coords 
         self.inA10 = inA10 # True or False 
         self.waterbound = waterbound # True of False
+        self.site_index = len(self.model.construction_sites) # row in the model's site arrays
+        self.rng = self.model.make_rng('ConstructionSite', unique_id)
+        self.done = False # True once all materials are received, see Model.run_until_complete()
         self.materials_request = {}
         self.materials_received = {}
         
@@ -38,18 +155,20 @@ class ConstructionSite(Agent):
         self.nearestMacroHub_id = None
         self.nearestMacroHub_dist = None
         
-        self.filter_material_composition_df()
+        # tons per (strucType, material) of the building type, a row shared by all sites of the type 
+        self.composition = self.model.site_composition[self.model.buildingType_ids[buildingType]]
         self.make_dicts_siteInfo()
         self.calc_materials_required()
-            
-    def filter_material_composition_df(self): 
-        '''make df of materials required, based on building type and biobased type'''
-        b = self.model.build_info.copy()
-        b = b[(b.buildingType == self.buildingType) & (b.biobased_type == self.model.biobased_type)] 
-        self.material_composition_df = b
     
     def make_dicts_siteInfo(self): 
-        '''make dictionaries required to record information on construction site'''
+        '''make dictionaries required to record information on construction site
+        (with array_state, these are views on the model's site arrays, see Model.make_site_arrays)'''
+        if self.model.array_state: 
+            mats = [mat for mat in self.model.materials_list if mat != 'modules']
+            self.materials_required = self.model.make_state_views(self.model.site_required, self.site_index, mats)
+            self.materials_received = self.model.make_state_views(self.model.site_received, self.site_index)
+            self.materials_request = self.model.make_state_views(self.model.site_request, self.site_index)
+            return
         self.materials_required = {
             strucType: {
                 mat: 0 for mat in [mat for mat in self.model.materials_list if mat != 'modules']
@@ -62,22 +181,22 @@ class ConstructionSite(Agent):
         }
 
     def calc_materials_required(self): 
-        '''calculate materials required based on modularity_type
-        self.materials_required = {'foundation': {'timber': 123, ...}, ... }'''        
-        b = self.material_composition_df
-        if self.model.modularity_type == 'none':
-            strucTypes = ['foundation', 'structural', 'non-structural']
-        else: 
-            strucTypes = ['foundation', 'structural']
-        
-        for strucType, mat_amounts in self.materials_required.items():
-            for mat, amounts in mat_amounts.items(): 
-                b1 = b[(b.material == mat) & (b.structural_type == strucType)].iloc[0]
-                self.materials_required[strucType][mat] += b1.tons
+        '''materials required by the building type (see Model.site_composition), plus modules 
+        as non-structural elements if modularity_type is not 'none'. With array_state, the other 
+        materials are filled in for all sites at once by Model.create_constructionSites() 
+        self.materials_required = {'foundation': {'timber': 123, ...}, ... }'''
+        mat_ids = self.model.mat_ids
+        if not self.model.array_state: 
+            for strucType_id, mat_amounts in enumerate(self.materials_required.values()): 
+                for mat in mat_amounts: 
+                    mat_amounts[mat] += self.composition[strucType_id, mat_ids[mat]]
         if self.model.modularity_type != 'none': 
-            self.materials_required['non-structural']['modules'] = b[(b.material == 'modules')].iloc[0].tons                              
+            self.materials_required['non-structural']['modules'] = \
+                self.composition[self.model.strucTypes.index('non-structural'), mat_ids['modules']]
                 
     def step(self): 
+        if self.model.array_state: # all sites request at once, see Model.request_materials_sites()
+            return
         self.check_materials_toRequest()
         self.request_materials()
     
@@ -97,17 +216,24 @@ class ConstructionSite(Agent):
         '''make materials_request that will be received by supplier / macro / micro hub'''
         material_request = {key: dict.fromkeys(self.model.materials_list, 0) for key in 
                             list(self.materials_required.keys())} 
-        for strucType in self.materials_required.keys(): 
+        shares = self.draw_request_shares()
+        for strucType_id, strucType in enumerate(self.materials_required.keys()): 
             for mat in self.materials_toRequest_list:
                 if mat == 'modules' and strucType != 'non-structural': 
                     continue
                 mat_required = self.materials_required[strucType][mat]
                 mat_received = self.materials_received[strucType][mat] 
                 mat_stillNeeded = mat_required - mat_received
-                mat_request = mat_required * random.uniform(0.1, 0.2)
+                mat_request = mat_required * shares[strucType_id, self.model.mat_ids[mat]]
                 mat_request = mat_request if mat_request < mat_stillNeeded else mat_stillNeeded
                 material_request[strucType][mat] += mat_request
         self.materials_request = material_request
+    
+    def draw_request_shares(self): 
+        '''uniform(0.1, 0.2) share of the amount required for every (strucType, material), drawn as 
+        one block per step from the site's own stream, so requests do not depend on the order in which 
+        materials are visited and the array path (Model.request_materials_sites) draws the same numbers'''
+        return self.rng.uniform(0.1, 0.2, size=(len(self.model.strucTypes), len(self.model.materials_list)))
         
 class Hub(Agent):
     def __init__(self, unique_id, model, hubType, coords, inA10, waterbound):
@@ -116,12 +242,17 @@ class Hub(Agent):
         self.coords = coords
         self.inA10 = inA10 # True of False
         self.waterbound = waterbound # True of False
+        self.hub_index = len(self.model.hubs) # row in the model's hub arrays
+        self.rng = self.model.make_rng('Hub', unique_id) # draws demolition sites
+        self.done = False # True once all clients are done, see Model.run_until_complete()
         self.nearestMacroHub_id = None
         self.nearestMacroHub_dist = None
         
         self.materials_toSend = {}
         self.nTrips = {}
         self.materials_request = {}
+        if self.model.array_state: 
+            self.materials_request = self.model.make_state_views(self.model.hub_request, self.hub_index)
         self.materials_received = dict.fromkeys(self.model.materials_list, 0)
         
         self.suppliers = {}
@@ -129,15 +260,18 @@ class Hub(Agent):
         self.trucks_toSite = []
         self.vehicles_toSupplier = []
         self.demolition_site_ids = []
+        self.demSite_arrays = None
         self.supplier_ids = []
         self.client_ids = []
                                 
     def step(self):
-        self.find_clients()
-        if self.clients: # if hub has clients: 
-            self.calc_materials_toSend() # to each site / microHub
-            self.make_materials_request() # for suppliers / demSites / macroHubs 
-            self.triage_materials_request()
+        if self.clients: # if hub has clients (see find_clients): 
+            if self.model.array_state: 
+                self.aggregate_materials_request()
+            else: 
+                self.calc_materials_toSend() # to each site / microHub
+                self.make_materials_request() # for suppliers / demSites / macroHubs 
+                self.triage_materials_request()
             
             if self.model.circularity_type != 'none' and self.hubType == 'macro': 
                 self.convertNames_matRequest_forDemolitionSites()
@@ -149,7 +283,9 @@ class Hub(Agent):
             self.send_materials_toClient() # send materials to site / microhub
         
     def find_clients(self): 
-        '''self.clients = {id: {'agent': agentObject, 'distance': 14312}, ... etc}'''
+        '''clients only change when hubs are assigned, so this is run by the model after 
+        assign_hubs_to_sites() and assign_hubs_to_hubs() rather than every step 
+        self.clients = {id: {'agent': agentObject, 'distance': 14312}, ... etc}'''
         
         self.clients = {}
         
@@ -173,6 +309,14 @@ class Hub(Agent):
             clients = [site for site in sites if site.nearestMacroHub_id == self.unique_id]
             for client in clients: 
                 self.clients[client.unique_id] = {'agent': client, 'distance': client.nearestMacroHub_dist}    
+        
+        # rows of the clients in the model's site / hub arrays, see aggregate_materials_request()
+        sites = [c['agent'] for c in self.clients.values() if type(c['agent']) is ConstructionSite]
+        hubs = [c['agent'] for c in self.clients.values() if type(c['agent']) is Hub]
+        self.client_site_idx = np.array([site.site_index for site in sites], dtype=int)
+        self.client_site_ids = np.array([site.unique_id for site in sites], dtype=int)
+        self.client_hub_idx = np.array([hub.hub_index for hub in hubs], dtype=int)
+        self.client_hub_ids = np.array([hub.unique_id for hub in hubs], dtype=int)
                         
     def calc_materials_toSend(self): 
         '''check which clients still need materials and make materials_toSend dictionary
@@ -199,11 +343,8 @@ class Hub(Agent):
                     material_request[strucType][mat] += amount 
         self.materials_request = material_request
                 
-    def triage_materials_request(self):
-        '''separate self.materials_request into two parts, 
-        one for demolition sites and one for suppliers'''
-        
-        # pick strucType for demSite and suppliers 
+    def get_strucTypes_triaged(self): 
+        '''strucTypes collected from demolition sites and from suppliers, based on model params'''
         strucTypes_forCircParam_dict = {
             'none': [], 
             'semi': ['non-structural'], 
@@ -215,6 +356,14 @@ class Hub(Agent):
         strucTypes_suppliers = [i for i in strucTypes_all if i not in strucTypes_demSites]
         if self.model.modularity_type == 'full': 
             strucTypes_suppliers = strucTypes_suppliers + ['non-structural']
+        return strucTypes_demSites, strucTypes_suppliers
+    
+    def triage_materials_request(self):
+        '''separate self.materials_request into two parts, 
+        one for demolition sites and one for suppliers'''
+        
+        # pick strucType for demSite and suppliers 
+        strucTypes_demSites, strucTypes_suppliers = self.get_strucTypes_triaged()
         
         # make separate materials_requests for demSites and suppliers
         def make_matRequest_triaged(strucTypes): 
@@ -228,6 +377,33 @@ class Hub(Agent):
         
         self.materials_request_forDemSites = make_matRequest_triaged(strucTypes_demSites)
         self.materials_request_forSuppliers = make_matRequest_triaged(strucTypes_suppliers)
+    
+    def aggregate_materials_request(self): 
+        '''calc_materials_toSend(), make_materials_request() and triage_materials_request() for 
+        models with array_state: the requests of all clients are summed over the model's site and 
+        hub request arrays, and triaged with weights over the strucType axis'''
+        site_requests = self.model.site_request[self.client_site_idx]
+        hub_requests = self.model.hub_request[self.client_hub_idx]
+        
+        # clients requesting any material 
+        site_active = site_requests.sum(axis=(1, 2)) > 0
+        hub_active = hub_requests.sum(axis=(1, 2)) > 0
+        active_ids = set(self.client_site_ids[site_active].tolist() + self.client_hub_ids[hub_active].tolist())
+        self.materials_toSend = {client_id: self.clients[client_id]['agent'].materials_request 
+                                 for client_id in self.clients if client_id in active_ids}
+        
+        request = site_requests[site_active].sum(axis=0) + hub_requests[hub_active].sum(axis=0)
+        self.model.hub_request[self.hub_index] = request
+        
+        def make_matRequest_triaged(strucTypes): 
+            # a strucType listed twice is counted twice, as in triage_materials_request()
+            weights = np.array([strucTypes.count(strucType) for strucType in self.model.strucTypes])
+            amounts = weights @ request
+            return {mat: amounts[i] for mat, i in self.model.mat_ids.items() if amounts[i] != 0}
+        
+        strucTypes_demSites, strucTypes_suppliers = self.get_strucTypes_triaged()
+        self.materials_request_forDemSites = make_matRequest_triaged(strucTypes_demSites)
+        self.materials_request_forSuppliers = make_matRequest_triaged(strucTypes_suppliers)
         
     def convertNames_matRequest_forDemolitionSites(self): 
         '''convert mat names in materials_request_forDemSites to match mat names in demolition_sites_df'''
@@ -258,57 +434,61 @@ class Hub(Agent):
                 vehicle_type = self.model.truck_type 
         
         # select vehicle 
-        vehicles_df = self.model.vehicles_info_demSites
-        vehicle = vehicles_df[(vehicles_df.region == 'urban') & 
-                              (vehicles_df.transportation_network == transportation_network) & 
-                              (vehicles_df.vehicle_type == vehicle_type)].iloc[0]
+        vehicle = self.model.get_vehicle('urban', transportation_network, vehicle_type, demSites=True)
         return vehicle # need this for self.collect_materials_fromDemolitionSites() 
                                
+    def make_demSite_arrays(self): 
+        '''group the demolition sites assigned to this macro hub into arrays, 
+        so that materials can be collected in batches (see collect_materials_fromDemolitionSites)
+        self.demSite_arrays = {'unique_id': array, 'distance': array, 'stocks': {'timber': array, ... }, ... }'''
+        df = self.model.demolition_sites_df
+        df = df[df.nearestMacroHub_id == self.unique_id]
+        vehicles = [self._get_vehicle_forDemSite(demSite) for demSite in df.itertuples()]
+        mats = [mat for mat in self.model.materialNames_conversion.name_from_demSiteData.unique() 
+                if mat in df.columns]
+        self.demSite_arrays = {
+            'unique_id': df.unique_id.to_numpy(dtype=int), 
+            'distance': df.nearestMacroHub_dist.to_numpy(dtype=float), 
+            'stocks': {mat: np.nan_to_num(df[mat].to_numpy(dtype=float)) for mat in mats}, 
+            'capacity': {mat: np.array([v.capacity(mat) * 0.8 for v in vehicles]) for mat in mats}, 
+            'vehicle_weight': np.array([v.vehicle_weight for v in vehicles], dtype=float), 
+            'emissions_perTonKm': np.array([v.emissions_perTonKm for v in vehicles], dtype=float), 
+            'pollutants_perKm': np.array([v.pollutants_perKm for v in vehicles], dtype=float).reshape(-1, len(pollutants)), 
+            'nAxels': np.array([v.nAxels for v in vehicles], dtype=float), 
+            'road': np.array([v.transportation_network == 'road' for v in vehicles], dtype=bool), 
+        }
+    
     def collect_materials_fromDemolitionSites(self): 
         '''collect materials from randomly selected demolition sites'''
-        materials_collected = {key: 0 for key in self.materials_request_forDemSites.keys()}
+        if self.demSite_arrays is None: 
+            self.make_demSite_arrays()
+        d = self.demSite_arrays
+        
         for mat, request_amount in self.materials_request_forDemSites.items(): 
-            if mat not in self.model.demolition_sites_df.columns: 
+            if mat not in d['stocks']: 
                 continue
-            while True: 
-                # randomly select demolition site and see what's available
-                demSites = self.model.demolition_sites_df
-                demSites = demSites[demSites.nearestMacroHub_id == self.unique_id]
-                demSite = demSites.sample(1).iloc[0]
-                available_tons = demSite[mat] 
-
-                # collect what's still needed 
-                still_needed = request_amount - materials_collected[mat]
-                collect_tons = still_needed if available_tons >= still_needed else available_tons
-
-                # record emissions and demolition site ids
-                vehicle = self._get_vehicle_forDemSite(demSite)
-                capacity = vehicle[f'capacity_{mat}'] * 0.8
-                distance = demSite.nearestMacroHub_dist
-                nTrips = math.ceil(collect_tons / capacity)
-                emissions_perTonKm = vehicle.emissions_perTonKm
-                emissions_perKm = emissions_perTonKm * (vehicle.vehicle_weight + collect_tons)
-                emissions = emissions_perKm * distance * nTrips * 2
-                self.model.emissions_s2h += emissions
-                self.demolition_site_ids.append(demSite.unique_id)
-
-                if vehicle.transportation_network == 'road': 
-                    # record roads used
-                    roadMatrix = self.model.road_matrix_d2h
-                    road_ids = roadMatrix[(roadMatrix[:, 1] == self.unique_id) & (roadMatrix[:, 0] == demSite.unique_id)][0][2]
-                    mask = self.model.roads_used['osmid'].isin(road_ids)
-                    self.model.roads_used.loc[mask, 'nTrips'] += nTrips
-
-                    # record road damage
-                    nAxels = vehicle.nAxels
-                    weight = capacity / nAxels 
-                    damage = (weight ** 4) * nTrips 
-                    self.model.roads_used.loc[mask, 'damage'] += damage
-                               
-                # stop if enough materials have been collected 
-                materials_collected[mat] += collect_tons
-                if materials_collected[mat] >= request_amount: 
-                    break
+            # randomly select demolition sites and collect what's still needed 
+            sites, collect_tons = draw_demolition_sites(d['stocks'][mat], request_amount, self.rng)
+            
+            # record emissions and demolition site ids
+            capacity = d['capacity'][mat][sites]
+            nTrips = np.ceil(collect_tons / capacity)
+            pollutants_perKm = trip_pollutants(d['pollutants_perKm'][sites], d['emissions_perTonKm'][sites], 
+                                               d['vehicle_weight'][sites], collect_tons, nTrips * 2)
+            self.model.pollutants_s2h += (pollutants_perKm * d['distance'][sites, None]).sum(axis=0)
+            self.demolition_site_ids.extend(d['unique_id'][sites].tolist())
+            
+            # record roads used and road damage, summed per demolition site 
+            road = d['road'][sites]
+            weight = capacity / d['nAxels'][sites]
+            damage = (weight ** 4) * nTrips 
+            nTrips_perSite = np.bincount(sites[road], weights=nTrips[road], minlength=len(d['unique_id']))
+            damage_perSite = np.bincount(sites[road], weights=damage[road], minlength=len(d['unique_id']))
+            pollutants_perSite = np.zeros((len(d['unique_id']), len(pollutants)))
+            np.add.at(pollutants_perSite, sites[road], pollutants_perKm[road])
+            for i in np.flatnonzero(nTrips_perSite): 
+                route = self.model.route_index_d2h[(d['unique_id'][i], self.unique_id)]
+                self.model.record_road_usage(route, int(nTrips_perSite[i]), damage_perSite[i], pollutants_perSite[i])
 
     def find_suppliers(self): 
         '''this function is only run by macro hubs - see Hub.step()
@@ -317,16 +497,31 @@ class Hub(Agent):
         self.suppliers = {'timber': {'agent': agentObject, 'distance': 14312}, ... etc}'''
                
         self.suppliers = {}
-        mat_info = self.model.materials_logistics_info
         
         for mat in self.materials_request_forSuppliers.keys():
             self.suppliers[mat] = {}
-            location_type = mat_info[mat_info.material == mat].iloc[0].supplier_type
-            supplier = [s for s in self.model.suppliers if s.location_type == location_type][0]
+            supplier = self._get_supplier(mat)
             
             self.suppliers[mat]['agent'] = supplier 
             self.suppliers[mat]['distance'] = supplier.distance_fromAms
                         
+    def _get_vehicle_forSupplier(self): 
+        '''vehicle bringing materials from suppliers to this macro hub, and whether it uses the road network'''
+        vehicle = self.model.get_vehicle('international', self.model.network_type)
+        road = self.model.network_type == 'road'
+        # modify info based on water conditions 
+        # if macro hub is not water bound, materials will be delivered from supplier by truck
+        if self.model.network_type == 'water' and not self.waterbound: 
+            vehicle = self.model.get_vehicle('international', 'road')
+            road = True
+        return vehicle, road
+    
+    def _get_supplier(self, mat): 
+        '''supplier agent for a material, based on its location type (national / international)'''
+        mat_info = self.model.materials_logistics_info
+        location_type = mat_info[mat_info.material == mat].iloc[0].supplier_type
+        return [s for s in self.model.suppliers if s.location_type == location_type][0]
+    
     def collect_materials_fromSupplier(self): 
         '''this function is only run by macro hubs - see Hub.step()
         collect materials from factory supplier (national / international)'''
@@ -336,40 +531,31 @@ class Hub(Agent):
             # get info for calculating emissions and road usage 
             supplier = self.suppliers[mat]['agent']
             distance = self.suppliers[mat]['distance']
-            vehicles_df = self.model.vehicles_info
-            vehicle = vehicles_df[(vehicles_df.region == 'international') & 
-                                  (vehicles_df.transportation_network == self.model.network_type)].iloc[0]
-            capacity = vehicle[f'capacity_{mat}']
-            emissions_perTonKm = vehicle['emissions_perTonKm']
-            
-            # modify info based on water conditions 
-            # if macro hub is not water bound, materials will be delivered from supplier by truck
-            if self.model.network_type == 'water' and not self.waterbound: 
-                vehicle = vehicles_df[(vehicles_df.region == 'international') & 
-                                      (vehicles_df.transportation_network == 'road')].iloc[0]
-                capacity = vehicle[f'capacity_{mat}']
-                emissions_perTonKm = vehicle['emissions_perTonKm']
+            vehicle, road = self._get_vehicle_forSupplier()
+            capacity = vehicle.capacity(mat)
             nTrips = math.ceil(amount / capacity)
+            pollutants_perKm = vehicle.trip_pollutants(amount, nTrips * 2)
 
             # record road usage road network is used  
-            if self.model.network_type == 'road' or (self.model.network_type == 'water' and not self.waterbound): 
-                roadMatrix = self.model.road_matrix_s2h
-                road_ids = roadMatrix[(roadMatrix[:, 0] == supplier.unique_id) & (roadMatrix[:, 1] == self.unique_id)][0][2]
-                mask = self.model.roads_used['osmid'].isin(road_ids)
-                self.model.roads_used.loc[mask, 'nTrips'] += nTrips
+            if road: 
+                route = self.model.route_index_s2h[(supplier.unique_id, self.unique_id)]
                 
                 # record road damage
-                nAxels = vehicle['nAxels']
+                nAxels = vehicle.nAxels
                 weight = capacity / nAxels 
                 damage = (weight ** 4) * nTrips 
-                self.model.roads_used.loc[mask, 'damage'] += damage
+                self.model.record_road_usage(route, nTrips, damage, pollutants_perKm)
 
             # record emissions, materials received, and suppliers used 
-            emissions_perKm = emissions_perTonKm * (vehicle.vehicle_weight + amount)
-            self.model.emissions_s2h += emissions_perKm * distance * nTrips * 2
+            self.model.pollutants_s2h += pollutants_perKm * distance
             self.materials_received[mat] += amount
             self.supplier_ids.append(supplier.unique_id)
+            self.model.record_flow(supplier.unique_id, self.unique_id, amount, nTrips)
         
+    def _get_vehicle_forClient(self, client): 
+        '''vehicle bringing materials from this hub to a client (construction site or micro hub)'''
+        return get_vehicle_forClient(self.model, self.inA10, self.waterbound, client.inA10, client.waterbound)
+    
     def send_materials_toClient(self): 
         '''send materials to client (either construction sites or micro hubs) 
         self.materials_toSend = {site_id: {'foundation': {'timber': 123, ... }, ... }, ... }'''
@@ -382,37 +568,21 @@ class Hub(Agent):
             distance = self.clients[client_id]['distance']
             
             # get vehicle based on params 
-            region = 'urban'
-            if self.model.network_type == 'water' and self.waterbound and client.waterbound: 
-                transportation_network = 'water'
-                vehicle_type = 'water'
-            else: # road network is used: 
-                transportation_network = 'road'
-                if self.model.truck_type == 'semi': 
-                    vehicle_type = 'electric' if client.inA10 or self.inA10 else 'diesel'
-                else: 
-                    vehicle_type = self.model.truck_type 
-                    
-            # get vehicle info
-            vehicles_df = self.model.vehicles_info
-            vehicle = vehicles_df[(vehicles_df.transportation_network == transportation_network) & 
-                                  (vehicles_df.vehicle_type == vehicle_type)].iloc[0]
+            vehicle = self._get_vehicle_forClient(client)
+            transportation_network = vehicle.transportation_network
             
             # determine roads used
-            roadMatrix = self.model.road_matrix_h2hc
-            road_ids = roadMatrix[(roadMatrix[:, 0] == self.unique_id) & (roadMatrix[:, 1] == client.unique_id)][0][2]
-            road_ids_str = [','.join(map(str, r)) if isinstance(r, list) else str(r) for r in road_ids]
-            mask = self.model.roads_used['osmid'].isin(road_ids_str)
+            route = self.model.route_index_h2hc[(self.unique_id, client.unique_id)]
 
             for strucType, mat_amounts in mat_toSend_dict.items(): 
                 for mat, amount in mat_amounts.items(): 
                     
                     # record emissions 
-                    capacity = vehicle[f'capacity_{mat}']
+                    capacity = vehicle.capacity(mat)
                     nTrips = math.ceil(amount / capacity)
-                    emissions_perKm = vehicle.emissions_perTonKm * (vehicle.vehicle_weight + amount)
-                    emissions = emissions_perKm * distance * nTrips * 2
-                    self.model.emissions_h2c += emissions
+                    pollutants_perKm = vehicle.trip_pollutants(amount, nTrips * 2)
+                    self.model.pollutants_h2c += pollutants_perKm * distance
+                    self.model.record_flow(self.unique_id, client_id, amount, nTrips)
                     
                     if transportation_network == 'road': 
                         # record roads used, road damage
@@ -422,8 +592,7 @@ class Hub(Agent):
                         if self.model.network_type == 'water': 
                             if self.waterbound and client.waterbound: 
                                 damage = 0
-                        self.model.roads_used.loc[mask, 'damage'] += damage
-                        self.model.roads_used.loc[mask, 'nTrips'] += nTrips
+                        self.model.record_road_usage(route, nTrips, damage, pollutants_perKm)
                     
                     # record  materials received, client ids 
                     if type(client) is ConstructionSite: 
@@ -477,62 +646,738 @@ class Supplier(Agent):
                         self.materials_toSend[client.unique_id][strucType][mat] = amount
 
     def send_materials_toClient(self): 
-        vehicles_df = self.model.vehicles_info
-        vehicle = vehicles_df[(vehicles_df.region == 'international') & 
-                              (vehicles_df.transportation_network == self.model.network_type)].iloc[0]
-        emissions_perTonKm = vehicle.emissions_perTonKm
+        vehicle = self.model.get_vehicle('international', self.model.network_type)
 
+        clients = {c.unique_id: c for c in self.clients}
         for client_id, mat_toSend_dict in self.materials_toSend.items(): 
-            client = [c for c in self.clients if c.unique_id == client_id][0]
+            client = clients[client_id]
             distance = self.distance_fromAms
             for strucType, mat_amounts in mat_toSend_dict.items(): 
                 for mat, amount in mat_amounts.items(): 
                     # record emissions
                     # assuming that trucks from supplier to constructure site is 30% loaded
-                    capacity = vehicle[f'capacity_{mat}'] * 0.3 
+                    capacity = vehicle.capacity(mat) * 0.3 
                     nTrips = math.ceil(amount / capacity)
-                    emissions_perKm = emissions_perTonKm * (vehicle.vehicle_weight + amount)
-                    emissions = emissions_perKm * distance * nTrips * 2
-                    self.model.emissions_s2h += emissions
+                    pollutants_perKm = vehicle.trip_pollutants(amount, nTrips * 2)
+                    self.model.pollutants_s2h += pollutants_perKm * distance
+                    self.model.record_flow(self.unique_id, client_id, amount, nTrips)
                     client.materials_received[strucType][mat] += amount
 
-                    # record roads used 
-                    roadMatrix = self.model.road_matrix_s2c
-                    road_ids = roadMatrix[(roadMatrix[:, 0] == self.unique_id) & 
-                                          (roadMatrix[:, 1] == client_id)][0][2]
-                    roads_gdf = self.model.roads_used
-                    mask = roads_gdf['osmid'].isin(road_ids)
-                    roads_gdf.loc[mask, 'nTrips'] += nTrips
-                    self.model.roads_used = roads_gdf
-                    
-                    # record road damage
+                    # record roads used and road damage
+                    route = self.model.route_index_s2c[(self.unique_id, client_id)]
                     nAxels = vehicle.nAxels
                     weight = capacity / nAxels 
                     damage = (weight ** 4) * nTrips 
-                    self.model.roads_used.loc[mask, 'damage'] += damage
+                    self.model.record_road_usage(route, nTrips, damage, pollutants_perKm)
 
 
 from mesa import Model
 from mesa.datacollection import DataCollector
+class DataCache: 
+    '''binary cache of input files in {data_path}/.cache: GeoParquet for shapefiles, Parquet for 
+    csvs and non-pickled npz for road matrices. A cached copy is used as long as its source files 
+    are unchanged (same mtime, or same sha1 hash when only the mtime changed). Writing the cache is 
+    skipped when it is not possible (e.g. pyarrow is not installed or the folder is read-only).'''
+    def __init__(self, data_path): 
+        self.cache_path = os.path.join(data_path, '.cache')
+    
+    def read_file(self, source): 
+        return self.load(source, gpd.read_file, gpd.read_parquet, 
+                         lambda gdf, file: gdf.to_parquet(file), '.parquet')
+    
+    def read_csv(self, source): 
+        return self.load(source, pd.read_csv, pd.read_parquet, 
+                         lambda df, file: df.to_parquet(file), '.parquet')
+    
+    def load_road_matrix(self, source): 
+        return self.load(source, lambda file: np.load(file, allow_pickle=True), 
+                         self.read_road_matrix, self.write_road_matrix, '.npz')
+    
+    def load(self, source, read_source, read_cache, write_cache, suffix): 
+        '''return the cached copy of source if it is up to date, otherwise read source and cache it'''
+        cache_file = os.path.join(self.cache_path, os.path.basename(source) + suffix)
+        meta_file = cache_file + '.json'
+        sources = self.source_files(source)
+        mtimes = {os.path.basename(f): os.stat(f).st_mtime_ns for f in sources}
+        
+        if os.path.exists(cache_file) and os.path.exists(meta_file): 
+            with open(meta_file) as f: 
+                meta = json.load(f)
+            fresh = meta['mtimes'] == mtimes
+            if not fresh and meta['sha1'] == self.hash_files(sources): # touched, but not changed
+                fresh = True
+                self.write_meta(meta_file, mtimes, meta['sha1'])
+            if fresh: 
+                try: 
+                    return read_cache(cache_file)
+                except (ImportError, OSError, ValueError): 
+                    pass # unreadable cache, fall back to the source file
+        
+        data = read_source(source)
+        try: 
+            os.makedirs(self.cache_path, exist_ok=True)
+            write_cache(data, cache_file)
+            self.write_meta(meta_file, mtimes, self.hash_files(sources))
+        except (ImportError, OSError, ValueError): 
+            pass # caching is optional
+        return data
+    
+    def source_files(self, source): 
+        '''source file, plus its sidecar files (.dbf, .shx, .prj ...) for shapefiles'''
+        stem, ext = os.path.splitext(source)
+        if ext == '.shp': 
+            return sorted(glob.glob(glob.escape(stem) + '.*'))
+        return [source]
+    
+    def hash_files(self, files): 
+        sha1 = hashlib.sha1()
+        for file in files: 
+            with open(file, 'rb') as f: 
+                sha1.update(f.read())
+        return sha1.hexdigest()
+    
+    def write_meta(self, meta_file, mtimes, sha1): 
+        with open(meta_file, 'w') as f: 
+            json.dump({'mtimes': mtimes, 'sha1': sha1}, f)
+    
+    def write_road_matrix(self, roadMatrix, file): 
+        '''store rows of [origin_id, destination_id, [osmid, osmid, ...]] as flat arrays'''
+        road_ids = [[','.join(map(str, r)) if isinstance(r, list) else str(r) for r in row[2]] for row in roadMatrix]
+        np.savez(file, 
+                 origin=roadMatrix[:, 0].astype(np.int64), 
+                 destination=roadMatrix[:, 1].astype(np.int64), 
+                 lengths=np.array([len(r) for r in road_ids], dtype=np.int64), 
+                 road_ids=np.array([r for route in road_ids for r in route], dtype=str))
+    
+    def read_road_matrix(self, file): 
+        with np.load(file, allow_pickle=False) as f: 
+            road_ids = f['road_ids'].tolist()
+            offsets = np.concatenate(([0], np.cumsum(f['lengths']))).tolist()
+            roadMatrix = np.empty((len(f['origin']), 3), dtype=object)
+            roadMatrix[:, 0] = f['origin'].tolist()
+            roadMatrix[:, 1] = f['destination'].tolist()
+            for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])): 
+                roadMatrix[i, 2] = road_ids[start:end]
+        return roadMatrix
+
+class RoadUsageLog: 
+    '''time-resolved road counters, logged as trips are recorded (see Model.record_road_usage): in step i 
+    (0 = first model step), the roads_gdf rows edges[indptr[i]:indptr[i + 1]] (each once, ascending) got 
+    nTrips[...] trips and damage[...] added. Steps are kept as int32 edges and trips and float32 damage, 
+    so the log of a step is smaller than a snapshot of the roads it loaded; cumulative counters of any 
+    step are rebuilt on demand with cumulative(step), to float32 precision for damage'''
+    def __init__(self, n_roads): 
+        self.n_roads = n_roads
+        self.indptr = [0]
+        self.chunks = [] # (edges int32, nTrips int32, damage float32) per step
+        self.current = [] # (route, nTrips, damage) recorded in the current step
+        self._arrays = None
+    
+    def __len__(self): 
+        return len(self.chunks)
+    
+    def record(self, route, nTrips, damage): 
+        '''log trips and damage added to every road of a route (scalars, or arrays aligned with route); 
+        roads getting no trips are left out'''
+        if np.ndim(nTrips) == 0: 
+            if nTrips and len(route): 
+                self.current.append((route, nTrips, damage))
+            return
+        keep = np.asarray(nTrips) != 0
+        if keep.any(): 
+            self.current.append((route[keep], np.asarray(nTrips)[keep], np.broadcast_to(damage, keep.shape)[keep]))
+    
+    def end_step(self): 
+        '''store the trips recorded since the previous step as the changes of one step, summed per road'''
+        edges, nTrips, damage = [np.zeros(0, np.int32)], [np.zeros(0, np.int64)], [np.zeros(0)]
+        for route, route_nTrips, route_damage in self.current: 
+            edges.append(route)
+            nTrips.append(np.broadcast_to(route_nTrips, route.shape))
+            damage.append(np.broadcast_to(route_damage, route.shape))
+        edges, inverse = np.unique(np.concatenate(edges), return_inverse=True)
+        self.chunks.append((edges.astype(np.int32), 
+                            np.bincount(inverse, weights=np.concatenate(nTrips), minlength=len(edges)).astype(np.int32), 
+                            np.bincount(inverse, weights=np.concatenate(damage), minlength=len(edges)).astype(np.float32)))
+        self.indptr.append(self.indptr[-1] + len(edges))
+        self.current = []
+        self._arrays = None
+    
+    @property
+    def arrays(self): 
+        '''edges, nTrips, damage of all steps as flat arrays (concatenated once per recorded step)'''
+        if self._arrays is None: 
+            if self.chunks: 
+                self._arrays = tuple(np.concatenate(arrays) for arrays in zip(*self.chunks))
+            else: 
+                self._arrays = (np.zeros(0, np.int32), np.zeros(0, np.int32), np.zeros(0, np.float32))
+        return self._arrays
+    
+    def step_changes(self, step): 
+        '''edges, nTrips, damage added during one step'''
+        return self.chunks[step]
+    
+    def cumulative(self, step=None): 
+        '''roads_nTrips, roads_damage after a step (default: the last recorded step)'''
+        step = len(self.chunks) - 1 if step is None else step
+        end = self.indptr[step + 1]
+        edges, nTrips, damage = (array[:end] for array in self.arrays)
+        return (np.bincount(edges, weights=nTrips, minlength=self.n_roads).astype(np.int64), 
+                np.bincount(edges, weights=damage, minlength=self.n_roads))
+    
+    @property
+    def nbytes(self): 
+        return sum(array.nbytes for chunk in self.chunks for array in chunk)
+
+class RoadZones: 
+    '''share of every road edge's length inside each zone, kept as a sparse edge x zone matrix 
+    (edges, zone_ids, weights as COO arrays), so zone totals of any per-edge quantity are one 
+    sparse product: totals = road_zones.aggregate(values). Zone membership is found once per zone 
+    with the roads' spatial index. Lengths are measured in EPSG:28992 (RD New).'''
+    crs_metric = 'EPSG:28992'
+    
+    def __init__(self, roads_gdf): 
+        self.crs = roads_gdf.crs
+        self.geometry = roads_gdf.geometry.to_crs(self.crs_metric).reset_index(drop=True)
+        self.lengths_km = self.geometry.length.to_numpy() / 1000
+        self.names = []
+        self.edges = np.zeros(0, dtype=np.int32)
+        self.zone_ids = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0)
+    
+    def register(self, name, zone=None): 
+        '''add (or replace) a zone: a GeoDataFrame / GeoSeries (its geometries are merged), 
+        a shapely geometry in the roads' crs, or None for every road'''
+        if name in self.names: 
+            self.remove(name)
+        if zone is None: 
+            edges = np.arange(len(self.geometry))
+            weights = np.ones(len(edges))
+        else: 
+            if isinstance(zone, (gpd.GeoDataFrame, gpd.GeoSeries)): 
+                zone = zone.to_crs(self.crs_metric).union_all()
+            else: 
+                zone = gpd.GeoSeries([zone], crs=self.crs).to_crs(self.crs_metric).iloc[0]
+            edges = self.geometry.sindex.query(zone, predicate='intersects')
+            candidates = self.geometry.iloc[edges]
+            lengths = candidates.length.to_numpy()
+            inside = candidates.intersection(zone).length.to_numpy()
+            weights = np.divide(inside, lengths, out=np.ones(len(edges)), where=lengths > 0)
+        self.names.append(name)
+        self.edges = np.concatenate([self.edges, edges.astype(np.int32)])
+        self.zone_ids = np.concatenate([self.zone_ids, np.full(len(edges), len(self.names) - 1, dtype=np.int32)])
+        self.weights = np.concatenate([self.weights, weights])
+    
+    def copy(self): 
+        '''zones that can be registered / removed without changing these ones. The road geometries are 
+        shared, the zone arrays are never changed in place'''
+        zones = copy.copy(self)
+        zones.names = list(self.names)
+        return zones
+    
+    def remove(self, name): 
+        z = self.names.index(name)
+        keep = self.zone_ids != z
+        self.edges, self.weights = self.edges[keep], self.weights[keep]
+        self.zone_ids = self.zone_ids[keep] - (self.zone_ids[keep] > z)
+        self.names.remove(name)
+    
+    def aggregate(self, values): 
+        '''zone totals of per-edge values (n_roads, ...) weighted by the share of each edge inside the zone, 
+        returns (n_zones, ...)'''
+        values = np.asarray(values, dtype=float)
+        weights = self.weights.reshape((-1,) + (1,) * (values.ndim - 1))
+        totals = np.zeros((len(self.names),) + values.shape[1:])
+        np.add.at(totals, self.zone_ids, weights * values[self.edges])
+        return totals
+
+class RouteStore: 
+    '''road routes between (origin, destination) pairs in CSR form: the route of the i-th pair 
+    in keys is the roads_gdf rows indices[indptr[i]:indptr[i + 1]]. Stored as plain .npy files 
+    (roadRoutes_{name}_keys/indptr/indices.npy) that are memory mapped, so processes share one copy. 
+    route = routes[(origin_id, destination_id)]'''
+    names = ['h2hc', 'd2h', 's2h', 's2c']
+    
+    def __init__(self, keys, indptr, indices, unrouted=False): 
+        self.keys = keys # (n_routes, 2) origin_id, destination_id
+        self.indptr = indptr
+        self.indices = indices
+        self.positions = {(origin, destination): i for i, (origin, destination) in enumerate(keys.tolist())}
+        self.unrouted = unrouted # pairs without a route get an empty route instead of a KeyError
+    
+    def __getitem__(self, key): 
+        if self.unrouted and key not in self.positions: 
+            return self.indices[:0]
+        i = self.positions[key]
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+    
+    @classmethod
+    def empty(cls): 
+        '''routes for od pairs that have no road routes (every route is empty)'''
+        return cls(np.zeros((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64), 
+                   np.zeros(0, dtype=np.int32), unrouted=True)
+    
+    def __len__(self): 
+        return len(self.keys)
+    
+    def renamed(self, origin_ids, destination_ids): 
+        '''routes of the pairs whose origin is in origin_ids = {old_id: new_id} and destination in 
+        destination_ids, under their new ids. Other pairs get an empty route'''
+        keys = self.keys.tolist()
+        rows = [i for i, (origin, destination) in enumerate(keys) 
+                if origin in origin_ids and destination in destination_ids]
+        new_keys = np.array([[origin_ids[keys[i][0]], destination_ids[keys[i][1]]] for i in rows], 
+                            dtype=np.int64).reshape(-1, 2)
+        lengths = np.diff(self.indptr)[rows]
+        indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        indices = np.concatenate([np.zeros(0, dtype=np.int32)] + 
+                                 [self.indices[self.indptr[i]:self.indptr[i + 1]] for i in rows])
+        return RouteStore(new_keys, indptr, indices.astype(np.int32), unrouted=True)
+    
+    @staticmethod
+    def make_osmid_positions(roads_gdf): 
+        '''osmid_positions = {'7046570,1138382963': [12], ... } (row positions in roads_gdf)'''
+        osmid_positions = {}
+        for pos, osmid in enumerate(roads_gdf['osmid']): 
+            osmid_positions.setdefault(str(osmid), []).append(pos)
+        return osmid_positions
+    
+    @classmethod
+    def from_road_matrix(cls, roadMatrix, osmid_positions): 
+        '''build routes from rows of [origin_id, destination_id, [osmid, osmid, ...]] 
+        (nested lists of osmids are joined the way they are stored in roads_gdf)'''
+        if roadMatrix.ndim != 2 or roadMatrix.shape[1] != 3: 
+            raise ValueError('road matrix should have rows of [origin_id, destination_id, road_ids]')
+        keys = roadMatrix[:, :2].astype(np.int64)
+        indptr = np.zeros(len(roadMatrix) + 1, dtype=np.int64)
+        indices = []
+        for i, road_ids in enumerate(roadMatrix[:, 2]): 
+            road_ids_str = {','.join(map(str, r)) if isinstance(r, list) else str(r) for r in road_ids}
+            positions = sorted(pos for r in road_ids_str for pos in osmid_positions.get(r, []))
+            indices.extend(positions)
+            indptr[i + 1] = len(indices)
+        return cls(keys, indptr, np.array(indices, dtype=np.int32))
+    
+    @staticmethod
+    def files(data_path, name): 
+        return {part: f'{data_path}/roadRoutes_{name}_{part}.npy' for part in ['keys', 'indptr', 'indices']}
+    
+    @classmethod
+    def exists(cls, data_path, name): 
+        return all(os.path.exists(file) for file in cls.files(data_path, name).values())
+    
+    @classmethod
+    def load(cls, data_path, name, mmap_mode='r'): 
+        files = cls.files(data_path, name)
+        return cls(*[np.load(files[part], mmap_mode=mmap_mode) for part in ['keys', 'indptr', 'indices']])
+    
+    def save(self, data_path, name): 
+        files = self.files(data_path, name)
+        np.save(files['keys'], self.keys)
+        np.save(files['indptr'], self.indptr)
+        np.save(files['indices'], self.indices)
+
+def convert_road_matrices(data_path='data/data_cleaned'): 
+    '''convert the pickled roadOsmIds_matrix_*.npy files (made in dataPrep.ipynb) into CSR route files, 
+    which ModelData loads instead when they are present. Needs to be run again if ams_roads_edges.shp 
+    or the road matrices change.'''
+    roads_gdf = gpd.read_file(f'{data_path}/ams_roads_edges.shp')
+    osmid_positions = RouteStore.make_osmid_positions(roads_gdf)
+    for name in RouteStore.names: 
+        file = f'{data_path}/roadOsmIds_matrix_{name}.npy'
+        if os.path.exists(file): 
+            roadMatrix = np.load(file, allow_pickle=True)
+            RouteStore.from_road_matrix(roadMatrix, osmid_positions).save(data_path, name)
+
+class ModelData: 
+    '''input data shared by every model run in a process. Shapefiles, csvs, od matrices and 
+    road matrices are loaded, validated and indexed once, and treated as read-only by models, 
+    which only copy what they change (see Model.load_data). 
+    model = Model(parameters_dict, data=ModelData())
+    use_cache = read inputs through the binary cache in {data_path}/.cache (see DataCache)'''
+    def __init__(self, data_path='data/data_cleaned', use_cache=True): 
+        self.data_path = data_path
+        self.use_cache = use_cache
+        self.load_data()
+        self.validate()
+        self.make_composition()
+        self.load_routes()
+        self.load_od_matrices()
+        self.load_zones()
+        
+    def load_data(self): 
+        path = self.data_path
+        if self.use_cache: 
+            cache = DataCache(path)
+            read_file, read_csv = cache.read_file, cache.read_csv
+        else: 
+            read_file, read_csv = gpd.read_file, pd.read_csv
+        self.roads_gdf = read_file(f'{path}/ams_roads_edges.shp')
+        self.construction_sites_df = read_file(f'{path}/construction_sites.shp')
+        self.hubs_df = read_file(f'{path}/hubs.shp')
+        self.suppliers_df = read_file(f'{path}/suppliers.shp')
+        self.demolition_sites_df = read_file(f'{path}/demolition_sites.shp')
+        self.vehicles_info = read_csv(f'{path}/vehicles_info.csv')
+        self.vehicles_info_demSites = read_csv(f'{path}/vehicles_info_demSites.csv')
+        self.build_info = read_csv(f'{path}/buildingType_info.csv')
+        self.materials_logistics_info = read_csv(f'{path}/materials_logistics_info.csv')
+        self.materialNames_conversion = read_csv(f'{path}/materialNames_conversion.csv')
+        self.materials_list = list(self.build_info.material.unique())
+    
+    def validate(self): 
+        '''check that the inputs have the columns the model relies on'''
+        vehicle_columns = ['region', 'transportation_network', 'vehicle_type', 'vehicle_weight', 'emissions_perTonKm', 
+                           'nAxels'] + [column for column in pollutant_columns if column is not None]
+        required_columns = {
+            'roads_gdf': ['osmid', 'geometry'], 
+            'construction_sites_df': ['buildType', 'inA10', 'waterbound', 'geometry'], 
+            'hubs_df': ['hub_type', 'inA10', 'waterbound', 'geometry'], 
+            'suppliers_df': ['material', 'distAms', 'geometry'], 
+            'demolition_sites_df': ['unique_id', 'inA10', 'waterbound', 'geometry'], 
+            'vehicles_info': vehicle_columns, 
+            'vehicles_info_demSites': vehicle_columns, 
+            'build_info': ['material', 'biobased_type', 'structural_type', 'buildingType', 'tons'], 
+            'materials_logistics_info': ['material', 'supplier_type'], 
+            'materialNames_conversion': ['name_from_conSiteData', 'name_from_demSiteData'], 
+        }
+        for name, columns in required_columns.items(): 
+            missing = [col for col in columns if col not in getattr(self, name).columns]
+            if missing: 
+                raise ValueError(f'{name} is missing columns {missing} (data path: {self.data_path})')
+        # a missing emission factor would make the pollutant totals nan for the rest of a run 
+        for name in ['vehicles_info', 'vehicles_info_demSites']: 
+            incomplete = [col for col in vehicle_columns if getattr(self, name)[col].isna().any()]
+            if incomplete: 
+                raise ValueError(f'{name} has missing values in columns {incomplete} (data path: {self.data_path})')
+    
+    def make_composition(self): 
+        '''compile build_info into a tensor of tons per building type, biobased type, structural type and 
+        material: self.composition[buildingType_id, biobased_id, strucType_id, mat_id], indexed like 
+        self.buildingTypes, self.biobased_types, Model.strucTypes and self.materials_list. 
+        Tons are nan where build_info has no tons (the first row counts where a combination repeats)'''
+        b = self.build_info.drop_duplicates(['buildingType', 'biobased_type', 'structural_type', 'material'])
+        self.buildingTypes = list(b.buildingType.unique())
+        self.biobased_types = list(b.biobased_type.unique())
+        axes = [(b.buildingType, self.buildingTypes), (b.biobased_type, self.biobased_types), 
+                (b.structural_type, Model.strucTypes), (b.material, self.materials_list)]
+        ids = np.array([pd.Index(labels).get_indexer(column) for column, labels in axes])
+        known = (ids >= 0).all(axis=0)
+        composition = np.full([len(labels) for column, labels in axes], np.nan)
+        composition[tuple(ids[:, known])] = b.tons.to_numpy(dtype=float)[known]
+        self.composition = self.read_only(composition)
+    
+    def get_composition(self, biobased_type): 
+        '''(n_buildingTypes, n_strucTypes, n_materials) tons of each building type for a biobased type'''
+        if biobased_type not in self.biobased_types: 
+            raise ValueError(f'biobased_type {biobased_type!r} is not in build_info (it has {self.biobased_types})')
+        return self.composition[:, self.biobased_types.index(biobased_type)]
+    
+    def load_routes(self): 
+        '''road routes for every (origin, destination) pair, as RouteStores: 
+        self.route_index_d2h[(demSite_id, hub_id)] = array([12, 57, ...]) (row positions in roads_gdf)
+        The CSR route files made by convert_road_matrices() are memory mapped when present, 
+        otherwise the routes are built from the pickled roadOsmIds_matrix_*.npy files.'''
+        osmid_positions = None
+        for name in RouteStore.names: 
+            if RouteStore.exists(self.data_path, name): 
+                routes = RouteStore.load(self.data_path, name)
+                if routes.indices.size and routes.indices.max() >= len(self.roads_gdf): 
+                    raise ValueError(f'route file {name} does not match ams_roads_edges.shp, '
+                                     'run convert_road_matrices() again')
+            else: 
+                if osmid_positions is None: 
+                    osmid_positions = RouteStore.make_osmid_positions(self.roads_gdf)
+                roadMatrix = self.load_road_matrix(f'{self.data_path}/roadOsmIds_matrix_{name}.npy')
+                routes = RouteStore.from_road_matrix(roadMatrix, osmid_positions)
+            setattr(self, f'route_index_{name}', routes)
+    
+    def load_zones(self): 
+        '''zones the model reports emissions, trips and road damage for (see Model.calc_zone_totals): 
+        MRA = the whole road network, A10 = within the A10 ring road, zuid-oost = Amsterdam Zuid-Oost 
+        with a 500m buffer. More zones can be added with Model.register_zone()'''
+        read_file = DataCache(self.data_path).read_file if self.use_cache else gpd.read_file
+        self.road_zones = RoadZones(self.roads_gdf)
+        self.road_zones.register('MRA')
+        for name, file in [('A10', 'a10.shp'), ('zuid-oost', 'zuidOost_buffer_500m.shp')]: 
+            if os.path.exists(f'{self.data_path}/{file}'): 
+                self.road_zones.register(name, read_file(f'{self.data_path}/{file}'))
+    
+    def map_geometries(self, decimals=5, tolerance=5e-5): 
+        '''road geometries for web maps, as an array aligned with roads_gdf: coordinates rounded to 
+        decimals (5 = about 1 m) and simplified with tolerance (degrees), so they serialize to a fraction 
+        of the GeoJSON of the original geometries. Computed once per ModelData and setting'''
+        if not hasattr(self, '_map_geometries'): 
+            self._map_geometries = {}
+        key = (decimals, tolerance)
+        if key not in self._map_geometries: 
+            geoms = shapely.transform(np.asarray(self.roads_gdf.geometry.values), lambda c: np.round(c, decimals))
+            self._map_geometries[key] = shapely.simplify(geoms, tolerance)
+        return self._map_geometries[key]
+    
+    def load_road_matrix(self, file): 
+        if self.use_cache: 
+            return DataCache(self.data_path).load_road_matrix(file)
+        return np.load(file, allow_pickle=True)
+    
+    def load_od_matrices(self): 
+        '''These od matrices were made in dataPrep.ipynb. The ids correspond to the 
+        agent unique ids in the agent based model. If the input data for construction sites
+        and hubs changes, these od matrices need to change accordingly in dataPrep.ipynb.'''
+        path = self.data_path
+        self.od_matrix_h2c = self.read_only(np.load(f'{path}/od_matrix_h2c.npy'))
+        self.od_matrix_h2h = self.read_only(np.load(f'{path}/od_matrix_h2h.npy'))
+        self.od_matrix_d2h = self.read_only(np.load(f'{path}/od_matrix_d2h.npy'))
+        self.dist_h2c = self.make_dense_od_matrix(self.od_matrix_h2c)
+        self.dist_h2h = self.make_dense_od_matrix(self.od_matrix_h2h)
+        self.dist_d2h = self.make_dense_od_matrix(self.od_matrix_d2h)
+    
+    def with_hubs(self, hubs_df, detour_factor): 
+        '''copy of the data with other hub locations (hubs_df with hub_type, inA10, waterbound, geometry). 
+        Macro hubs at the location of a macro hub in the data keep its od distances and road routes (to 
+        sites, from suppliers and from demolition sites), under their new ids. Distances from the other hubs 
+        are straight-line distances times detour_factor. There are no road routes for them, so their 
+        trips count for emissions but are not recorded on roads_gdf.'''
+        data = copy.copy(self)
+        hubs_df = hubs_df[hubs_df.hub_type.isin(['macro', 'micro'])]
+        hubs_df = hubs_df.iloc[np.argsort((hubs_df.hub_type != 'macro').to_numpy(), kind='stable')].copy()
+        # hub unique ids as given by Model.create_hubs(), after construction sites and suppliers 
+        first_id = len(self.construction_sites_df) + len(self.suppliers_df)
+        hubs_df['unique_id'] = first_id + np.arange(len(hubs_df))
+        hubs_df = hubs_df.reset_index(drop=True)
+        data.hubs_df = hubs_df
+        
+        def coords(df): 
+            return np.column_stack([df.geometry.y, df.geometry.x])
+        
+        hub_ids = hubs_df.unique_id.to_numpy()
+        macro = (hubs_df.hub_type == 'macro').to_numpy()
+        site_ids = np.arange(len(self.construction_sites_df))
+        supplier_ids = first_id - len(self.suppliers_df) + np.arange(len(self.suppliers_df))
+        demSite_ids = self.demolition_sites_df.unique_id.to_numpy(dtype=int)
+        
+        # macro hubs that stay where they are: {old_id: new_id} 
+        hubs_before = self.hubs_df[self.hubs_df.hub_type.isin(['macro', 'micro'])].reset_index(drop=True)
+        ids_before = {(point.x, point.y): first_id + i for i, (point, hub_type) in 
+                      enumerate(zip(hubs_before.geometry, hubs_before.hub_type)) if hub_type == 'macro'}
+        kept = {ids_before[(point.x, point.y)]: int(hub_id) for point, hub_id in 
+                zip(hubs_df.geometry[macro], hub_ids[macro]) if (point.x, point.y) in ids_before}
+        same = lambda ids: {int(i): int(i) for i in ids}
+        before = {new_id: old_id for old_id, new_id in kept.items()}
+        
+        def od_matrix(origin_ids, origin_coords, destination_ids, destination_coords, 
+                      dist_before, origins_before, destinations_before): 
+            '''od rows with the distances of the data (dist_before) where both ends did not move, 
+            origins_before / destinations_before = {new_id: old_id} of the ends that did not move'''
+            dist = haversine_matrix(origin_coords, destination_coords) * detour_factor
+            n = len(dist_before)
+            o = np.array([origins_before.get(int(i), -1) for i in origin_ids])
+            d = np.array([destinations_before.get(int(i), -1) for i in destination_ids])
+            known = ((o >= 0) & (o < n))[:, None] & ((d >= 0) & (d < n))[None, :]
+            dist_known = dist_before[np.ix_(np.clip(o, 0, n - 1), np.clip(d, 0, n - 1))]
+            dist = np.where(known & np.isfinite(dist_known), dist_known, dist)
+            return np.column_stack([np.repeat(origin_ids, len(destination_ids)), 
+                                    np.tile(destination_ids, len(origin_ids)), dist.ravel()]).astype(float)
+        
+        data.od_matrix_h2c = self.read_only(od_matrix(hub_ids, coords(hubs_df), 
+                                                      site_ids, coords(self.construction_sites_df), 
+                                                      self.dist_h2c, before, same(site_ids)))
+        data.od_matrix_h2h = self.read_only(od_matrix(hub_ids[macro], coords(hubs_df[macro]), 
+                                                      hub_ids, coords(hubs_df), self.dist_h2h, before, before))
+        data.od_matrix_d2h = self.read_only(od_matrix(demSite_ids, coords(self.demolition_sites_df), 
+                                                      hub_ids[macro], coords(hubs_df[macro]), 
+                                                      self.dist_d2h, same(demSite_ids), before))
+        data.dist_h2c = data.make_dense_od_matrix(data.od_matrix_h2c)
+        data.dist_h2h = data.make_dense_od_matrix(data.od_matrix_h2h)
+        data.dist_d2h = data.make_dense_od_matrix(data.od_matrix_d2h)
+        data.route_index_h2hc = self.route_index_h2hc.renamed(kept, same(site_ids))
+        data.route_index_d2h = self.route_index_d2h.renamed(same(demSite_ids), kept)
+        data.route_index_s2h = self.route_index_s2h.renamed(same(supplier_ids), kept)
+        return data
+    
+    def make_dense_od_matrix(self, od): 
+        '''convert od matrix rows [origin_id, destination_id, distance] into a dense matrix 
+        indexed by unique ids: dist[origin_id, destination_id] (np.inf where there is no od pair)'''
+        n = int(od[:, :2].max()) + 1
+        dist = np.full((n, n), np.inf)
+        dist[od[:, 0].astype(int), od[:, 1].astype(int)] = od[:, 2]
+        return self.read_only(dist)
+    
+    def read_only(self, array): 
+        array.flags.writeable = False
+        return array
+
+_model_data = {}
+def load_model_data(data_path='data/data_cleaned', use_cache=True): 
+    '''ModelData for data_path and use_cache, loaded once per process and reused by every Model'''
+    key = (data_path, use_cache)
+    if key not in _model_data: 
+        _model_data[key] = ModelData(data_path, use_cache)
+    return _model_data[key]
+
+
+def expected_trips(low, high, capacity): 
+    '''expected trips E[ceil(a / capacity)] and expected ton-trips E[a * ceil(a / capacity)] 
+    for a load a ~ uniform(low, high), in closed form (elementwise over arrays)'''
+    low, high, c = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [low, high, capacity]])
+    
+    def F(x): # integral of ceil(a / c) from 0 to x
+        m = np.floor(x / c)
+        return c * m * (m + 1) / 2 + (m + 1) * (x - m * c)
+    
+    def G(x): # integral of a * ceil(a / c) from 0 to x
+        m = np.floor(x / c)
+        return c ** 2 * m * (m + 1) * (4 * m - 1) / 12 + (m + 1) * (x ** 2 - (m * c) ** 2) / 2
+    
+    width = high - low
+    with np.errstate(divide='ignore', invalid='ignore'): 
+        trips = np.where(width > 0, (F(high) - F(low)) / width, np.ceil(low / c))
+        tonTrips = np.where(width > 0, (G(high) - G(low)) / width, low * np.ceil(low / c))
+    return trips, tonTrips
+
+def expected_request_counts(nDeliveries=1, low=0.1, high=0.2): 
+    '''a site requests uniform(low, high) shares of what it requires (see ConstructionSite.request_materials) 
+    until it has received everything, and each request is delivered nDeliveries times. 
+    returns the expected number of requests before the last one, and the mean share of the last 
+    (capped) request. P(nDeliveries * S_j < 1), with S_j the sum of j shares, follows from the 
+    Irwin-Hall distribution. This is an approximation: 
+    - the last share is taken as what the expected number of full requests leaves over, although the 
+      number of requests and the size of the last one depend on the same history of shares 
+    - every request is assumed to be delivered in full, and runs to complete (the max_steps cap of 
+      Model.run_until_complete is ignored)'''
+    def irwin_hall_cdf(x, n): 
+        if x <= 0: 
+            return 0.0
+        if x >= n: 
+            return 1.0
+        return sum((-1) ** k * math.comb(n, k) * (x - k) ** n for k in range(int(x) + 1)) / math.factorial(n)
+    
+    n_full = 0
+    j = 1
+    while nDeliveries * low * j < 1: 
+        n_full += irwin_hall_cdf((1 / nDeliveries - low * j) / (high - low), j)
+        j += 1
+    mean_share = (low + high) / 2
+    share_last = min(max(1 - nDeliveries * mean_share * n_full, 0), mean_share)
+    return n_full, share_last
+
+
+class HubAssignment: 
+    '''nearest and second nearest open hub of every client, from a (n_clients x n_hubs) distance matrix 
+    with columns ordered as hub_ids. Clients without a second open hub (e.g. when one hub is open) have 
+    second = -1, second_ids = -1 and second_dist = inf. Opening or closing a hub only updates the clients 
+    it affects: 
+    assignment = HubAssignment(dist, hub_ids)
+    changed = assignment.remove(hub_id) # rows of the clients whose nearest hub changed
+    assignment.nearest_ids, assignment.nearest_dist'''
+    def __init__(self, dist, hub_ids, is_open=None): 
+        self.dist = np.asarray(dist, dtype=float)
+        self.hub_ids = np.asarray(hub_ids, dtype=int)
+        self.columns = {hub_id: i for i, hub_id in enumerate(self.hub_ids.tolist())}
+        self.is_open = np.ones(len(self.hub_ids), dtype=bool) if is_open is None else np.array(is_open, dtype=bool)
+        self.rows = np.arange(len(self.dist))
+        self.nearest = np.zeros(len(self.dist), dtype=int)
+        self.second = np.full(len(self.dist), -1, dtype=int)
+        self.update(self.rows)
+    
+    def update(self, rows): 
+        '''find the nearest and second nearest open hub of some clients from scratch'''
+        dist = np.where(self.is_open, self.dist[rows], np.inf)
+        nearest = np.argmin(dist, axis=1)
+        dist[np.arange(len(rows)), nearest] = np.inf
+        second = np.argmin(dist, axis=1)
+        self.nearest[rows] = nearest
+        self.second[rows] = np.where(np.isfinite(dist[np.arange(len(rows)), second]), second, -1)
+    
+    @property
+    def nearest_ids(self): 
+        return self.hub_ids[self.nearest]
+    
+    @property
+    def nearest_dist(self): 
+        return self.dist[self.rows, self.nearest]
+    
+    @property
+    def second_ids(self): 
+        return np.where(self.second >= 0, self.hub_ids[self.second], -1)
+    
+    @property
+    def second_dist(self): 
+        return np.where(self.second >= 0, self.dist[self.rows, self.second], np.inf)
+    
+    def add(self, hub_id): 
+        '''open a hub, returns rows of the clients that now have it as nearest hub'''
+        c = self.columns[hub_id]
+        if self.is_open[c]: 
+            return np.zeros(0, dtype=int)
+        self.is_open[c] = True
+        dist = self.dist[:, c]
+        closer = dist < self.nearest_dist
+        between = ~closer & (dist < self.second_dist) # includes clients without a second hub
+        self.second[closer] = self.nearest[closer]
+        self.second[between] = c
+        self.nearest[closer] = c
+        return np.flatnonzero(closer)
+    
+    def remove(self, hub_id): 
+        '''close a hub, returns rows of the clients that had it as nearest hub'''
+        c = self.columns[hub_id]
+        if not self.is_open[c]: 
+            return np.zeros(0, dtype=int)
+        if self.is_open.sum() == 1: 
+            raise ValueError(f'hub {hub_id} is the last open hub')
+        self.is_open[c] = False
+        changed = np.flatnonzero(self.nearest == c)
+        self.update(np.flatnonzero((self.nearest == c) | (self.second == c)))
+        return changed
+    
+    def nearest_after(self, add=None, remove=None): 
+        '''column of the nearest hub of every client if hub add were opened and / or hub remove closed, 
+        without changing the assignment'''
+        nearest = self.nearest.copy()
+        if remove is not None: 
+            moved = nearest == self.columns[remove]
+            nearest[moved] = self.second[moved] # -1 for clients without a second hub
+        if add is not None: 
+            c = self.columns[add]
+            nearest_dist = np.where(nearest >= 0, self.dist[self.rows, nearest], np.inf)
+            nearest[self.dist[:, c] < nearest_dist] = c
+        if (nearest < 0).any(): 
+            raise ValueError(f'hub {remove} is the only open hub of some clients')
+        return nearest
+
+
 class Model(Model):
-    def __init__(self, parameters_dict): 
-        '''create construction sites, hubs, and vehicles'''
+    strucTypes = ['foundation', 'structural', 'non-structural']
+    
+    def __init__(self, parameters_dict, seed=None, data=None, array_state=False): 
+        '''create construction sites, hubs, and vehicles
+        data = ModelData shared between runs (loaded once per process if not given)
+        array_state = keep construction site materials in (n_sites, 3, n_materials) arrays 
+        and make all site requests in one vectorized pass (see make_site_arrays)'''
         super().__init__()
+        self.array_state = array_state
         self.schedule = BaseScheduler(self)
-        self.emissions_s2h = 0
-        self.emissions_h2c = 0 
-        self.roads_used = gpd.read_file('data/data_cleaned/ams_roads_edges.shp')
-        self.roads_used['damage'] = 0 
-        self.roads_used['damage'] = self.roads_used['damage'].astype(float)
+        self.seed_sequence = np.random.SeedSequence(seed)
+        # pollutants emitted so far, indexed like pollutants (co2, NOX, PM2.5, PM10, logistic movements)
+        self.pollutants_s2h = np.zeros(len(pollutants))
+        self.pollutants_h2c = np.zeros(len(pollutants))
         self.datacollector = DataCollector(
             model_reporters = {
                 'emissions_s2h': lambda m: m.emissions_s2h, 
                 'emissions_h2c': lambda m: m.emissions_h2c, 
                 'emissions_total': lambda m: m.emissions_s2h + m.emissions_h2c, 
+                'outstanding_demand': lambda m: m.outstanding_demand, 
+                **{pollutant: (lambda m, i=i: m.pollutants_s2h[i] + m.pollutants_h2c[i]) 
+                   for i, pollutant in enumerate(pollutants)}, 
+                'zones': lambda m: m.zone_totals, 
             }
         )
+        self.zone_totals = {}
+        self.outstanding_demand = None
+        self.steps_taken = 0
+        self.hub_assignments = {}
+        self.closed_hubs = {}
         
-        self.load_data()
+        self.load_data(data)
         self.add_parameters(parameters_dict) 
         
         self.id_count = 0
@@ -546,26 +1391,80 @@ class Model(Model):
             self.create_od_matrix_h2h()
             self.assign_hubs_to_sites()
             self.assign_hubs_to_hubs()
+            for hub in self.hubs: 
+                hub.find_clients()
         
-        if self.circularity_type != 'none': 
+        # demolition sites are collected from by hubs only (see Hub.step), so without hubs 
+        # circularity leaves the logistics unchanged
+        if self.circularity_type != 'none' and self.hub_network != 'none': 
             self.create_od_matrix_d2h()
             self.assign_hubs_to_demolition_sites()
                     
-    def load_data(self): 
-        self.construction_sites_df = gpd.read_file('data/data_cleaned/construction_sites.shp')
-        self.hubs_df = gpd.read_file('data/data_cleaned/hubs.shp')
-        self.suppliers_df = gpd.read_file('data/data_cleaned/suppliers.shp')
-        self.demolition_sites_df = gpd.read_file('data/data_cleaned/demolition_sites.shp')
-        self.vehicles_info = pd.read_csv('data/data_cleaned/vehicles_info.csv')
-        self.vehicles_info_demSites = pd.read_csv('data/data_cleaned/vehicles_info_demSites.csv')
-        self.build_info = pd.read_csv('data/data_cleaned/buildingType_info.csv')
-        self.materials_logistics_info = pd.read_csv('data/data_cleaned/materials_logistics_info.csv')
-        self.materialNames_conversion = pd.read_csv('data/data_cleaned/materialNames_conversion.csv')
-        self.materials_list = list(self.build_info.material.unique())
-        self.road_matrix_h2hc = np.load('data/data_cleaned/roadOsmIds_matrix_h2hc.npy', allow_pickle=True)
-        self.road_matrix_d2h = np.load('data/data_cleaned/roadOsmIds_matrix_d2h.npy', allow_pickle=True)
-        self.road_matrix_s2h = np.load('data/data_cleaned/roadOsmIds_matrix_s2h.npy', allow_pickle=True)
-        self.road_matrix_s2c = np.load('data/data_cleaned/roadOsmIds_matrix_s2c.npy', allow_pickle=True)
+    rng_streams = ['Model', 'ConstructionSite', 'Hub']
+    
+    def make_rng(self, stream, unique_id=0): 
+        '''independent random Generator for a stream (the model or an agent class, see rng_streams) and 
+        agent unique_id, spawned from the model's seed. The spawn key is (stream, unique_id) rather than 
+        a counter, so streams do not depend on the order in which agents are created or on which 
+        process runs the model'''
+        ss = self.seed_sequence
+        spawn_key = ss.spawn_key + (self.rng_streams.index(stream), int(unique_id))
+        return np.random.default_rng(np.random.SeedSequence(ss.entropy, spawn_key=spawn_key))
+    
+    @property
+    def emissions_s2h(self): 
+        return self.pollutants_s2h[0]
+    
+    @property
+    def emissions_h2c(self): 
+        return self.pollutants_h2c[0]
+    
+    def make_results_table(self): 
+        '''pollutants as rows of result_name, value, unit, area (the layout of the results csvs), 
+        for the whole model and for the road traffic in every zone (see calc_zone_totals)'''
+        results = [pd.DataFrame({
+            'result_name': pollutants, 
+            'value': self.pollutants_s2h + self.pollutants_h2c, 
+            'unit': pollutant_units, 
+            'area': 'whole model', 
+        })]
+        for zone, totals in self.zone_totals.items(): 
+            results.append(pd.DataFrame({
+                'result_name': pollutants, 
+                'value': [totals[pollutant] for pollutant in pollutants], 
+                'unit': pollutant_units, 
+                'area': zone, 
+            }))
+        return pd.concat(results, ignore_index=True)
+    
+    def load_data(self, data=None): 
+        '''take inputs from the shared ModelData, copying only what the model changes 
+        (road counters, zones and demolition sites, which get hubs assigned)'''
+        data = load_model_data() if data is None else data
+        self.data = data
+        self.roads_gdf = data.roads_gdf
+        self.roads_nTrips = np.zeros(len(data.roads_gdf), dtype=np.int64)
+        self.roads_damage = np.zeros(len(data.roads_gdf), dtype=float)
+        self.roads_pollutants_perKm = np.zeros((len(data.roads_gdf), len(pollutants)))
+        self.road_log = RoadUsageLog(len(data.roads_gdf))
+        self.flows = {}
+        self.road_zones = data.road_zones.copy() # see register_zone
+        self.construction_sites_df = data.construction_sites_df
+        self.hubs_df = data.hubs_df
+        self.suppliers_df = data.suppliers_df
+        self.demolition_sites_df = data.demolition_sites_df.copy()
+        self.vehicles_info = data.vehicles_info
+        self.vehicles_info_demSites = data.vehicles_info_demSites
+        self.build_info = data.build_info
+        self.materials_logistics_info = data.materials_logistics_info
+        self.materialNames_conversion = data.materialNames_conversion
+        self.materials_list = list(data.materials_list)
+        self.mat_ids = {mat: i for i, mat in enumerate(self.materials_list)}
+        self.route_index_h2hc = data.route_index_h2hc
+        self.route_index_d2h = data.route_index_d2h
+        self.route_index_s2h = data.route_index_s2h
+        self.route_index_s2c = data.route_index_s2c
+        self.vehicle_cache = {}
 
         self.construction_sites = []
         self.hubs = []
@@ -573,6 +1472,84 @@ class Model(Model):
         self.trucks_urban = []
         self.vehicles_international = []
         
+    def record_road_usage(self, route, nTrips, damage, pollutants_perKm=0): 
+        '''add trips, road damage and pollutants per km driven to every road segment of a route 
+        (route = array of row positions in self.roads_gdf, see RouteStore)'''
+        np.add.at(self.roads_nTrips, route, nTrips)
+        np.add.at(self.roads_damage, route, damage)
+        np.add.at(self.roads_pollutants_perKm, route, pollutants_perKm)
+        self.road_log.record(route, nTrips, damage)
+    
+    def record_flow(self, origin_id, destination_id, tons, nTrips): 
+        '''add tons and trips delivered from one agent to another (supplier, hub or construction site) 
+        self.flows = {(origin_id, destination_id): [tons, nTrips], ... }'''
+        flow = self.flows.setdefault((origin_id, destination_id), [0., 0])
+        flow[0] += tons
+        flow[1] += nTrips
+    
+    def get_flows(self): 
+        '''deliveries so far as a DataFrame with a row per origin / destination pair: 
+        origin_id, destination_id, tons, nTrips'''
+        pairs = np.array(list(self.flows.keys()), dtype=int).reshape(-1, 2)
+        totals = np.array(list(self.flows.values()), dtype=float).reshape(-1, 2)
+        return pd.DataFrame({'origin_id': pairs[:, 0], 'destination_id': pairs[:, 1], 
+                             'tons': totals[:, 0], 'nTrips': totals[:, 1].astype(int)})
+    
+    def calc_zone_totals(self): 
+        '''pollutants, trips and road damage on the roads of every zone (see RoadZones) 
+        self.zone_totals = {'A10': {'co2': 12.3, ..., 'nTrips': 456, 'damage': 7.8}, ... }'''
+        roads = np.column_stack([self.roads_pollutants_perKm * self.road_zones.lengths_km[:, None], 
+                                 self.roads_nTrips, self.roads_damage])
+        totals = self.road_zones.aggregate(roads)
+        self.zone_totals = {name: dict(zip(pollutants + ['nTrips', 'damage'], row.tolist())) 
+                            for name, row in zip(self.road_zones.names, totals)}
+    
+    def register_zone(self, name, zone): 
+        '''report totals for another zone (GeoDataFrame, GeoSeries or shapely geometry). The zone is 
+        registered for this model only, the zones of the shared ModelData are not changed'''
+        self.road_zones.register(name, zone)
+        self.calc_zone_totals()
+    
+    @property
+    def roads_used(self): 
+        '''copy of the roads GeoDataFrame with nTrips and damage from the trip counters. 
+        Only needed for visualisation and exports - agents record trips with record_road_usage()'''
+        roads_used = self.roads_gdf.copy()
+        roads_used['nTrips'] = self.roads_nTrips
+        roads_used['damage'] = self.roads_damage
+        return roads_used
+    
+    def roads_used_at(self, step): 
+        '''like roads_used, with the counters as they were after a step (0 = first step), see RoadUsageLog'''
+        roads_used = self.roads_gdf.copy()
+        roads_used['nTrips'], roads_used['damage'] = self.road_log.cumulative(step)
+        return roads_used
+    
+    def get_vehicle(self, region=None, transportation_network=None, vehicle_type=None, demSites=False): 
+        '''select the first vehicle in vehicles_info (or vehicles_info_demSites) matching the 
+        given region, transportation network and vehicle type - None matches any value. 
+        Each selection is compiled into a Vehicle once and cached in self.vehicle_cache'''
+        key = (demSites, region, transportation_network, vehicle_type)
+        if key not in self.vehicle_cache: 
+            vehicles_df = self.vehicles_info_demSites if demSites else self.vehicles_info
+            mask = np.ones(len(vehicles_df), dtype=bool)
+            for column, value in [('region', region), 
+                                  ('transportation_network', transportation_network), 
+                                  ('vehicle_type', vehicle_type)]: 
+                if value is not None: 
+                    mask &= (vehicles_df[column] == value).to_numpy()
+            v = vehicles_df[mask].iloc[0]
+            capacity_columns = [col for col in vehicles_df.columns if col.startswith('capacity_')]
+            material_ids = {col[len('capacity_'):]: i for i, col in enumerate(capacity_columns)}
+            self.vehicle_cache[key] = Vehicle(
+                v.get('region'), v.transportation_network, v.vehicle_type, v.vehicle_weight, 
+                v.emissions_perTonKm, v.nAxels, v[capacity_columns].to_numpy(dtype=float), material_ids, 
+                np.array([1.0 if pollutant == 'logistic movements' else 0.0 if column is None 
+                          else v[column] for pollutant, column in zip(pollutants, pollutant_columns)], 
+                         dtype=float)
+            )
+        return self.vehicle_cache[key]
+    
     def add_parameters(self, parameters_dict): 
         self.network_type = parameters_dict['network_type']
         self.truck_type = parameters_dict['truck_type']
@@ -583,14 +1560,68 @@ class Model(Model):
         self.parameters_dict = parameters_dict
     
     def create_constructionSites(self): 
-        for i, row in self.construction_sites_df.iterrows(): 
-            coords = (row.geometry.y, row.geometry.x)
-            site = ConstructionSite(self.id_count, self, row.buildType, 
-                                    coords, row.inA10, row.waterbound)
+        '''create construction sites from the columns of construction_sites_df. Sites share the 
+        composition of their building type for the model's biobased_type (self.site_composition = 
+        (n_buildingTypes, n_strucTypes, n_materials) tons, see ModelData.make_composition)'''
+        df = self.construction_sites_df
+        self.site_composition = self.data.get_composition(self.biobased_type)
+        self.buildingType_ids = {buildingType: i for i, buildingType in enumerate(self.data.buildingTypes)}
+        buildingType_ids = pd.Index(self.data.buildingTypes).get_indexer(df.buildType)
+        if (buildingType_ids < 0).any(): 
+            unknown = sorted(set(df.buildType[buildingType_ids < 0]))
+            raise ValueError(f'construction sites have building types {unknown} that are not in build_info')
+        without_rows = np.isnan(self.site_composition).all(axis=(1, 2))[buildingType_ids]
+        if without_rows.any(): 
+            unknown = sorted(set(df.buildType[without_rows]))
+            raise ValueError(f'build_info has no rows for building types {unknown} '
+                             f'with biobased_type {self.biobased_type!r}')
+        # sites per building type, for totals over all sites (see get_material_totals)
+        self.site_buildingType_counts = np.bincount(buildingType_ids, minlength=len(self.data.buildingTypes))
+        if self.array_state: 
+            self.make_site_arrays()
+            required = self.site_composition[buildingType_ids]
+            if 'modules' in self.mat_ids: 
+                required[:, :, self.mat_ids['modules']] = 0 # see ConstructionSite.calc_materials_required()
+            self.site_required[...] = required
+        
+        columns = [df.buildType, df.geometry.y, df.geometry.x, df.inA10, df.waterbound]
+        for buildingType, y, x, inA10, waterbound in zip(*[column.tolist() for column in columns]): 
+            site = ConstructionSite(self.id_count, self, buildingType, (y, x), inA10, waterbound)
             self.schedule.add(site)
             self.construction_sites.append(site)
             self.id_count += 1 
             
+    def make_site_arrays(self): 
+        '''materials required / received / requested by all construction sites, 
+        self.site_required[site_index, strucType_id, mat_id] = tons 
+        (strucTypes = ['foundation', 'structural', 'non-structural'], mats = self.materials_list)'''
+        shape = (len(self.construction_sites_df), len(self.strucTypes), len(self.materials_list))
+        self.site_required = np.zeros(shape)
+        self.site_received = np.zeros(shape)
+        self.site_request = np.zeros(shape)
+        # modules are only requested as non-structural elements
+        self.site_request_mask = np.ones(shape[1:], dtype=bool)
+        if 'modules' in self.mat_ids: 
+            self.site_request_mask[:2, self.mat_ids['modules']] = False
+    
+    def make_state_views(self, array, site_index, mats=None): 
+        '''{'foundation': MaterialsView, ... } on the rows of one site (or hub) in a state array'''
+        mats = self.materials_list if mats is None else mats
+        return {strucType: MaterialsView(array[site_index, i], self.mat_ids, mats) 
+                for i, strucType in enumerate(self.strucTypes)}
+    
+    def request_materials_sites(self): 
+        '''ConstructionSite.check_materials_toRequest() and request_materials() for all sites at once: 
+        every material still missing for any strucType is requested as a uniform(0.1, 0.2) share 
+        of the amount required, capped at what is still needed'''
+        required, received = self.site_required, self.site_received
+        toRequest = (received < required).any(axis=1) # (n_sites, n_mats)
+        mask = toRequest[:, None, :] & self.site_request_mask
+        request = required * np.stack([site.draw_request_shares() for site in self.construction_sites])
+        stillNeeded = required - received
+        request = np.where(request < stillNeeded, request, stillNeeded)
+        self.site_request[...] = np.where(mask, request, 0)
+    
     def create_suppliers(self): 
         for i, row in self.suppliers_df.iterrows(): 
             coords = (row.geometry.y, row.geometry.x)
@@ -607,6 +1638,9 @@ class Model(Model):
             hub_type = ['micro', 'macro']
         elif self.hub_network == 'none': 
             hub_type = []
+        if self.array_state: 
+            nHubs = self.hubs_df.hub_type.isin(hub_type).sum()
+            self.hub_request = np.zeros((nHubs, len(self.strucTypes), len(self.materials_list)))
         for i, row in self.hubs_df.iterrows(): 
             if row.hub_type in hub_type: 
                 coords = (row.geometry.y, row.geometry.x)
@@ -628,68 +1662,362 @@ class Model(Model):
         nAxels = v.nAxels.iloc[0]
         return capacity_dict, emissions_perTonKm, nAxels
     
-    # this needs to be changed to real distance od matrix 
-    # add this in data prep 
     def create_od_matrix_h2c(self): 
-        '''This od matrix was made in dataPrep.ipynb. The ids correspond to the 
-        agent unique ids in the agent based model. If the input data for construction sites
-        and hubs changes, this od matrix needs to change accordingly in dataPrep.ipynb.'''
-        self.od_matrix_h2c = np.load('data/data_cleaned/od_matrix_h2c.npy')
+        '''od matrix and dense distance matrix from ModelData.load_od_matrices()'''
+        self.od_matrix_h2c = self.data.od_matrix_h2c
+        self.dist_h2c = self.data.dist_h2c
     
-    # this needs to be changed to real distance od matrix 
-    # add this in data prep
     def create_od_matrix_h2h(self): 
-        '''This od matrix was made in dataPrep.ipynb. The ids correspond to the 
-        agent unique ids in the agent based model. If the input data for construction sites
-        and hubs changes, this od matrix needs to change accordingly in dataPrep.ipynb.'''
-        self.od_matrix_h2h = np.load('data/data_cleaned/od_matrix_h2h.npy')
+        '''od matrix and dense distance matrix from ModelData.load_od_matrices()'''
+        self.od_matrix_h2h = self.data.od_matrix_h2h
+        self.dist_h2h = self.data.dist_h2h
         
     def create_od_matrix_d2h(self): 
-        '''This od matrix was made in dataPrep.ipynb. The ids correspond to the 
-        agent unique ids in the agent based model. If the input data for construction sites
-        and hubs changes, this od matrix needs to change accordingly in dataPrep.ipynb.'''
-        self.od_matrix_d2h = np.load('data/data_cleaned/od_matrix_d2h.npy')
-                
+        '''od matrix and dense distance matrix from ModelData.load_od_matrices()'''
+        self.od_matrix_d2h = self.data.od_matrix_d2h
+        self.dist_d2h = self.data.dist_d2h
+    
     def assign_hubs_to_sites(self):
-        od = self.od_matrix_h2c
-        nMacroHubs = len([hub for hub in self.hubs if hub.hubType == 'macro'])
-        for site in self.construction_sites: 
-            site_od = od[od[:, 1] == site.unique_id]
+        '''nearest hub and nearest macro hub of every construction site, kept in HubAssignments 
+        (self.hub_assignments['sites'] / ['sites_macro']) so hubs can be closed / opened later'''
+        site_ids = [site.unique_id for site in self.construction_sites]
+        hub_ids = [hub.unique_id for hub in self.hubs]
+        macroHub_ids = [hub.unique_id for hub in self.hubs if hub.hubType == 'macro']
+        dist = self.dist_h2c[np.ix_(hub_ids, site_ids)].T
+        self.hub_assignments['sites'] = HubAssignment(dist, hub_ids, [hub.hubType == 'macro' or 
+                                                                      self.hub_network == 'decentralized' 
+                                                                      for hub in self.hubs])
+        self.hub_assignments['sites_macro'] = HubAssignment(dist, hub_ids, [hub.hubType == 'macro' for hub in self.hubs])
+        self.apply_site_assignments()
+    
+    def apply_site_assignments(self, rows=slice(None)): 
+        '''copy nearest (macro) hub ids and distances to the construction site agents (rows = site positions)'''
+        sites = self.hub_assignments['sites'], self.hub_assignments['sites_macro']
+        for site, hub_id, hub_dist, macroHub_id, macroHub_dist in zip(
+                np.array(self.construction_sites, dtype=object)[rows], 
+                sites[0].nearest_ids[rows], sites[0].nearest_dist[rows], 
+                sites[1].nearest_ids[rows], sites[1].nearest_dist[rows]): 
             if self.hub_network == 'decentralized': 
-                site.nearestHub_id = int(site_od[np.argmin(site_od[:, 2]), 0])
-                site.nearestHub_dist = site_od[np.argmin(site_od[:, 2]), 2]
-            site_od_macro = site_od[:nMacroHubs]
-            site.nearestMacroHub_id = int(site_od_macro[np.argmin(site_od_macro[:, 2]), 0])
-            site.nearestMacroHub_dist = site_od_macro[np.argmin(site_od_macro[:, 2]), 2]
+                site.nearestHub_id = int(hub_id)
+                site.nearestHub_dist = hub_dist
+            site.nearestMacroHub_id = int(macroHub_id)
+            site.nearestMacroHub_dist = macroHub_dist
                         
     def assign_hubs_to_hubs(self): 
-        od = self.od_matrix_h2h
-        for hub in self.hubs: 
-            hub_od = od[od[:, 1] == hub.unique_id]
-            hub.nearestMacroHub_id = int(hub_od[np.argmin(hub_od[:, 2])][0])
-            hub.nearestMacroHub_dist = hub_od[np.argmin(hub_od[:, 2])][2]
+        '''nearest macro hub of every hub (self.hub_assignments['hubs'])'''
+        hub_ids = [hub.unique_id for hub in self.hubs]
+        macroHub_ids = [hub.unique_id for hub in self.hubs if hub.hubType == 'macro']
+        self.hub_assignments['hubs'] = HubAssignment(self.dist_h2h[np.ix_(macroHub_ids, hub_ids)].T, macroHub_ids)
+        self.assigned_hubs = list(self.hubs) # rows of self.hub_assignments['hubs']
+        self.apply_hub_assignments()
+    
+    def apply_hub_assignments(self, rows=slice(None)): 
+        hubs = self.hub_assignments['hubs']
+        for hub, macroHub_id, macroHub_dist in zip(np.array(self.assigned_hubs, dtype=object)[rows], 
+                                                    hubs.nearest_ids[rows], hubs.nearest_dist[rows]): 
+            hub.nearestMacroHub_id = int(macroHub_id)
+            hub.nearestMacroHub_dist = macroHub_dist
             
     def assign_hubs_to_demolition_sites(self): 
-        od = self.od_matrix_d2h
-        def func(row): 
-            unique_id = row.unique_id
-            site_od = od[od[:, 0] == unique_id]
-            # nearest hub out of all hubs
-            row['nearestHub_id'] = int(site_od[np.argmin(site_od[:, 2]), 1])
-            row['nearestHub_dist'] = site_od[np.argmin(site_od[:, 2]), 2]
-            # nearest macroHub
-            macroHubIds = [h.unique_id for h in self.hubs if h.hubType == 'macro']
-            site_od_macro = site_od[np.isin(site_od[:, 1], macroHubIds)]
-            row['nearestMacroHub_id'] = int(site_od_macro[np.argmin(site_od_macro[:, 2]), 1])
-            row['nearestMacroHub_dist'] = site_od_macro[np.argmin(site_od_macro[:, 2]), 2]
-            return row
-        self.demolition_sites_df = self.demolition_sites_df.apply(lambda row: func(row), axis=1)
+        '''nearest hub and nearest macro hub of every demolition site 
+        (self.hub_assignments['demSites'] / ['demSites_macro'])'''
+        demSite_ids = self.demolition_sites_df.unique_id.to_numpy(dtype=int)
+        hub_ids = [hub.unique_id for hub in self.hubs]
+        dist = self.dist_d2h[np.ix_(demSite_ids, hub_ids)]
+        self.hub_assignments['demSites'] = HubAssignment(dist, hub_ids)
+        self.hub_assignments['demSites_macro'] = HubAssignment(dist, hub_ids, [hub.hubType == 'macro' for hub in self.hubs])
+        self.apply_demSite_assignments()
+    
+    def apply_demSite_assignments(self): 
+        for key, column in [('demSites', 'nearestHub'), ('demSites_macro', 'nearestMacroHub')]: 
+            self.demolition_sites_df[f'{column}_id'] = self.hub_assignments[key].nearest_ids
+            self.demolition_sites_df[f'{column}_dist'] = self.hub_assignments[key].nearest_dist
+    
+    def close_hub(self, hub_id): 
+        '''take a hub out of the network (what-if): its sites, micro hubs and demolition sites move to 
+        their next nearest hub. Only the affected clients are reassigned, see HubAssignment'''
+        hub = [hub for hub in self.hubs if hub.unique_id == hub_id][0]
+        self.hubs.remove(hub)
+        self.schedule.remove(hub)
+        self.closed_hubs[hub_id] = hub
+        self.update_hub_network(hub, 'remove')
+    
+    def open_hub(self, hub_id): 
+        '''put a hub closed with close_hub() back into the network, at its original place in self.hubs and 
+        in the schedule (agents step in the order they were created, so a macro hub keeps stepping 
+        before its micro hubs and close_hub(x); open_hub(x) leaves the model unchanged)'''
+        hub = self.closed_hubs.pop(hub_id)
+        self.hubs.insert(sum(h.hub_index < hub.hub_index for h in self.hubs), hub)
+        later = [agent for agent in self.schedule.agents if agent.unique_id > hub_id]
+        for agent in later: 
+            self.schedule.remove(agent)
+        for agent in [hub] + later: 
+            self.schedule.add(agent)
+        self.update_hub_network(hub, 'add')
+    
+    def update_hub_network(self, hub, change): 
+        '''add / remove a hub in every hub assignment it takes part in, then update the affected 
+        agents and the clients of the hubs involved'''
+        hubs_involved = {hub.unique_id}
+        for key, assignment in self.hub_assignments.items(): 
+            if hub.unique_id not in assignment.columns: 
+                continue
+            if key.endswith('_macro') and hub.hubType != 'macro': 
+                continue
+            before = assignment.nearest_ids.copy()
+            rows = getattr(assignment, change)(hub.unique_id)
+            hubs_involved.update(before[rows].tolist())
+            hubs_involved.update(assignment.nearest_ids[rows].tolist())
+            if key.startswith('sites'): 
+                self.apply_site_assignments(rows)
+            elif key == 'hubs': 
+                self.apply_hub_assignments(rows)
+            else: 
+                self.apply_demSite_assignments()
+        for h in self.hubs: 
+            if h.unique_id in hubs_involved: 
+                h.find_clients()
+                h.demSite_arrays = None
             
     def step(self):
+        if self.array_state: 
+            self.request_materials_sites()
         self.schedule.step()
+        self.road_log.end_step()
+        self.steps_taken += 1
+        self.calc_zone_totals()
         self.calc_emissions()
+        self.calc_outstanding_demand()
         self.datacollector.collect(self)
     
+    def estimate(self): 
+        '''expected emissions_s2h, emissions_h2c and road trips of this scenario, computed in closed 
+        form from the od distances, vehicles and material composition without stepping any agents. 
+        Sites request uniform(0.1, 0.2) shares of each material they require, so the expected number of 
+        requests follows from expected_request_counts() and the expected trips per request from 
+        expected_trips(). Macro hubs, micro hubs and demolition sites handle the summed requests of 
+        their clients, which are spread evenly over the expected number of steps. Missing tons count 
+        as zero. Expected trips and damage per road are kept in self.expected_roads_nTrips / _damage. 
+        The estimate is of a run that completes (as in expected_request_counts), with trips of the last 
+        request taken at its mean load and hub loads at their mean per step, so it is an approximation 
+        of the mean of many runs. see validate_estimates() for a comparison with the agent based model'''
+        self.expected_roads_nTrips = np.zeros(len(self.roads_gdf))
+        self.expected_roads_damage = np.zeros(len(self.roads_gdf))
+        self.expected_road_trips = 0
+        emissions_s2h = 0
+        emissions_h2c = 0
+        required = self.get_site_required()
+        
+        if self.hub_network == 'none': 
+            # every supplier sends each site its whole request, see Supplier.calc_materials_toSend()
+            n_full, share_last = expected_request_counts(len(self.suppliers))
+            vehicle = self.get_vehicle('international', self.network_type)
+            capacity = self.get_capacities(vehicle) * 0.3
+            for supplier in self.suppliers: 
+                for site in self.construction_sites: 
+                    nTrips, emissions = self.estimate_deliveries(required[site.site_index], capacity, vehicle, 
+                                                                 supplier.distance_fromAms, n_full, share_last)
+                    emissions_s2h += emissions.sum()
+                    route = self.route_index_s2c[(supplier.unique_id, site.unique_id)]
+                    self.record_expected_road_usage(route, nTrips, capacity, vehicle)
+            n_steps = n_full + 1
+        
+        else: 
+            n_full, share_last = expected_request_counts(1)
+            n_steps = n_full + 1
+            # tons requested through each hub: its sites, plus the sites of its micro hub clients 
+            hub_totals = {}
+            for hub in sorted(self.hubs, key=lambda hub: hub.hubType != 'micro'): 
+                hub_totals[hub.unique_id] = required[hub.client_site_idx].sum(axis=0)
+                for microHub_id in hub.client_hub_ids.tolist(): 
+                    hub_totals[hub.unique_id] = hub_totals[hub.unique_id] + hub_totals[microHub_id]
+            
+            for hub in self.hubs: 
+                for client_id, c in hub.clients.items(): 
+                    client = c['agent']
+                    vehicle = hub._get_vehicle_forClient(client)
+                    capacity = self.get_capacities(vehicle)
+                    if type(client) is ConstructionSite: 
+                        nTrips, emissions = self.estimate_deliveries(required[client.site_index], capacity, vehicle, 
+                                                                     c['distance'], n_full, share_last)
+                    else: # micro hub 
+                        nTrips, emissions = self.estimate_aggregated(hub_totals[client_id], capacity, vehicle, 
+                                                                     c['distance'], n_steps)
+                    emissions_h2c += emissions.sum()
+                    if vehicle.transportation_network == 'road': 
+                        route = self.route_index_h2hc[(hub.unique_id, client_id)]
+                        self.record_expected_road_usage(route, nTrips, capacity, vehicle)
+                if hub.hubType == 'macro': 
+                    emissions_s2h += self.estimate_hub_collection(hub, hub_totals[hub.unique_id], n_steps)
+        
+        return {
+            'emissions_s2h': emissions_s2h, 
+            'emissions_h2c': emissions_h2c, 
+            'emissions_total': emissions_s2h + emissions_h2c, 
+            'road_trips': self.expected_road_trips, 
+            'steps': n_steps, 
+        }
+    
+    def get_site_required(self): 
+        '''materials required by all sites as an (n_sites, 3, n_materials) array, missing tons as 0'''
+        if self.array_state: 
+            return np.nan_to_num(self.site_required)
+        mat_ids = {mat: i for i, mat in enumerate(self.materials_list)}
+        required = np.zeros((len(self.construction_sites), len(self.strucTypes), len(self.materials_list)))
+        for site in self.construction_sites: 
+            for j, strucType in enumerate(self.strucTypes): 
+                for mat, amount in site.materials_required[strucType].items(): 
+                    required[site.site_index, j, mat_ids[mat]] = amount
+        return np.nan_to_num(required)
+    
+    def get_capacities(self, vehicle): 
+        '''vehicle capacity for every material in self.materials_list (nan if it has none)'''
+        return np.array([vehicle.capacity(mat) if mat in vehicle.material_ids else np.nan 
+                         for mat in self.materials_list])
+    
+    def estimate_deliveries(self, required, capacity, vehicle, distance, n_full, share_last): 
+        '''expected trips and emissions per (strucType, material) of delivering all requests of one site, 
+        required = tons per (strucType, material), see expected_request_counts()'''
+        trips, tonTrips = expected_trips(required * 0.1, required * 0.2, capacity)
+        load_last = required * share_last
+        with np.errstate(divide='ignore', invalid='ignore'): 
+            trips_last = np.ceil(load_last / capacity)
+        nTrips = np.where(required > 0, n_full * trips + trips_last, 0)
+        tonTrips = np.where(required > 0, n_full * tonTrips + load_last * trips_last, 0)
+        emissions = vehicle.emissions_perTonKm * (vehicle.vehicle_weight * nTrips + tonTrips) * distance * 2
+        return nTrips, emissions
+    
+    def estimate_aggregated(self, total, capacity, vehicle, distance, n_steps): 
+        '''expected trips and emissions of moving total tons in n_steps equal loads'''
+        load = total / n_steps
+        with np.errstate(divide='ignore', invalid='ignore'): 
+            nTrips = np.where(total > 0, n_steps * np.ceil(load / capacity), 0)
+        emissions = vehicle.emissions_perTonKm * (vehicle.vehicle_weight + load) * distance * nTrips * 2
+        return nTrips, emissions
+    
+    def estimate_hub_collection(self, hub, total, n_steps): 
+        '''expected emissions of a macro hub collecting total (tons per strucType, material) 
+        from suppliers and demolition sites, triaged as in Hub.triage_materials_request()'''
+        strucTypes_demSites, strucTypes_suppliers = hub.get_strucTypes_triaged()
+        weights = lambda strucTypes: np.array([strucTypes.count(strucType) for strucType in self.strucTypes])
+        
+        emissions = 0
+        supplier_totals = weights(strucTypes_suppliers) @ total
+        vehicle, road = hub._get_vehicle_forSupplier()
+        capacity = self.get_capacities(vehicle)
+        for i, mat in enumerate(self.materials_list): 
+            if supplier_totals[i] == 0: 
+                continue
+            supplier = hub._get_supplier(mat)
+            nTrips, e = self.estimate_aggregated(supplier_totals[i:i + 1], capacity[i:i + 1], vehicle, 
+                                                 supplier.distance_fromAms, n_steps)
+            emissions += e.sum()
+            if road: 
+                route = self.route_index_s2h[(supplier.unique_id, hub.unique_id)]
+                self.record_expected_road_usage(route, nTrips, capacity[i:i + 1], vehicle)
+        
+        if self.circularity_type != 'none': 
+            demSite_totals = weights(strucTypes_demSites) @ total
+            emissions += self.estimate_demolition_collection(hub, demSite_totals, n_steps)
+        return emissions
+    
+    def estimate_demolition_collection(self, hub, totals, n_steps): 
+        '''expected emissions of a macro hub collecting totals (tons per material) from its demolition 
+        sites. Every step, sites are drawn until their stocks cover that step's request, so by Wald's 
+        identity the expected number of draws is the request over the mean stock.'''
+        conversion = self.materialNames_conversion.drop_duplicates('name_from_conSiteData')
+        conversion = dict(zip(conversion.name_from_conSiteData, conversion.name_from_demSiteData))
+        totals_demSites = {}
+        for i, mat in enumerate(self.materials_list): 
+            if totals[i] and mat in conversion: 
+                totals_demSites[conversion[mat]] = totals_demSites.get(conversion[mat], 0) + totals[i]
+        
+        if hub.demSite_arrays is None: 
+            hub.make_demSite_arrays()
+        d = hub.demSite_arrays
+        emissions = 0
+        for mat, total in totals_demSites.items(): 
+            if mat not in d['stocks'] or d['stocks'][mat].sum() == 0: 
+                continue
+            request = total / n_steps
+            stocks = d['stocks'][mat]
+            nDraws = n_steps * max(1, request / stocks.mean())
+            collect = np.minimum(stocks, request)
+            capacity = d['capacity'][mat]
+            trips = np.ceil(collect / capacity)
+            emissions_perDraw = d['emissions_perTonKm'] * (d['vehicle_weight'] + collect) * d['distance'] * trips * 2
+            emissions += nDraws * emissions_perDraw.mean()
+            
+            # every site is drawn nDraws / n_sites times on average 
+            draws_perSite = nDraws / len(stocks)
+            for i in np.flatnonzero(d['road']): 
+                route = self.route_index_d2h[(d['unique_id'][i], hub.unique_id)]
+                damage = (capacity[i] / d['nAxels'][i]) ** 4 * trips[i] * draws_perSite
+                np.add.at(self.expected_roads_nTrips, route, trips[i] * draws_perSite)
+                np.add.at(self.expected_roads_damage, route, damage)
+                self.expected_road_trips += trips[i] * draws_perSite
+        return emissions
+    
+    def record_expected_road_usage(self, route, nTrips, capacity, vehicle): 
+        '''add expected trips (per material, with their capacities) and road damage to a route'''
+        damage = np.nansum((capacity / vehicle.nAxels) ** 4 * nTrips)
+        np.add.at(self.expected_roads_nTrips, route, nTrips.sum())
+        np.add.at(self.expected_roads_damage, route, damage)
+        self.expected_road_trips += nTrips.sum()
+    
+    def calc_outstanding_demand(self): 
+        '''tons that construction sites still need to receive, 
+        per site (self.outstanding_perSite) and in total (self.outstanding_demand)'''
+        if self.array_state: 
+            missing = self.site_required - self.site_received
+            self.outstanding_perSite = np.where(missing > 0, missing, 0).sum(axis=(1, 2))
+        else: 
+            self.outstanding_perSite = np.array([
+                sum(required - site.materials_received[strucType][mat] 
+                    for strucType, mat_required_dict in site.materials_required.items() 
+                    for mat, required in mat_required_dict.items() 
+                    if site.materials_received[strucType][mat] < required) 
+                for site in self.construction_sites
+            ], dtype=float)
+        self.outstanding_demand = self.outstanding_perSite.sum()
+    
+    def run_until_complete(self, max_steps=100): 
+        '''step the model until all construction sites have received the materials they require, 
+        or until max_steps. Sites that are done, and hubs whose clients are all done and whose last 
+        request was passed on, are removed from the schedule so that later steps only run agents that 
+        still have work (the totals are those of stepping the model without removing agents). 
+        returns the number of steps taken'''
+        while self.steps_taken < max_steps: 
+            self.step()
+            self.remove_done_agents()
+            if self.outstanding_demand == 0: 
+                break
+        return self.steps_taken
+    
+    def remove_done_agents(self): 
+        '''remove sites without outstanding demand and hubs without active clients from the schedule'''
+        for site in self.construction_sites: 
+            if not site.done and self.outstanding_perSite[site.site_index] == 0: 
+                site.done = True
+                self.schedule.remove(site)
+                # stop hubs / suppliers from delivering the site's last request again 
+                if self.array_state: 
+                    self.site_request[site.site_index] = 0
+                else: 
+                    site.materials_request = {strucType: dict.fromkeys(self.materials_list, 0) 
+                                              for strucType in site.materials_required}
+        # micro hubs first, so macro hubs see whether their micro hub clients are done. 
+        # A micro hub's request is served by its macro hub in the next step, so a hub is only done 
+        # once its clients are done and its own request is zero, i.e. its last request was passed on 
+        for hub in sorted(self.hubs, key=lambda hub: hub.hubType != 'micro'): 
+            if self.array_state: 
+                requesting = self.hub_request[hub.hub_index].any()
+            else: 
+                requesting = any(amount for request in hub.materials_request.values() for amount in request.values())
+            if not hub.done and not requesting and all(client['agent'].done for client in hub.clients.values()): 
+                hub.done = True
+                self.schedule.remove(hub)
+    
     def calc_emissions(self): 
         self.emissions = round(self.emissions_h2c + self.emissions_s2h)
     
@@ -722,8 +2050,8 @@ class Model(Model):
         return fig
     
     def display_materials_chart(self): 
-        df_mat = self._make_df_materials(self.construction_sites)
-        df_circ = self._make_df_circular(self.construction_sites, self.circularity_type)
+        df_mat = self._make_df_materials()
+        df_circ = self._make_df_circular()
         fig_1 = px.pie(df_mat, values='tons', names='material', title='materials used')
         fig_2 = px.pie(df_circ, values='tons', names='circular', title='materials used')
 
@@ -738,30 +2066,32 @@ class Model(Model):
         
         return fig 
     
-    def _make_df_materials(self, consite_agents_list): 
-        dfs = []
-        for site in consite_agents_list: 
-            df = site.material_composition_df
-            df = df.groupby(by='material').sum(numeric_only=True).reset_index()
-            dfs.append(df)
-        return pd.concat(dfs).groupby('material').sum(numeric_only=True).reset_index() 
+    circularity_strucTypes = {
+        'none': [], 
+        'semi': ['non-structural'], 
+        'full': ['non-structural', 'structural'], 
+        'extreme': ['non-structural', 'structural', 'foundation']
+    }
     
-    def _make_df_circular(self, consite_agents_list, circularity_type): 
-        circularity_dict = {
-            'none': [], 
-            'semi': ['non-structural'], 
-            'full': ['non-structural', 'structural'], 
-            'extreme': ['non-structural', 'structural', 'foundation']
-        }
-
-        dfs = []
-        for site in consite_agents_list: 
-            df = site.material_composition_df
-            df['circular'] = df.structural_type.map(lambda x: 'circular' if x in circularity_dict[circularity_type] else 'not circular')
-            df = df.groupby('circular').sum(numeric_only=True).reset_index()
-            dfs.append(df)
-
-        return pd.concat(dfs).groupby('circular').sum(numeric_only=True).reset_index()
+    def get_material_totals(self): 
+        '''tons of every structural type and material in the composition of all construction sites, 
+        as an (n_strucTypes, n_materials) array indexed like self.strucTypes and self.materials_list: 
+        the number of sites per building type times the composition of each building type'''
+        return np.tensordot(self.site_buildingType_counts, np.nan_to_num(self.site_composition), axes=1)
+    
+    def _make_df_materials(self): 
+        totals = self.get_material_totals().sum(axis=0)
+        df = pd.DataFrame({'material': self.materials_list, 'tons': totals})
+        return df.sort_values('material').reset_index(drop=True)
+    
+    def _make_df_circular(self): 
+        circular_strucTypes = self.circularity_strucTypes[self.circularity_type]
+        df = pd.DataFrame({
+            'circular': ['circular' if strucType in circular_strucTypes else 'not circular' 
+                         for strucType in self.strucTypes], 
+            'tons': self.get_material_totals().sum(axis=1), 
+        })
+        return df.groupby('circular').sum().reset_index()
     
     def display_folium_html(self): 
         
@@ -780,109 +2110,134 @@ class Model(Model):
         return html_string
     
     def plotPoints(self, m, agent_list, color, radius): 
-        for agent in agent_list: 
-            # selected_color = 'blue' if agent.waterbound else color
-            selected_color = color
-            folium.CircleMarker(
-                location=agent.coords, radius=radius, color=selected_color, fill_color=selected_color, 
-                popup=folium.Popup(f'id: {agent.unique_id}', max_width=300, height=150), 
-            ).add_to(m)
-
-    def plotLines_roadsUsed(self, m): 
-        indicator = 'damage'
-        df = self.roads_used
-        df = df[df.nTrips > 0]
-        max_trips = df[indicator].max()
-        quantiles = df[indicator].quantile([0, 0.2, 0.4, 0.6, 0.8, 1])
-        def get_color(value):
-            lowVal = 80
-            inc = (255 - lowVal) / 5
-            if value <= quantiles[0.2]:
-                return f'rgb({lowVal}, 0, 0)'  # Dark Red
-            elif value <= quantiles[0.4]:
-                return f'rgb({lowVal+inc*1}, 0, 0)'  # Slightly Brighter Red
-            elif value <= quantiles[0.6]:
-                return f'rgb({lowVal+inc*2}, 0, 0)'  # Medium Bright Red
-            elif value <= quantiles[0.8]:
-                return f'rgb({lowVal+inc*3}, 0, 0)'  # Brighter Red
-            else:
-                return 'rgb(255, 0, 0)'  # Brightest Red
-        def style_function(feature):
-            nTrips = feature['properties'][indicator]
-            proportion = np.log(1 + nTrips) / np.log(1 + max_trips)
-            red_intensity = int(20 + 235 * proportion)
-            return {
-                'fillOpacity': 0.5,
-                'weight': 2,  # or however thick you want your roads
-                'color': get_color(nTrips)
-                # 'color': f'rgb({red_intensity}, 0, 0)'
-            }
-        def popup_function(feature):
-            return folium.Popup(str(feature['properties'][indicator]))
+        self.add_points_layer(m, [agent.unique_id for agent in agent_list], 
+                              [agent.coords for agent in agent_list], color, radius)
+    
+    def add_points_layer(self, m, ids, coords, color, radius, visits=None): 
+        '''add points (coords = [(lat, lon), ... ]) to the map as one GeoJSON layer of circle markers 
+        with an id popup, instead of a folium.CircleMarker per point. 
+        visits = times every point was visited, shown in the popup and scaling the marker area'''
+        coords = np.round(np.asarray(coords, dtype=float).reshape(-1, 2), 5)
+        if not len(coords): 
+            return
+        df = gpd.GeoDataFrame({'id': np.asarray(ids, dtype=int)}, 
+                              geometry=gpd.points_from_xy(coords[:, 1], coords[:, 0]), crs='EPSG:4326')
+        fields = ['id']
+        kwargs = {}
+        if visits is not None: 
+            df['visits'] = np.asarray(visits, dtype=int)
+            fields.append('visits')
+            # a few distinct radii only, so folium shares one style between many markers
+            kwargs['style_function'] = lambda feature: {
+                'radius': round(radius * min(feature['properties']['visits'], 16) ** 0.5)}
+        folium.GeoJson(
+            df, 
+            marker=folium.CircleMarker(radius=radius, color=color, fill_color=color), 
+            popup=folium.GeoJsonPopup(fields=fields, aliases=[f'{field}:' for field in fields]), 
+            **kwargs
+        ).add_to(m)
+    
+    def add_lines_layer(self, m, coords_from, coords_to, color='#454545', properties=None, weight_column=None): 
+        '''add straight dashed lines from coords_from[i] to coords_to[i] ((lat, lon) arrays) 
+        to the map as one GeoJSON layer. properties = DataFrame with a row per line, shown in a tooltip. 
+        weight_column = column of properties scaling the line width (1 to 5)'''
+        coords_from = np.asarray(coords_from, dtype=float).reshape(-1, 2)
+        coords_to = np.asarray(coords_to, dtype=float).reshape(-1, 2)
+        if not len(coords_from): 
+            return
+        lines = np.round(np.stack([coords_from[:, ::-1], coords_to[:, ::-1]], axis=1), 5)
+        properties = pd.DataFrame(index=range(len(lines))) if properties is None else properties.reset_index(drop=True)
+        df = gpd.GeoDataFrame(properties, geometry=shapely.linestrings(lines), crs='EPSG:4326')
+        kwargs = {}
+        if len(properties.columns): 
+            kwargs['tooltip'] = folium.GeoJsonTooltip(fields=list(properties.columns))
+        if weight_column is None: 
+            df['weight'] = 1
+        else: 
+            # few distinct widths, so folium shares one style between many lines
+            values = df[weight_column].to_numpy(dtype=float)
+            df['weight'] = 1 + np.round(4 * np.sqrt(values / max(values.max(), 1e-9))).astype(int)
+        folium.GeoJson(
+            df, 
+            style_function=lambda feature: {'weight': feature['properties']['weight'], 'color': color, 'dashArray': '5'}, 
+            **kwargs
+        ).add_to(m)
+
+    # colours of the road classes in plotLines_roadsUsed, from the lowest to the highest quintile
+    road_class_colors = ['rgb(80, 0, 0)', 'rgb(115, 0, 0)', 'rgb(150, 0, 0)', 'rgb(185, 0, 0)', 'rgb(255, 0, 0)']
+    
+    def plotLines_roadsUsed(self, m, indicator='damage', merge=True): 
+        '''used roads coloured by quintile of indicator ('damage' or 'nTrips'). Classes are computed in one 
+        pass over the road counters and only the class of each road goes into the GeoJSON, with geometries 
+        simplified once per ModelData (see ModelData.map_geometries). 
+        merge = join touching roads of the same class, so the layer has one feature per class'''
+        used = np.flatnonzero(self.roads_nTrips > 0)
+        if not len(used): 
+            return
+        values = (self.roads_damage if indicator == 'damage' else self.roads_nTrips)[used]
+        quantiles = np.quantile(values, [0.2, 0.4, 0.6, 0.8])
+        classes = np.searchsorted(quantiles, values)
+        geoms = self.data.map_geometries()[used]
+        if merge: 
+            present = np.unique(classes)
+            geoms = [shapely.line_merge(shapely.multilinestrings(geoms[classes == c])) for c in present]
+            classes = present
+        df = gpd.GeoDataFrame({'class': classes}, geometry=geoms, crs=self.roads_gdf.crs)
+        colors = self.road_class_colors
         folium.GeoJson(
             df, 
-            style_function=style_function, 
-            popup=popup_function
+            style_function=lambda feature: {
+                'fillOpacity': 0.5, 
+                'weight': 2, 
+                'color': colors[feature['properties']['class']], 
+            }, 
         ).add_to(m)
                 
     def plotLines_s2h(self, m): 
-        if self.hub_network != 'none': 
-            macroHubs = [hub for hub in self.hubs if hub.hubType == 'macro']
-            for hub in self.hubs: 
-                if hub.supplier_ids: 
-                    for supplier_id in hub.supplier_ids: 
-                        suppliers = self.suppliers if hub.hubType == 'macro' else macroHubs
-                        supplier = [s for s in suppliers if s.unique_id == supplier_id][0]
-                        folium.PolyLine(
-                            locations=[supplier.coords, hub.coords], weight=1, 
-                            color='#454545', dash_array='5'
-                        ).add_to(m)
-        else: 
-            sites = self.construction_sites
-            for supplier in self.suppliers: 
-                for site in sites: 
-                    folium.PolyLine(
-                        locations=[supplier.coords, site.coords], weight=1, 
-                        color='#454545', dash_array='5'
-                    ).add_to(m)
+        '''deliveries into hubs (from suppliers and macro hubs), or from suppliers to construction sites 
+        when there are no hubs, as one line layer with a line per origin / destination pair (see 
+        get_flows), weighted by tons delivered'''
+        flows = self.get_flows()
+        supplier_ids = {supplier.unique_id for supplier in self.suppliers}
+        hub_ids = {hub.unique_id for hub in self.hubs}
+        flows = flows[flows.origin_id.isin(supplier_ids) | flows.destination_id.isin(hub_ids)]
+        coords = {agent.unique_id: agent.coords for agent in self.suppliers + self.hubs + self.construction_sites}
+        self.add_lines_layer(m, [coords[i] for i in flows.origin_id], [coords[i] for i in flows.destination_id], 
+                             properties=flows[['tons', 'nTrips']].round(1), weight_column='tons')
                 
+    def get_demSite_visits(self): 
+        '''demolition sites visited by hubs, with the number of collections from each: 
+        DataFrame with unique_id, hub_ids (the hubs collecting there), visits and geometry'''
+        ids = [np.asarray(hub.demolition_site_ids, dtype=int) for hub in self.hubs]
+        hub_ids = np.repeat([hub.unique_id for hub in self.hubs], [len(i) for i in ids]).astype(int)
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=int)
+        demSite_ids, visits = np.unique(ids, return_counts=True)
+        demSites = self.demolition_sites_df.set_index(self.demolition_sites_df.unique_id.astype(int))
+        demSites = demSites.loc[demSite_ids, ['geometry']].rename_axis('unique_id').reset_index()
+        demSites['visits'] = visits
+        pairs = np.unique(np.column_stack([ids, hub_ids]), axis=0)
+        demSites['hub_ids'] = np.split(pairs[:, 1], np.searchsorted(pairs[:, 0], demSite_ids[1:]))
+        return demSites
+    
     def plotLines_d2h(self, m):
-        for hub in self.hubs: 
-            coords_hub = hub.coords
-            demSite_ids = list(set(hub.demolition_site_ids))
-            for demSite_id in demSite_ids:
-                demSites = self.demolition_sites_df
-                demSite = demSites[demSites.unique_id == demSite_id].iloc[0]
-                coord_demSite = (demSite.geometry.y, demSite.geometry.x)
-                folium.PolyLine(
-                    locations=[coords_hub, coord_demSite], weight=1, 
-                    color='#454545', dash_array='5'
-                ).add_to(m)
+        demSites = self.get_demSite_visits()
+        hub_coords = {hub.unique_id: hub.coords for hub in self.hubs}
+        hub_ids = np.concatenate(demSites.hub_ids.tolist()) if len(demSites) else np.zeros(0, dtype=int)
+        n_hubs = demSites.hub_ids.map(len).to_numpy()
+        coords_demSites = np.repeat(np.column_stack([demSites.geometry.y, demSites.geometry.x]), n_hubs, axis=0)
+        self.add_lines_layer(m, [hub_coords[hub_id] for hub_id in hub_ids], coords_demSites)
         
     def plotPoints_demSites(self, m, color, radius): 
-        for hub in self.hubs: 
-            demSite_ids = list(set(hub.demolition_site_ids))
-            for demSite_id in demSite_ids: 
-                demSites = self.demolition_sites_df
-                demSite = demSites[demSites.unique_id == demSite_id].iloc[0]
-                coord = (demSite.geometry.y, demSite.geometry.x)
-                folium.CircleMarker(
-                    location=coord, radius=radius, color=color, 
-                    popup=folium.Popup(f'id: {demSite.unique_id}', max_width=300)
-                ).add_to(m)
+        demSites = self.get_demSite_visits()
+        self.add_points_layer(m, demSites.unique_id, np.column_stack([demSites.geometry.y, demSites.geometry.x]), 
+                              color, radius, visits=demSites.visits)
                 
     def plotPoints_hubs(self, m, color):
-        self.plotPoints(m, [hub for hub in self.hubs if hub.hubType == 'macro'], color, 5)
+        macroHubs = [hub for hub in self.hubs if hub.hubType == 'macro']
+        self.plotPoints(m, macroHubs, color, 5)
         if self.hub_network == 'decentralized': 
-            for macroHub in [h for h in self.hubs if h.hubType == 'macro']: 
-                for client_id in macroHub.client_ids: 
-                    if client_id in [h.unique_id for h in self.hubs]: 
-                        microHub = [h for h in self.hubs if h.unique_id == client_id][0]
-                        folium.CircleMarker(
-                            location=microHub.coords, radius=1, color=color, 
-                            popup=folium.Popup(f'id: {microHub.unique_id}', max_width=300)
-                        ).add_to(m)
-
+            client_ids = {client_id for macroHub in macroHubs for client_id in macroHub.client_ids}
+            self.plotPoints(m, [hub for hub in self.hubs if hub.unique_id in client_ids], color, 1)
 
 import ipywidgets as widgets
 from IPython.display import display
@@ -916,6 +2271,475 @@ params_conversion = {
                       'conventional': 'none'}
 }
 
+def make_scenarios(param_grid=None): 
+    '''cartesian product of param_grid = {'hub_network': ['centralized', ... ], ... } 
+    (defaults to params_options), with values converted using params_conversion
+    returns [parameters_dict, parameters_dict, ... ]'''
+    param_grid = params_options if param_grid is None else param_grid
+    keys = list(param_grid.keys())
+    scenarios = []
+    for values in itertools.product(*[param_grid[key] for key in keys]): 
+        parameters_dict = dict(zip(keys, values))
+        for key, value in parameters_dict.items(): 
+            if key in params_conversion: 
+                parameters_dict[key] = params_conversion[key].get(value, value)
+        scenarios.append(parameters_dict)
+    return scenarios
+
+def run_scenario(parameters_dict, n_steps=None, seed=None, max_steps=100): 
+    '''run one model for n_steps (or until complete, see Model.run_until_complete) 
+    and return its emissions per step as a DataFrame'''
+    model = Model(parameters_dict, seed=seed)
+    if n_steps is None: 
+        model.run_until_complete(max_steps)
+    else: 
+        for i in range(n_steps): 
+            model.step()
+    df = model.datacollector.get_model_vars_dataframe().reset_index(names='step')
+    df['steps_taken'] = model.steps_taken
+    return df
+
+def make_executor(n_workers=None): 
+    '''process pool for model runs. Inputs are loaded before forking, so workers share them 
+    copy-on-write where the platform supports it'''
+    load_model_data()
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    return ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(method))
+
+def run_sweep(param_grid=None, n_replicates=1, n_workers=None, n_steps=None, seed=None, results_path=None, 
+              max_steps=100, common_random_numbers=False): 
+    '''run every scenario in param_grid (see make_scenarios) n_replicates times over a process pool, 
+    for n_steps or until complete (see run_scenario). Every run gets its own seed spawned from seed, 
+    or with common_random_numbers, replicate r of every scenario gets the same seed (see run_paired_sweep). 
+    Results are collected as runs finish (and appended to results_path as csv, if given) into one 
+    table with a row per scenario / replicate / step.'''
+    scenarios = make_scenarios(param_grid)
+    runs = [(scenario_id, replicate) for scenario_id in range(len(scenarios)) for replicate in range(n_replicates)]
+    if common_random_numbers: 
+        replicate_seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+        seeds = [replicate_seeds[replicate] for scenario_id, replicate in runs]
+    else: 
+        seeds = np.random.SeedSequence(seed).spawn(len(runs))
+    
+    results = []
+    with make_executor(n_workers) as executor: 
+        futures = {
+            executor.submit(run_scenario, scenarios[scenario_id], n_steps, int(run_seed.generate_state(1)[0]), max_steps): 
+            (scenario_id, replicate) for (scenario_id, replicate), run_seed in zip(runs, seeds)
+        }
+        for future in as_completed(futures): 
+            scenario_id, replicate = futures[future]
+            df = future.result()
+            df.insert(0, 'replicate', replicate)
+            df.insert(0, 'scenario_id', scenario_id)
+            for key, value in scenarios[scenario_id].items(): 
+                df[key] = value
+            if results_path is not None: 
+                df.to_csv(results_path, mode='a', index=False, header=not results)
+            results.append(df)
+    
+    return pd.concat(results).sort_values(['scenario_id', 'replicate', 'step']).reset_index(drop=True)
+
+def t_quantile(p, dof): 
+    '''quantile p of Student's t distribution with dof degrees of freedom 
+    (exact for 1 and 2, Cornish-Fisher expansion otherwise)'''
+    if dof == 1: 
+        return math.tan(math.pi * (p - 0.5))
+    if dof == 2: 
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    g = [(z ** 3 + z) / 4, 
+         (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96, 
+         (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384, 
+         (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160]
+    return z + sum(gi / dof ** (i + 1) for i, gi in enumerate(g))
+
+def summarize_paired_differences(values, scenarios, baseline=0, confidence=0.95): 
+    '''values = (n_scenarios, n_replicates) metric per scenario and replicate, where replicate r of every 
+    scenario ran with the same seed. returns a row per scenario with its mean, the mean paired 
+    difference to the baseline scenario and its confidence interval, and the confidence interval width 
+    the same replicates would give without pairing'''
+    n = values.shape[1]
+    t = t_quantile(0.5 + confidence / 2, n - 1) if n > 1 else np.inf
+    differences = values - values[baseline]
+    rows = []
+    for scenario_id, parameters_dict in enumerate(scenarios): 
+        mean = differences[scenario_id].mean()
+        half_width = t * differences[scenario_id].std(ddof=1) / math.sqrt(n) if n > 1 else np.inf
+        half_width_unpaired = t * math.sqrt((values[scenario_id].var(ddof=1) + values[baseline].var(ddof=1)) / n) \
+            if n > 1 else np.inf
+        rows.append(dict(parameters_dict, scenario_id=scenario_id, mean=values[scenario_id].mean(), 
+                         mean_difference=mean, ci_low=mean - half_width, ci_high=mean + half_width, 
+                         ci_width_unpaired=2 * half_width_unpaired, n_replicates=n))
+    return pd.DataFrame(rows)
+
+def run_paired_sweep(param_grid=None, baseline=0, metric='emissions_total', ci_width=None, rel_ci_width=0.05, 
+                     confidence=0.95, min_replicates=3, max_replicates=30, n_workers=None, seed=None, max_steps=100): 
+    '''compare every scenario in param_grid with a baseline scenario (index into make_scenarios) using 
+    common random numbers: replicate r of every scenario runs with the same seed, so every site and hub 
+    draws the same random numbers in each scenario (see Model.make_rng) and most noise cancels in the 
+    paired differences. Replicates are added in batches until the confidence interval of every 
+    difference is narrower than ci_width (or rel_ci_width x |mean difference|), or max_replicates is 
+    reached. metric = final value of a DataCollector column. 
+    returns the summary of summarize_paired_differences() and the metric per scenario / replicate'''
+    scenarios = make_scenarios(param_grid)
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(max_replicates)]
+    values = np.full((len(scenarios), max_replicates), np.nan)
+    n = 0
+    batch = min_replicates
+    with make_executor(n_workers) as executor: 
+        while n < max_replicates: 
+            replicates = range(n, min(n + batch, max_replicates))
+            futures = {
+                executor.submit(run_scenario, scenarios[scenario_id], None, seeds[replicate], max_steps): 
+                (scenario_id, replicate) for replicate in replicates for scenario_id in range(len(scenarios))
+            }
+            for future in as_completed(futures): 
+                scenario_id, replicate = futures[future]
+                values[scenario_id, replicate] = future.result()[metric].iloc[-1]
+            n = replicates.stop
+            
+            summary = summarize_paired_differences(values[:, :n], scenarios, baseline, confidence)
+            compared = summary.scenario_id != baseline
+            widths = (summary.ci_high - summary.ci_low)[compared]
+            targets = ci_width if ci_width is not None else rel_ci_width * summary.mean_difference.abs()[compared]
+            if n >= min_replicates and (widths <= targets).all(): 
+                break
+            # next batch: enough runs to keep every worker busy
+            batch = max(1, math.ceil((n_workers or os.cpu_count()) / len(scenarios)))
+    
+    runs = pd.DataFrame([dict(scenario_id=scenario_id, replicate=replicate, seed=seeds[replicate], 
+                              **{metric: values[scenario_id, replicate]}) 
+                         for scenario_id in range(len(scenarios)) for replicate in range(n)])
+    return summary, runs
+
+
+class RunningStats: 
+    '''mean and variance of a vector of metrics over replicates, updated one replicate at a time 
+    with Welford's algorithm, so replicates can be dropped as soon as they are added'''
+    def __init__(self, n_metrics): 
+        self.n = 0
+        self.mean = np.zeros(n_metrics)
+        self.m2 = np.zeros(n_metrics)
+    
+    def add(self, values): 
+        self.n += 1
+        delta = values - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (values - self.mean)
+    
+    @property
+    def std(self): 
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.full(len(self.mean), np.inf)
+    
+    def half_width(self, confidence=0.95): 
+        '''half width of the t confidence interval of the means'''
+        if self.n < 2: 
+            return np.full(len(self.mean), np.inf)
+        return t_quantile(0.5 + confidence / 2, self.n - 1) * self.std / math.sqrt(self.n)
+    
+    def rel_half_width(self, confidence=0.95): 
+        '''half width relative to |mean| (0 for metrics that are always 0)'''
+        half_width = self.half_width(confidence)
+        with np.errstate(divide='ignore', invalid='ignore'): 
+            return np.where(half_width == 0, 0., half_width / np.abs(self.mean))
+
+def summarize_replicate(parameters_dict, seed=None, max_steps=100): 
+    '''run one model until complete and return only its final results (see Model.make_results_table, 
+    with the emissions split into site-to-hub and hub-to-site), so workers do not ship models back'''
+    model = Model(parameters_dict, seed=seed)
+    model.run_until_complete(max_steps)
+    results = model.make_results_table()
+    emissions = pd.DataFrame({
+        'result_name': ['emissions_s2h', 'emissions_h2c', 'emissions_total'], 
+        'value': [model.emissions_s2h, model.emissions_h2c, model.emissions_s2h + model.emissions_h2c], 
+        'unit': pollutant_units[0], 
+        'area': 'whole model', 
+    })
+    return pd.concat([emissions, results], ignore_index=True)
+
+def run_replicates(parameters_dict, rel_tol=0.05, max_reps=100, min_reps=3, confidence=0.95, 
+                   stop_on=('emissions_total',), n_workers=None, seed=None, max_steps=100): 
+    '''run replicates of one scenario over a process pool until the confidence interval half width of 
+    every metric in stop_on (result_names of the whole model, None = every metric incl. zones) is below 
+    rel_tol x |mean|, or max_reps replicates have run. Replicates are folded into RunningStats in 
+    replicate order as they finish, so the result does not depend on which worker finishes first. 
+    returns a row per result_name / area with mean, std and confidence interval over the replicates'''
+    if max_reps < 1: 
+        raise ValueError(f'max_reps must be at least 1, not {max_reps}')
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(max_reps)]
+    n_workers = n_workers or os.cpu_count()
+    stats = None
+    finished = {}
+    n = 0
+    converged = False
+    with make_executor(n_workers) as executor: 
+        futures = {}
+        while n < max_reps and not converged: 
+            # keep every worker busy
+            while n + len(futures) + len(finished) < max_reps and len(futures) < n_workers: 
+                replicate = n + len(futures) + len(finished)
+                futures[executor.submit(summarize_replicate, parameters_dict, seeds[replicate], max_steps)] = replicate
+            
+            future = next(as_completed(futures))
+            finished[futures.pop(future)] = future.result()
+            
+            while n in finished and not converged: 
+                results = finished.pop(n)
+                if stats is None: 
+                    index = results[['result_name', 'unit', 'area']]
+                    stats = RunningStats(len(index))
+                    stopping = np.ones(len(index), dtype=bool) if stop_on is None else \
+                        ((index.area == 'whole model') & index.result_name.isin(stop_on)).values
+                stats.add(results.value.values)
+                n += 1
+                converged = n >= min_reps and (stats.rel_half_width(confidence)[stopping] <= rel_tol).all()
+        for future in futures: 
+            future.cancel()
+    
+    half_width = stats.half_width(confidence)
+    summary = index.assign(mean=stats.mean, std=stats.std, ci_low=stats.mean - half_width, 
+                           ci_high=stats.mean + half_width, rel_half_width=stats.rel_half_width(confidence), 
+                           n_replicates=stats.n, converged=converged)
+    return summary
+
+def estimate_scenario(parameters_dict, data=None): 
+    '''expected emissions and road trips of a scenario without running the agents, see Model.estimate()'''
+    return Model(parameters_dict, data=data).estimate()
+
+def validate_estimates(param_grid=None, n_replicates=5, n_workers=None, seed=None, max_steps=100): 
+    '''compare estimate_scenario() with the mean of n_replicates agent based model runs (see run_sweep) 
+    for every scenario in param_grid. returns a row per scenario with estimated and simulated emissions 
+    and their relative error. Runs that stop at max_steps before completing make the simulated emissions 
+    smaller than the estimates, so max_steps should be large enough for every scenario to complete'''
+    sweep = run_sweep(param_grid, n_replicates, n_workers, seed=seed, max_steps=max_steps)
+    final = sweep.sort_values('step').groupby(['scenario_id', 'replicate']).last()
+    columns = ['emissions_s2h', 'emissions_h2c', 'emissions_total']
+    simulated = final.groupby('scenario_id')[columns].mean()
+    
+    rows = []
+    for scenario_id, parameters_dict in enumerate(make_scenarios(param_grid)): 
+        estimates = estimate_scenario(parameters_dict)
+        row = dict(parameters_dict, scenario_id=scenario_id)
+        for column in columns: 
+            row[f'{column}_estimated'] = estimates[column]
+            row[f'{column}_simulated'] = simulated.loc[scenario_id, column]
+            row[f'{column}_relError'] = (estimates[column] - row[f'{column}_simulated']) / row[f'{column}_simulated']
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def haversine_matrix(coords_a, coords_b): 
+    '''great circle distances in km between every (lat, lon) in coords_a and every (lat, lon) in coords_b'''
+    lat_a, lon_a = np.radians(np.asarray(coords_a, dtype=float)).T
+    lat_b, lon_b = np.radians(np.asarray(coords_b, dtype=float)).T
+    a = (np.sin((lat_b[None, :] - lat_a[:, None]) / 2) ** 2 + 
+         np.cos(lat_a[:, None]) * np.cos(lat_b[None, :]) * np.sin((lon_b[None, :] - lon_a[:, None]) / 2) ** 2)
+    return 2 * 6371.0088 * np.arcsin(np.sqrt(a))
+
+class HubSiting: 
+    '''choose the locations of n_hubs micro hubs from candidate locations (hubs_candidateLocations.shp) 
+    that minimise the expected emissions or road damage of a decentralized hub network. Only micro hubs 
+    are sited: macro hubs are kept fixed at their locations in hubs.shp (with their od distances and road 
+    routes, see ModelData.with_hubs) and n_hubs counts micro hubs only. As in the model, every site is 
+    served by its nearest hub and every micro hub by its nearest macro hub. 
+    The objective is built from the analytical estimates of Model.estimate(): the delivery cost per km of 
+    every site with every vehicle is computed once, and micro hub supply costs follow from the tons each 
+    hub serves. Moves are evaluated from the nearest and second nearest hub of every site, without 
+    running the model. Distances to candidates are straight-line distances times the median detour 
+    factor of the existing od matrices, and road damage is measured as damage x km, since candidate 
+    locations have no road routes. Materials without a vehicle capacity are left out. 
+    siting = HubSiting(parameters_dict, n_hubs=20)
+    hubs_df = siting.optimize()
+    siting.validate()'''
+    def __init__(self, parameters_dict, n_hubs, objective='emissions', candidates_df=None, data=None, seed=None): 
+        if parameters_dict['hub_network'] != 'decentralized': 
+            raise ValueError('hub siting needs a decentralized hub network')
+        if objective not in ['emissions', 'damage']: 
+            raise ValueError(f"objective must be 'emissions' or 'damage', not {objective!r}")
+        self.parameters_dict = parameters_dict
+        self.objective = objective
+        self.data = load_model_data() if data is None else data
+        self.rng = np.random.default_rng(seed)
+        self.model = Model(parameters_dict, data=self.data)
+        if candidates_df is None: 
+            candidates_df = gpd.read_file(f'{self.data.data_path}/hubs_candidateLocations.shp')
+        self.candidates_df = self.prepare_candidates(candidates_df)
+        if n_hubs > len(self.candidates_df): 
+            raise ValueError(f'{n_hubs} hubs requested, but there are {len(self.candidates_df)} candidate locations')
+        self.n_hubs = n_hubs
+        self.make_costs()
+        self.set_open([])
+    
+    def prepare_candidates(self, candidates_df): 
+        '''candidate locations as micro hubs, with inA10 from a10.shp and (unless given) not waterbound'''
+        candidates_df = candidates_df.to_crs(self.data.hubs_df.crs).reset_index(drop=True)
+        candidates_df['hub_type'] = 'micro'
+        if 'inA10' not in candidates_df.columns: 
+            a10 = gpd.read_file(f'{self.data.data_path}/a10.shp').to_crs(candidates_df.crs).union_all()
+            candidates_df['inA10'] = candidates_df.within(a10).astype(int)
+        if 'waterbound' not in candidates_df.columns: 
+            candidates_df['waterbound'] = 0
+        return candidates_df
+    
+    def make_costs(self): 
+        '''facilities = the model's macro hubs (always open) followed by the candidates. 
+        self.site_costs[site, facility] = expected cost of serving a site from a facility 
+        self.dist_toMacro[facility], self.leg_vehicles = supply leg of every micro hub'''
+        model = self.model
+        sites = model.construction_sites
+        self.macroHubs = [hub for hub in model.hubs if hub.hubType == 'macro']
+        self.n_fixed = len(self.macroHubs)
+        site_coords = np.array([site.coords for site in sites])
+        candidate_coords = np.column_stack([self.candidates_df.geometry.y, self.candidates_df.geometry.x])
+        
+        # detour factor of road distances over straight-line distances
+        site_ids = [site.unique_id for site in sites]
+        road = model.dist_h2c[np.ix_([hub.unique_id for hub in model.hubs], site_ids)]
+        straight = haversine_matrix([hub.coords for hub in model.hubs], site_coords)
+        valid = np.isfinite(road) & (straight > 0)
+        self.detour_factor = np.median(road[valid] / straight[valid])
+        
+        macro_dist = model.dist_h2c[np.ix_([hub.unique_id for hub in self.macroHubs], site_ids)].T
+        self.dist = np.hstack([macro_dist, haversine_matrix(site_coords, candidate_coords) * self.detour_factor])
+        # (inA10, waterbound) of every facility 
+        facilities = [(hub.inA10, hub.waterbound) for hub in self.macroHubs]
+        facilities += [(row.inA10, row.waterbound) for row in self.candidates_df.itertuples()]
+        self.n_facilities = len(facilities)
+        
+        # expected delivery cost per km of every site, for every vehicle a hub can send 
+        # (vehicles are cached by the model, so they are keyed by id)
+        self.required = model.get_site_required()
+        n_full, share_last = expected_request_counts(1)
+        self.n_steps = n_full + 1
+        perKm = {}
+        self.site_costs = np.empty(self.dist.shape)
+        for f, (inA10, waterbound) in enumerate(facilities): 
+            for s, site in enumerate(sites): 
+                vehicle = get_vehicle_forClient(model, inA10, waterbound, site.inA10, site.waterbound)
+                if id(vehicle) not in perKm: 
+                    capacity = model.get_capacities(vehicle)
+                    nTrips, emissions = model.estimate_deliveries(self.required, capacity, vehicle, 1, n_full, share_last)
+                    perKm[id(vehicle)] = self.cost(nTrips, emissions, capacity, vehicle, 1)
+                self.site_costs[s, f] = perKm[id(vehicle)][s] * self.dist[s, f]
+        
+        # supply leg of every candidate from its nearest macro hub 
+        macro_coords = [hub.coords for hub in self.macroHubs]
+        dist_toMacro = haversine_matrix(candidate_coords, macro_coords) * self.detour_factor
+        nearest_macro = np.argmin(dist_toMacro, axis=1)
+        self.dist_toMacro = np.concatenate([np.zeros(self.n_fixed), dist_toMacro.min(axis=1)])
+        leg_groups = {}
+        for c, m in enumerate(nearest_macro): 
+            vehicle = get_vehicle_forClient(model, self.macroHubs[m].inA10, self.macroHubs[m].waterbound, 
+                                            *facilities[self.n_fixed + c])
+            leg_groups.setdefault(id(vehicle), (vehicle, []))[1].append(self.n_fixed + c)
+        self.leg_groups = [(vehicle, np.array(f)) for vehicle, f in leg_groups.values()]
+    
+    def cost(self, nTrips, emissions, capacity, vehicle, distance): 
+        '''emissions, or road damage x km, summed over the last two axes (strucType, material)'''
+        if self.objective == 'emissions': 
+            return np.nansum(emissions, axis=(-2, -1))
+        if vehicle.transportation_network != 'road': 
+            return np.zeros(np.shape(nTrips)[:-2])
+        return np.nansum((capacity / vehicle.nAxels) ** 4 * nTrips * distance, axis=(-2, -1))
+    
+    def evaluate(self, nearest): 
+        '''objective when every site is served by facility nearest[site]'''
+        total_cost = self.site_costs[np.arange(len(nearest)), nearest].sum()
+        totals = np.zeros((self.n_facilities,) + self.required.shape[1:])
+        np.add.at(totals, nearest, self.required)
+        for vehicle, f in self.leg_groups: 
+            f = f[totals[f].any(axis=(1, 2))]
+            if len(f): 
+                distance = self.dist_toMacro[f][:, None, None]
+                capacity = self.model.get_capacities(vehicle)
+                nTrips, emissions = self.model.estimate_aggregated(totals[f], capacity, vehicle, distance, self.n_steps)
+                total_cost += self.cost(nTrips, emissions, capacity, vehicle, distance).sum()
+        return total_cost
+    
+    def set_open(self, candidates): 
+        '''open the macro hubs and the given candidates (positions in candidates_df) 
+        self.assignment = nearest and second nearest open facility of every site (ids = facility positions)'''
+        self.chosen = sorted(int(c) for c in candidates)
+        is_open = np.zeros(self.n_facilities, dtype=bool)
+        is_open[:self.n_fixed] = True
+        is_open[[self.n_fixed + c for c in self.chosen]] = True
+        self.assignment = HubAssignment(self.dist, np.arange(self.n_facilities), is_open)
+        self.objective_value = self.evaluate(self.assignment.nearest)
+    
+    def swap(self, add=None, remove=None, value=None): 
+        '''open candidate add and / or close candidate remove, updating only the affected sites'''
+        if remove is not None: 
+            self.assignment.remove(self.n_fixed + remove)
+            self.chosen.remove(remove)
+        if add is not None: 
+            self.assignment.add(self.n_fixed + add)
+            self.chosen = sorted(self.chosen + [add])
+        self.objective_value = self.evaluate(self.assignment.nearest) if value is None else value
+    
+    def nearest_after(self, add=None, remove=None): 
+        '''nearest facility of every site after opening candidate add and / or closing candidate remove'''
+        return self.assignment.nearest_after(None if add is None else self.n_fixed + add, 
+                                             None if remove is None else self.n_fixed + remove)
+    
+    def first_guess(self): 
+        '''open candidates one at a time, each time the one that lowers the objective most'''
+        self.set_open([])
+        while len(self.chosen) < self.n_hubs: 
+            closed = [c for c in range(len(self.candidates_df)) if c not in self.chosen]
+            costs = [self.evaluate(self.nearest_after(add=c)) for c in closed]
+            self.swap(add=closed[int(np.argmin(costs))], value=min(costs))
+        return self.chosen
+    
+    def optimize(self, n_iterations=2000, temperature=None, cooling=0.998): 
+        '''simulated annealing over swaps (close a chosen candidate, open another one), starting from 
+        first_guess(). temperature = starting temperature (default: 1% of the average cost per hub). 
+        returns the hubs_df of the best network found'''
+        if len(self.chosen) != self.n_hubs: 
+            self.first_guess()
+        best, best_value = list(self.chosen), self.objective_value
+        temperature = 0.01 * self.objective_value / max(self.n_hubs, 1) if temperature is None else temperature
+        for i in range(n_iterations): 
+            if not self.chosen or len(self.chosen) == len(self.candidates_df): 
+                break
+            remove = self.rng.choice(self.chosen)
+            add = self.rng.choice([c for c in range(len(self.candidates_df)) if c not in self.chosen])
+            value = self.evaluate(self.nearest_after(add, remove))
+            delta = value - self.objective_value
+            if delta < 0 or self.rng.random() < math.exp(-delta / max(temperature, 1e-12)): 
+                self.swap(add, remove, value)
+                if self.objective_value < best_value: 
+                    best, best_value = list(self.chosen), self.objective_value
+            temperature *= cooling
+        self.set_open(best)
+        return self.hubs_df()
+    
+    def hubs_df(self): 
+        '''macro hubs of the model data and the chosen candidates, in the layout of hubs.shp'''
+        columns = ['hub_type', 'inA10', 'waterbound', 'geometry']
+        macro = self.data.hubs_df[self.data.hubs_df.hub_type == 'macro'][columns]
+        return pd.concat([macro, self.candidates_df.iloc[self.chosen][columns]], ignore_index=True)
+    
+    def validate(self, n_replicates=1, max_steps=100, seed=None): 
+        '''run the agent based model with the chosen hubs (see ModelData.with_hubs) and compare its 
+        emissions with the analytical estimate, for the chosen and the current hub network'''
+        data = self.data.with_hubs(self.hubs_df(), self.detour_factor)
+        columns = ['emissions_s2h', 'emissions_h2c', 'emissions_total']
+        seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+        runs = []
+        for s in seeds: 
+            model = Model(self.parameters_dict, seed=int(s.generate_state(1)[0]), data=data)
+            model.run_until_complete(max_steps)
+            runs.append([getattr(model, column) if column != 'emissions_total' 
+                         else model.emissions_s2h + model.emissions_h2c for column in columns])
+        estimated = Model(self.parameters_dict, data=data).estimate()
+        estimated_current = self.model.estimate()
+        return pd.DataFrame({
+            'simulated': np.mean(runs, axis=0), 
+            'estimated': [estimated[column] for column in columns], 
+            'estimated_currentHubs': [estimated_current[column] for column in columns], 
+        }, index=columns)
+
 import streamlit as st
 
 def main():
@@ -933,12 +2757,12 @@ def main():
     if st.button("Run model!"):
         # create and run model 
         model = Model(parameters_dict)
-        for i in range(2): 
-            model.step()
+        model.run_until_complete()
 
         emissions_text, fig_emissions, fig_materials, map_html = model.visualize()
 
         # visualize in Streamlit
+        st.write(f'steps taken: {model.steps_taken}')
         st.write(emissions_text)
         col1, col2 = st.columns(2)
         col1.write(fig_emissions)
@@ -0,0 +1,160 @@
+'''a small synthetic dataset in the layout of data/data_cleaned, written once per test session:
+12 construction sites, 2 suppliers, 2 macro and 3 micro hubs, 15 demolition sites and 40 roads around
+Amsterdam, with od matrices and road routes for every pair the model looks up'''
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import LineString, Point, box
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import model
+
+materials = ['timber', 'concrete', 'steel', 'modules']
+demSite_materials = ['timber', 'concrete', 'steel', 'other']
+crs = 'EPSG:4326'
+bounds = (4.80, 52.30, 5.00, 52.42) # lon_min, lat_min, lon_max, lat_max
+a10 = box(4.85, 52.33, 4.95, 52.39)
+
+base_params = {'hub_network': 'decentralized', 'network_type': 'road', 'truck_type': 'diesel',
+               'biobased_type': 'none', 'modularity_type': 'none', 'circularity_type': 'none'}
+
+
+def random_points(rng, n):
+    lon = rng.uniform(bounds[0], bounds[2], n)
+    lat = rng.uniform(bounds[1], bounds[3], n)
+    return [Point(x, y) for x, y in zip(lon, lat)]
+
+def points_df(points, **columns):
+    df = gpd.GeoDataFrame(columns, geometry=points, crs=crs)
+    if 'inA10' not in columns:
+        df['inA10'] = [int(a10.contains(p)) for p in points]
+    return df
+
+def coords(df):
+    return np.column_stack([df.geometry.y, df.geometry.x])
+
+def write_od_matrix(path, name, origin_ids, origin_df, destination_ids, destination_df):
+    dist = model.haversine_matrix(coords(origin_df), coords(destination_df)) * 1.3
+    od = np.column_stack([np.repeat(origin_ids, len(destination_ids)),
+                          np.tile(destination_ids, len(origin_ids)), dist.ravel()]).astype(float)
+    np.save(f'{path}/od_matrix_{name}.npy', od)
+
+def write_routes(path, name, pairs, n_roads, rng):
+    keys = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    routes = [np.sort(rng.choice(n_roads, rng.integers(2, 6), replace=False)) for _ in pairs]
+    indptr = np.concatenate([[0], np.cumsum([len(r) for r in routes])]).astype(np.int64)
+    indices = np.concatenate(routes).astype(np.int32)
+    model.RouteStore(keys, indptr, indices).save(path, name)
+
+def vehicles_table(capacity_materials):
+    rows = [('urban', 'road', 'diesel', 12, 0.00020, 2, 1.2, 0.020, 0.030),
+            ('urban', 'road', 'electric', 12, 0.00005, 2, 0.1, 0.010, 0.020),
+            ('urban', 'water', 'water', 60, 0.00010, 4, 3.0, 0.050, 0.060),
+            ('international', 'road', 'diesel', 40, 0.00010, 5, 2.0, 0.040, 0.050),
+            ('international', 'water', 'water', 400, 0.00003, 8, 6.0, 0.100, 0.120),
+            ('international', 'rail', 'rail', 800, 0.00002, 12, 4.0, 0.080, 0.090)]
+    df = pd.DataFrame(rows, columns=['region', 'transportation_network', 'vehicle_type', 'vehicle_weight',
+                                     'emissions_perTonKm', 'nAxels', 'emissions_perKm_gNOX',
+                                     'emissions_perKm_gPM2p5', 'emissions_perKm_gPM10'])
+    df.insert(0, 'vehicle_name', [f'vehicle_{i}' for i in range(len(df))])
+    scale = df.vehicle_weight.to_numpy() / 12
+    for i, mat in enumerate(capacity_materials):
+        df[f'capacity_{mat}'] = np.round((8 + 3 * i) * scale, 1)
+    return df
+
+def write_dataset(path, seed=0):
+    rng = np.random.default_rng(seed)
+
+    roads = []
+    for x, y in zip(rng.uniform(bounds[0], bounds[2], 40), rng.uniform(bounds[1], bounds[3], 40)):
+        roads.append(LineString([(x, y), (x + rng.uniform(-0.01, 0.01), y + rng.uniform(-0.01, 0.01)),
+                                 (x + rng.uniform(-0.02, 0.02), y + rng.uniform(-0.02, 0.02))]))
+    roads_gdf = gpd.GeoDataFrame({'osmid': np.arange(1000, 1000 + len(roads)),
+                                  'highway': rng.choice(['primary', 'secondary', 'residential'], len(roads))},
+                                 geometry=roads, crs=crs)
+    roads_gdf.to_file(f'{path}/ams_roads_edges.shp')
+
+    sites = points_df(random_points(rng, 12), buildType=rng.choice(['A', 'B'], 12),
+                      waterbound=rng.integers(0, 2, 12))
+    suppliers = points_df(random_points(rng, 2), material=['national', 'international'],
+                          distAms=[60.0, 250.0], lat=0.0, lng=0.0)
+    hubs = points_df(random_points(rng, 5), hub_type=['macro', 'macro', 'micro', 'micro', 'micro'],
+                     waterbound=[1, 0, 1, 0, 1])
+    demSites = points_df(random_points(rng, 15), unique_id=19 + np.arange(15),
+                         waterbound=rng.integers(0, 2, 15),
+                         **{mat: np.round(rng.uniform(5, 60, 15), 1) for mat in demSite_materials})
+    candidates = gpd.GeoDataFrame(geometry=random_points(rng, 8), crs=crs)
+    sites.to_file(f'{path}/construction_sites.shp')
+    suppliers.to_file(f'{path}/suppliers.shp')
+    hubs.to_file(f'{path}/hubs.shp')
+    demSites.to_file(f'{path}/demolition_sites.shp')
+    candidates.to_file(f'{path}/hubs_candidateLocations.shp')
+    gpd.GeoDataFrame(geometry=[a10], crs=crs).to_file(f'{path}/a10.shp')
+
+    vehicles_table(materials).to_csv(f'{path}/vehicles_info.csv', index=False)
+    vehicles_table(demSite_materials).to_csv(f'{path}/vehicles_info_demSites.csv', index=False)
+    build_info = pd.DataFrame([(mat, biobased, strucType, buildingType)
+                               for mat in materials for biobased in ['none', 'full']
+                               for strucType in model.Model.strucTypes for buildingType in ['A', 'B']
+                               if mat != 'modules' or strucType == 'non-structural'],
+                              columns=['material', 'biobased_type', 'structural_type', 'buildingType'])
+    build_info['tons'] = np.round(rng.uniform(40, 250, len(build_info)), 1)
+    # the other biobased types of params_options, drawn apart so the rest of the dataset is unchanged
+    more_rng = np.random.default_rng(seed + 1)
+    more = pd.concat([build_info[build_info.biobased_type == 'full'].assign(biobased_type=biobased)
+                      for biobased in ['semi', 'extreme']])
+    more['tons'] = np.round(more_rng.uniform(40, 250, len(more)), 1)
+    build_info = pd.concat([build_info, more], ignore_index=True)
+    build_info['unit'] = 'tons'
+    build_info.to_csv(f'{path}/buildingType_info.csv', index=False)
+    pd.DataFrame({'material': materials, 'supplier_type': ['national', 'national', 'international', 'national']
+                  }).to_csv(f'{path}/materials_logistics_info.csv', index=False)
+    pd.DataFrame({'name_from_conSiteData': materials, 'name_from_demSiteData': demSite_materials
+                  }).to_csv(f'{path}/materialNames_conversion.csv', index=False)
+
+    # unique ids as given by the model: sites, suppliers, hubs (macro first), then demolition sites
+    site_ids = np.arange(12)
+    supplier_ids = 12 + np.arange(2)
+    hub_ids = 14 + np.arange(5)
+    macro_ids, micro_ids = hub_ids[:2], hub_ids[2:]
+    demSite_ids = demSites.unique_id.to_numpy()
+    write_od_matrix(path, 'h2c', hub_ids, hubs, site_ids, sites)
+    write_od_matrix(path, 'h2h', macro_ids, hubs.iloc[:2], hub_ids, hubs)
+    write_od_matrix(path, 'd2h', demSite_ids, demSites, hub_ids, hubs)
+
+    n_roads = len(roads_gdf)
+    write_routes(path, 'h2hc', [(h, s) for h in hub_ids for s in site_ids] +
+                               [(h, m) for h in macro_ids for m in micro_ids], n_roads, rng)
+    write_routes(path, 'd2h', [(d, h) for d in demSite_ids for h in hub_ids], n_roads, rng)
+    write_routes(path, 's2h', [(s, h) for s in supplier_ids for h in hub_ids], n_roads, rng)
+    write_routes(path, 's2c', [(s, c) for s in supplier_ids for c in site_ids], n_roads, rng)
+
+
+@pytest.fixture(scope='session')
+def data_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('data_cleaned'))
+    write_dataset(path)
+    return path
+
+@pytest.fixture(scope='session')
+def data(data_path):
+    return model.ModelData(data_path, use_cache=False)
+
+@pytest.fixture
+def params():
+    return dict(base_params)
+
+@pytest.fixture(scope='session')
+def make_model(data):
+    '''factory of models on the test data: make_model(n_steps, seed=..., array_state=..., **params) 
+    builds a Model with base_params updated by params and steps it n_steps times'''
+    def make_model(n_steps=0, seed=0, array_state=False, data=data, **params):
+        m = model.Model(dict(base_params, **params), seed=seed, data=data, array_state=array_state)
+        for _ in range(n_steps):
+            m.step()
+        return m
+    return make_model
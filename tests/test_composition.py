@@ -0,0 +1,80 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import model
+
+
+def old_composition(m, site):
+    '''rows of build_info for the building type of a site, as ConstructionSite.material_composition_df was'''
+    b = m.build_info.copy()
+    return b[(b.buildingType == site.buildingType) & (b.biobased_type == m.biobased_type)]
+
+def old_materials_required(m, site):
+    '''materials required by a site as computed with a build_info filter per material before the 
+    composition tensor (see ConstructionSite.calc_materials_required)'''
+    b = old_composition(m, site)
+    required = {strucType: {mat: 0 for mat in m.materials_list if mat != 'modules'} 
+                for strucType in ['foundation', 'structural', 'non-structural']}
+    for strucType, mat_amounts in required.items(): 
+        for mat in mat_amounts: 
+            mat_amounts[mat] += b[(b.material == mat) & (b.structural_type == strucType)].iloc[0].tons
+    if m.modularity_type != 'none': 
+        required['non-structural']['modules'] = b[b.material == 'modules'].iloc[0].tons
+    return required
+
+def old_df_materials(m):
+    dfs = [old_composition(m, site).groupby(by='material').sum(numeric_only=True).reset_index() 
+           for site in m.construction_sites]
+    return pd.concat(dfs).groupby('material').sum(numeric_only=True).reset_index()
+
+def old_df_circular(m):
+    dfs = []
+    for site in m.construction_sites: 
+        df = old_composition(m, site)
+        df['circular'] = df.structural_type.map(
+            lambda x: 'circular' if x in m.circularity_strucTypes[m.circularity_type] else 'not circular')
+        dfs.append(df.groupby('circular').sum(numeric_only=True).reset_index())
+    return pd.concat(dfs).groupby('circular').sum(numeric_only=True).reset_index()
+
+@pytest.mark.parametrize('biobased_type', ['none', 'full'])
+@pytest.mark.parametrize('circularity_type', ['none', 'semi', 'full', 'extreme'])
+def test_chart_tables_match_the_per_site_groupby(make_model, biobased_type, circularity_type):
+    m = make_model(hub_network='centralized', biobased_type=biobased_type, circularity_type=circularity_type)
+    df_mat, old_mat = m._make_df_materials(), old_df_materials(m)
+    assert list(df_mat.material) == list(old_mat.material)
+    np.testing.assert_allclose(df_mat.tons, old_mat.tons)
+    df_circ, old_circ = m._make_df_circular(), old_df_circular(m)
+    assert list(df_circ.circular) == list(old_circ.circular)
+    np.testing.assert_allclose(df_circ.tons, old_circ.tons)
+    assert df_mat.tons.sum() == pytest.approx(df_circ.tons.sum())
+
+@pytest.mark.parametrize('array_state', [False, True])
+@pytest.mark.parametrize('modularity_type', ['none', 'full'])
+@pytest.mark.parametrize('biobased_type', ['none', 'full'])
+def test_materials_required_match_the_build_info_filter(make_model, biobased_type, modularity_type, array_state):
+    m = make_model(array_state=array_state, hub_network='centralized', biobased_type=biobased_type,
+                   modularity_type=modularity_type)
+    for site in m.construction_sites: 
+        old = old_materials_required(m, site)
+        required = {strucType: dict(mat_amounts) for strucType, mat_amounts in site.materials_required.items()}
+        # the array state keeps a zero for every material, modules included
+        if array_state and modularity_type == 'none': 
+            assert required['non-structural'].pop('modules', 0) == 0
+        assert required == old
+
+def test_unknown_biobased_types_are_rejected(make_model):
+    with pytest.raises(ValueError, match='biobased_type'):
+        make_model(biobased_type='unknown')
+
+def test_building_types_without_rows_are_rejected(data_path, tmp_path, make_model):
+    shutil.copytree(data_path, tmp_path, dirs_exist_ok=True)
+    build_info = pd.read_csv(f'{tmp_path}/buildingType_info.csv')
+    build_info = build_info[(build_info.buildingType != 'B') | (build_info.biobased_type != 'full')]
+    build_info.to_csv(f'{tmp_path}/buildingType_info.csv', index=False)
+    data = model.ModelData(str(tmp_path), use_cache=False)
+    assert make_model(data=data, biobased_type='none').construction_sites
+    with pytest.raises(ValueError, match="no rows for building types \\['B'\\]"):
+        make_model(data=data, biobased_type='full')
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import model
+
+
+def test_load_model_data_is_cached_per_use_cache(data_path, monkeypatch):
+    monkeypatch.setattr(model, '_model_data', {})
+    data = model.load_model_data(data_path, use_cache=False)
+    assert model.load_model_data(data_path, use_cache=False) is data
+    cached = model.load_model_data(data_path, use_cache=True)
+    assert cached is not data
+    assert not data.use_cache and cached.use_cache
+
+@pytest.mark.parametrize('file', ['vehicles_info.csv', 'vehicles_info_demSites.csv'])
+def test_vehicles_without_emission_factors_are_rejected(data_path, tmp_path, file):
+    shutil.copytree(data_path, tmp_path, dirs_exist_ok=True)
+    vehicles = pd.read_csv(f'{tmp_path}/{file}')
+    vehicles.drop(columns='emissions_perKm_gPM10').to_csv(f'{tmp_path}/{file}', index=False)
+    with pytest.raises(ValueError, match='emissions_perKm_gPM10'):
+        model.ModelData(str(tmp_path), use_cache=False)
+
+def test_vehicles_with_missing_emission_factors_are_rejected(data_path, tmp_path):
+    shutil.copytree(data_path, tmp_path, dirs_exist_ok=True)
+    vehicles = pd.read_csv(f'{tmp_path}/vehicles_info.csv')
+    vehicles.loc[2, 'emissions_perKm_gNOX'] = np.nan
+    vehicles.to_csv(f'{tmp_path}/vehicles_info.csv', index=False)
+    with pytest.raises(ValueError, match='missing values'):
+        model.ModelData(str(tmp_path), use_cache=False)
+
+def copy_data(data_path, tmp_path):
+    '''the fixture's files, without the cache other tests may have written'''
+    shutil.copytree(data_path, tmp_path, dirs_exist_ok=True, ignore=shutil.ignore_patterns('.cache'))
+    return str(tmp_path)
+
+def fail(*args, **kwargs):
+    raise AssertionError('the source file should not be read')
+
+@pytest.mark.parametrize('file, read', [('vehicles_info.csv', 'read_csv'), ('suppliers.shp', 'read_file')])
+def test_cached_copy_is_used_while_the_source_is_unchanged(data_path, tmp_path, monkeypatch, file, read):
+    pytest.importorskip('pyarrow')
+    path = copy_data(data_path, tmp_path)
+    cache = model.DataCache(path)
+    first = getattr(cache, read)(f'{path}/{file}')
+    assert os.path.exists(f'{path}/.cache/{file}.parquet')
+    monkeypatch.setattr(model.pd, 'read_csv', fail)
+    monkeypatch.setattr(model.gpd, 'read_file', fail)
+    pd.testing.assert_frame_equal(pd.DataFrame(getattr(cache, read)(f'{path}/{file}')), pd.DataFrame(first))
+
+def test_changed_source_is_read_again(data_path, tmp_path):
+    pytest.importorskip('pyarrow')
+    path = copy_data(data_path, tmp_path)
+    cache = model.DataCache(path)
+    source = f'{path}/vehicles_info.csv'
+    vehicles = cache.read_csv(source)
+    vehicles.loc[0, 'nAxels'] = 99
+    vehicles.to_csv(source, index=False)
+    os.utime(source, ns=(0, 0)) # an older mtime, as when files are copied back
+    assert cache.read_csv(source).loc[0, 'nAxels'] == 99
+
+def test_touched_source_keeps_the_cached_copy(data_path, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    path = copy_data(data_path, tmp_path)
+    cache = model.DataCache(path)
+    source = f'{path}/vehicles_info.csv'
+    vehicles = cache.read_csv(source)
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9)) # same content, new mtime
+    monkeypatch.setattr(model.pd, 'read_csv', fail)
+    pd.testing.assert_frame_equal(cache.read_csv(source), vehicles)
+    with open(f'{path}/.cache/vehicles_info.csv.parquet.json') as f:
+        assert json.load(f)['mtimes'] == {'vehicles_info.csv': os.stat(source).st_mtime_ns}
+
+def test_road_matrix_round_trip(tmp_path):
+    roadMatrix = np.empty((3, 3), dtype=object)
+    roadMatrix[:, 0] = [1, 1, 2]
+    roadMatrix[:, 1] = [5, 6, 5]
+    roadMatrix[:, 2] = [[101, [102, 103], 101], [], [[104, 105]]]
+    source = str(tmp_path / 'roadOsmIds_matrix_h2hc.npy')
+    np.save(source, roadMatrix, allow_pickle=True)
+    cache = model.DataCache(str(tmp_path))
+    first = cache.load_road_matrix(source)
+    assert os.path.exists(str(tmp_path / '.cache' / 'roadOsmIds_matrix_h2hc.npy.npz'))
+    cached = cache.load_road_matrix(source)
+    # osmids come back as the strings they are matched with in roads_gdf (see RouteStore.from_road_matrix)
+    assert cached[:, :2].tolist() == first[:, :2].tolist()
+    assert cached[:, 2].tolist() == [['101', '102,103', '101'], [], ['104,105']]
+    osmid_positions = {'101': [0], '102,103': [1, 2], '104,105': [3]}
+    a = model.RouteStore.from_road_matrix(first, osmid_positions)
+    b = model.RouteStore.from_road_matrix(cached, osmid_positions)
+    for key in [(1, 5), (1, 6), (2, 5)]:
+        np.testing.assert_array_equal(a[key], b[key])
+
+def test_unreadable_cache_falls_back_to_the_source(data_path, tmp_path):
+    pytest.importorskip('pyarrow')
+    path = copy_data(data_path, tmp_path)
+    cache = model.DataCache(path)
+    source = f'{path}/vehicles_info.csv'
+    vehicles = cache.read_csv(source)
+    with open(f'{path}/.cache/vehicles_info.csv.parquet', 'wb') as f:
+        f.write(b'not a parquet file')
+    pd.testing.assert_frame_equal(cache.read_csv(source), vehicles)
+
+def test_unwritable_cache_falls_back_to_the_source(data_path, tmp_path):
+    path = copy_data(data_path, tmp_path)
+    with open(f'{path}/.cache', 'w') as f: # the cache folder cannot be made
+        f.write('')
+    cache = model.DataCache(path)
+    vehicles = cache.read_csv(f'{path}/vehicles_info.csv')
+    pd.testing.assert_frame_equal(vehicles, pd.read_csv(f'{path}/vehicles_info.csv'))
+    data = model.ModelData(path, use_cache=True)
+    assert len(data.roads_gdf) == 40
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import model
+
+
+def sequential_draws(stocks, request_amount, rng):
+    '''the old collection loop: draw one demolition site at a time (as DataFrame.sample(1)) and collect 
+    what is still needed, until the request is covered'''
+    sites, collected = [], []
+    while True:
+        site = int(rng.integers(len(stocks)))
+        still_needed = request_amount - sum(collected)
+        sites.append(site)
+        collected.append(still_needed if stocks[site] >= still_needed else stocks[site])
+        if sum(collected) >= request_amount:
+            return np.array(sites), np.array(collected)
+
+def ks_distance(a, b):
+    '''largest difference between the empirical distribution functions of two samples'''
+    values = np.union1d(a, b)
+    cdf_a = np.searchsorted(np.sort(a), values, side='right') / len(a)
+    cdf_b = np.searchsorted(np.sort(b), values, side='right') / len(b)
+    return np.abs(cdf_a - cdf_b).max()
+
+stocks = np.array([0., 12.5, 40., 3., 75., 0., 22., 8.])
+
+@pytest.mark.parametrize('request_amount', [0., 5., 60., 400.])
+def test_batched_draws_match_the_sequential_draws(request_amount):
+    n_seeds = 2000
+    batched = [model.draw_demolition_sites(stocks, request_amount, np.random.default_rng(seed))
+               for seed in range(n_seeds)]
+    sequential = [sequential_draws(stocks, request_amount, np.random.default_rng(seed + 10 ** 6))
+                  for seed in range(n_seeds)]
+    for draws in [batched, sequential]:
+        for sites, collected in draws:
+            assert len(sites) == len(collected) >= 1 # a request of 0 still visits one site
+            assert collected.sum() == pytest.approx(request_amount)
+            assert (collected <= stocks[sites]).all()
+
+    # draws per request: same distribution (two-sample KS at 1 %) and mean
+    n_batched = np.array([len(sites) for sites, collected in batched])
+    n_sequential = np.array([len(sites) for sites, collected in sequential])
+    assert ks_distance(n_batched, n_sequential) < 1.63 * np.sqrt(2 / n_seeds)
+    se = np.sqrt((n_batched.var() + n_sequential.var()) / n_seeds)
+    assert abs(n_batched.mean() - n_sequential.mean()) <= 4 * se + 1e-12
+    # sites visited and tons collected per visit
+    sites_batched = np.concatenate([sites for sites, collected in batched])
+    sites_sequential = np.concatenate([sites for sites, collected in sequential])
+    assert ks_distance(sites_batched, sites_sequential) < 1.63 * np.sqrt(2 / min(len(sites_batched), len(sites_sequential)))
+    tons_batched = np.concatenate([collected for sites, collected in batched])
+    tons_sequential = np.concatenate([collected for sites, collected in sequential])
+    assert ks_distance(tons_batched, tons_sequential) < 1.63 * np.sqrt(2 / min(len(tons_batched), len(tons_sequential)))
+
+def test_a_request_of_zero_visits_one_site():
+    sites, collected = model.draw_demolition_sites(stocks, 0., np.random.default_rng(0))
+    assert len(sites) == 1 and collected[0] == 0
+
+def test_nothing_is_drawn_without_stocks():
+    sites, collected = model.draw_demolition_sites(np.zeros(4), 10., np.random.default_rng(0))
+    assert len(sites) == len(collected) == 0
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import model
+
+
+@pytest.fixture
+def default_data(data, monkeypatch):
+    '''make the fixture dataset the one every model loads by default, also in forked sweep workers'''
+    monkeypatch.setattr(model, 'load_model_data', lambda *args, **kwargs: data)
+    return data
+
+def test_expected_request_counts_match_simulated_requests():
+    rng = np.random.default_rng(0)
+    shares = rng.uniform(0.1, 0.2, size=(20000, 20))
+    received = np.cumsum(shares, axis=1)
+    n_full = (received < 1).sum(axis=1) # requests before the one that completes the material
+    last = 1 - np.take_along_axis(received, n_full[:, None] - 1, axis=1)[:, 0]
+    expected_full, share_last = model.expected_request_counts()
+    assert expected_full == pytest.approx(n_full.mean(), rel=0.01)
+    assert share_last == pytest.approx(last.mean(), abs=0.01)
+
+def test_estimates_are_within_tolerance_of_simulated_runs(default_data):
+    '''the closed form estimates are approximations (see Model.estimate), within 10% of the mean of
+    simulated runs on this grid'''
+    param_grid = {'hub_network': ['centralized', 'decentralized'], 'network_type': ['road'],
+                  'truck_type': ['diesel'], 'biobased_type': ['conventional'],
+                  'modularity_type': ['conventional', 'non-structural modules'],
+                  'circularity_type': ['conventional', 'circular non-structural + structural elements']}
+    validation = model.validate_estimates(param_grid, n_replicates=4, n_workers=2, seed=0)
+    assert len(validation) == 8
+    for column in ['emissions_s2h', 'emissions_h2c', 'emissions_total']:
+        assert (validation[f'{column}_relError'].abs() < 0.1).all(), validation[f'{column}_relError']
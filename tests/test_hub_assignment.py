@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import model
+
+
+def brute_force(dist, is_open):
+    '''nearest and second nearest open column of every row (-1 if there is none)'''
+    dist = np.where(is_open, dist, np.inf)
+    order = np.argsort(dist, axis=1, kind='stable')
+    ranked = np.take_along_axis(dist, order, axis=1)
+    nearest = order[:, 0]
+    second = np.where(np.isfinite(ranked[:, 1]), order[:, 1], -1)
+    return nearest, second
+
+def check(assignment, dist):
+    nearest, second = brute_force(dist, assignment.is_open)
+    np.testing.assert_array_equal(assignment.nearest, nearest)
+    np.testing.assert_array_equal(assignment.second, second)
+    hub_ids = assignment.hub_ids
+    np.testing.assert_array_equal(assignment.second_ids, np.where(second >= 0, hub_ids[second], -1))
+    expected_dist = np.where(second >= 0, dist[np.arange(len(dist)), second], np.inf)
+    np.testing.assert_array_equal(assignment.second_dist, expected_dist)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_open_hubs_one_at_a_time_from_a_single_open_hub(seed):
+    rng = np.random.default_rng(seed)
+    dist = rng.uniform(1, 10, size=(40, 7))
+    hub_ids = 100 + np.arange(7)
+    order = rng.permutation(7)
+    is_open = np.zeros(7, dtype=bool)
+    is_open[order[0]] = True
+    assignment = model.HubAssignment(dist, hub_ids, is_open)
+    check(assignment, dist)
+    assert (assignment.second == -1).all()
+    assert np.isinf(assignment.second_dist).all()
+
+    for c in order[1:]:
+        # nearest_after of opening c, then of closing any open hub, agrees with opening / closing it
+        is_open_after = assignment.is_open.copy()
+        is_open_after[c] = True
+        np.testing.assert_array_equal(assignment.nearest_after(add=hub_ids[c]), brute_force(dist, is_open_after)[0])
+        for r in np.flatnonzero(assignment.is_open):
+            if assignment.is_open.sum() > 1:
+                is_open_after = assignment.is_open.copy()
+                is_open_after[r] = False
+                np.testing.assert_array_equal(assignment.nearest_after(remove=hub_ids[r]),
+                                              brute_force(dist, is_open_after)[0])
+        changed = assignment.add(hub_ids[c])
+        check(assignment, dist)
+        np.testing.assert_array_equal(changed, np.flatnonzero(assignment.nearest == c))
+
+    for c in order[:0:-1]: # close them again down to the first hub
+        assignment.remove(hub_ids[c])
+        check(assignment, dist)
+    assert (assignment.second == -1).all()
+    with pytest.raises(ValueError):
+        assignment.remove(hub_ids[order[0]])
+
+def test_nearest_after_removing_the_only_hub_of_a_client():
+    dist = np.array([[1.0, 2.0], [3.0, 1.0]])
+    assignment = model.HubAssignment(dist, [5, 6], is_open=[True, False])
+    with pytest.raises(ValueError):
+        assignment.nearest_after(remove=5)
+    np.testing.assert_array_equal(assignment.nearest_after(add=6, remove=5), [1, 1])
+
+def totals(m):
+    return np.concatenate([m.pollutants_s2h, m.pollutants_h2c, m.roads_nTrips, m.roads_damage])
+
+@pytest.mark.parametrize('steps_before', [0, 2])
+@pytest.mark.parametrize('hub_network', ['centralized', 'decentralized'])
+def test_closing_and_reopening_a_hub_leaves_the_model_unchanged(make_model, hub_network, steps_before):
+    expected = make_model(steps_before + 4, seed=3, hub_network=hub_network, circularity_type='full')
+    for hub_id in [hub.unique_id for hub in expected.hubs]:
+        m = make_model(steps_before, seed=3, hub_network=hub_network, circularity_type='full')
+        agents = [agent.unique_id for agent in m.schedule.agents]
+        hubs = [hub.unique_id for hub in m.hubs]
+        m.close_hub(hub_id)
+        m.open_hub(hub_id)
+        assert [agent.unique_id for agent in m.schedule.agents] == agents
+        assert [hub.unique_id for hub in m.hubs] == hubs
+        for _ in range(4):
+            m.step()
+        np.testing.assert_array_equal(totals(m), totals(expected))
@@ -0,0 +1,68 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import model
+
+
+def test_with_hubs_keeps_routes_and_distances_of_macro_hubs(data):
+    macro = data.hubs_df[data.hubs_df.hub_type == 'macro']
+    micro = data.hubs_df[data.hubs_df.hub_type == 'micro'].copy()
+    micro['geometry'] = micro.geometry.translate(0.001, 0.001) # micro hubs move
+    hubs_df = pd.concat([micro, macro.iloc[::-1]]) # macro hubs get each other's ids
+    moved = data.with_hubs(hubs_df, detour_factor=1.3)
+    new_id = {14: 15, 15: 14}
+    sites = np.arange(len(data.construction_sites_df))
+
+    for old, new in new_id.items():
+        for supplier_id in [12, 13]:
+            np.testing.assert_array_equal(moved.route_index_s2h[(supplier_id, new)],
+                                          data.route_index_s2h[(supplier_id, old)])
+        for site_id in sites:
+            np.testing.assert_array_equal(moved.route_index_h2hc[(new, site_id)],
+                                          data.route_index_h2hc[(old, site_id)])
+        for demSite_id in data.demolition_sites_df.unique_id:
+            np.testing.assert_array_equal(moved.route_index_d2h[(demSite_id, new)],
+                                          data.route_index_d2h[(demSite_id, old)])
+        np.testing.assert_array_equal(moved.dist_h2c[new, sites], data.dist_h2c[old, sites])
+    # micro hubs moved, so they have no routes and straight-line distances
+    assert len(moved.route_index_h2hc[(16, 0)]) == 0
+    assert len(moved.route_index_h2hc[(14, 16)]) == 0
+    assert moved.dist_h2c[16, 0] != data.dist_h2c[16, 0]
+
+def test_model_with_the_same_macro_hubs_is_unchanged(data, make_model):
+    same = data.with_hubs(data.hubs_df, detour_factor=1.3)
+    runs = []
+    for d in [data, same]:
+        m = make_model(seed=2, data=d, hub_network='centralized', circularity_type='full')
+        m.run_until_complete()
+        runs.append(m)
+    assert runs[0].roads_nTrips.sum() > 0
+    np.testing.assert_array_equal(runs[0].roads_nTrips, runs[1].roads_nTrips)
+    np.testing.assert_allclose(runs[0].roads_damage, runs[1].roads_damage)
+    np.testing.assert_allclose(runs[0].pollutants_s2h, runs[1].pollutants_s2h)
+    np.testing.assert_allclose(runs[0].pollutants_h2c, runs[1].pollutants_h2c)
+
+def test_hub_siting_chooses_micro_hubs_only(data, params):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        siting = model.HubSiting(params, n_hubs=3, data=data, seed=0)
+    siting.first_guess()
+    first_value = siting.objective_value
+    hubs_df = siting.optimize(n_iterations=200)
+    assert siting.objective_value <= first_value
+    assert list(hubs_df.hub_type) == ['macro', 'macro', 'micro', 'micro', 'micro']
+    macro = data.hubs_df[data.hubs_df.hub_type == 'macro']
+    assert hubs_df.geometry.iloc[:2].geom_equals(macro.geometry.reset_index(drop=True)).all()
+    validation = siting.validate(max_steps=50, seed=0)
+    assert np.isfinite(validation.to_numpy()).all()
+
+def test_hub_siting_uses_the_vehicles_of_the_model(data, params):
+    params.update(truck_type='semi')
+    siting = model.HubSiting(params, n_hubs=1, data=data)
+    m = siting.model
+    for hub in siting.macroHubs:
+        for site in m.construction_sites:
+            assert hub._get_vehicle_forClient(site) is model.get_vehicle_forClient(
+                m, hub.inA10, hub.waterbound, site.inA10, site.waterbound)
@@ -0,0 +1,173 @@
+import folium
+import numpy as np
+import pytest
+import shapely
+
+
+@pytest.fixture(scope='module')
+def circular_run(make_model):
+    return make_model(5, seed=4, circularity_type='full')
+
+def geojson_layers(folium_map):
+    return [child for child in folium_map._children.values() if isinstance(child, folium.GeoJson)]
+
+def old_road_color(values, value):
+    '''colour of a used road as given by the style function of plotLines_roadsUsed before it used classes'''
+    quantiles = {q: np.quantile(values, q) for q in [0.2, 0.4, 0.6, 0.8]}
+    lowVal = 80
+    inc = (255 - lowVal) / 5
+    if value <= quantiles[0.2]:
+        return f'rgb({lowVal}, 0, 0)'
+    elif value <= quantiles[0.4]:
+        return f'rgb({lowVal+inc*1}, 0, 0)'
+    elif value <= quantiles[0.6]:
+        return f'rgb({lowVal+inc*2}, 0, 0)'
+    elif value <= quantiles[0.8]:
+        return f'rgb({lowVal+inc*3}, 0, 0)'
+    return 'rgb(255, 0, 0)'
+
+@pytest.mark.parametrize('indicator', ['damage', 'nTrips'])
+def test_road_classes_match_the_old_colors(circular_run, indicator):
+    m = circular_run
+    folium_map = folium.Map()
+    m.plotLines_roadsUsed(folium_map, indicator=indicator, merge=False)
+    [layer] = geojson_layers(folium_map)
+    used = np.flatnonzero(m.roads_nTrips > 0)
+    values = (m.roads_damage if indicator == 'damage' else m.roads_nTrips)[used]
+    classes = [feature['properties']['class'] for feature in layer.data['features']]
+    assert len(classes) == len(used)
+    colors = [m.road_class_colors[c].replace(' ', '') for c in classes]
+    old = [old_road_color(values, value).replace('.0', '').replace(' ', '') for value in values]
+    assert colors == old
+
+def test_merged_roads_keep_every_used_road(circular_run):
+    m = circular_run
+    folium_map = folium.Map()
+    m.plotLines_roadsUsed(folium_map)
+    [layer] = geojson_layers(folium_map)
+    assert len(layer.data['features']) <= 5
+    merged_length = sum(shapely.geometry.shape(f['geometry']).length for f in layer.data['features'])
+    used = np.flatnonzero(m.roads_nTrips > 0)
+    assert merged_length == pytest.approx(shapely.length(m.data.map_geometries()[used]).sum())
+
+def test_map_geometries_stay_close_to_the_roads(data):
+    geoms = data.map_geometries(decimals=5, tolerance=5e-5)
+    assert geoms is data.map_geometries(decimals=5, tolerance=5e-5) # computed once
+    distance = shapely.hausdorff_distance(geoms, np.asarray(data.roads_gdf.geometry.values))
+    assert distance.max() <= 5e-5 + 1e-5
+
+def point_features(layer):
+    '''(id, lat, lon) of every point of a GeoJSON layer'''
+    return [(f['properties']['id'], *np.round(f['geometry']['coordinates'][::-1], 5)) for f in layer.data['features']]
+
+def demSite_coords(m, demSite_id):
+    demSite = m.demolition_sites_df[m.demolition_sites_df.unique_id == demSite_id].iloc[0]
+    return (demSite.geometry.y, demSite.geometry.x)
+
+def test_demSite_visits_count_every_collection(circular_run):
+    m = circular_run
+    demSites = m.get_demSite_visits()
+    visits, hub_ids = {}, {}
+    for hub in m.hubs: 
+        for demSite_id in hub.demolition_site_ids: 
+            visits[demSite_id] = visits.get(demSite_id, 0) + 1
+            hub_ids.setdefault(demSite_id, set()).add(hub.unique_id)
+    assert len(visits) > 0
+    assert dict(zip(demSites.unique_id, demSites.visits)) == visits
+    assert {i: set(h) for i, h in zip(demSites.unique_id, demSites.hub_ids)} == hub_ids
+
+def test_demSite_points_match_the_old_markers(circular_run):
+    m = circular_run
+    folium_map = folium.Map()
+    m.plotPoints_demSites(folium_map, 'green', 2)
+    [layer] = geojson_layers(folium_map)
+    # the old code added a marker per hub and demolition site, at the same place for every hub
+    old = {(demSite_id, *np.round(demSite_coords(m, demSite_id), 5)) 
+           for hub in m.hubs for demSite_id in set(hub.demolition_site_ids)}
+    points = point_features(layer)
+    assert len(points) == len(set(points))
+    assert set(points) == old
+
+def test_hub_points_match_the_old_markers(circular_run):
+    m = circular_run
+    folium_map = folium.Map()
+    m.plotPoints_hubs(folium_map, 'blue')
+    macro_layer, micro_layer = geojson_layers(folium_map)
+    macroHubs = [hub for hub in m.hubs if hub.hubType == 'macro']
+    assert point_features(macro_layer) == [(hub.unique_id, *np.round(hub.coords, 5)) for hub in macroHubs]
+    # the old code added a marker per micro hub every time it was found among the clients of a macro hub
+    hub_ids = [hub.unique_id for hub in m.hubs]
+    old = {(client_id, *np.round(m.hubs[hub_ids.index(client_id)].coords, 5)) 
+           for macroHub in macroHubs for client_id in macroHub.client_ids if client_id in hub_ids}
+    points = point_features(micro_layer)
+    assert len(old) > 0
+    assert len(points) == len(set(points))
+    assert set(points) == old
+
+def test_d2h_lines_match_the_old_lines(circular_run):
+    m = circular_run
+    folium_map = folium.Map()
+    m.plotLines_d2h(folium_map)
+    [layer] = geojson_layers(folium_map)
+    old = [(tuple(np.round(hub.coords, 5)), tuple(np.round(demSite_coords(m, demSite_id), 5))) 
+           for hub in m.hubs for demSite_id in set(hub.demolition_site_ids)]
+    lines = [tuple(tuple(np.round(point[::-1], 5)) for point in f['geometry']['coordinates']) 
+             for f in layer.data['features']]
+    assert len(old) > 0
+    assert sorted(lines) == sorted(old)
+
+def line_features(layer):
+    '''((lat, lon), (lat, lon)) of every line of a GeoJSON layer'''
+    return [tuple(tuple(np.round(point[::-1], 5)) for point in f['geometry']['coordinates']) 
+            for f in layer.data['features']]
+
+@pytest.mark.parametrize('hub_network, circularity_type', 
+                         [('centralized', 'none'), ('decentralized', 'full'), ('none', 'none')])
+def test_flows_into_sites_add_up_to_the_materials_received(make_model, hub_network, circularity_type):
+    m = make_model(5, seed=6, hub_network=hub_network, circularity_type=circularity_type)
+    flows = m.get_flows()
+    assert not flows.duplicated(['origin_id', 'destination_id']).any()
+    tons = flows.groupby('destination_id').tons.sum()
+    for site in m.construction_sites: 
+        received = sum(amount for amounts in site.materials_received.values() for amount in amounts.values())
+        assert tons.get(site.unique_id, 0) == pytest.approx(received)
+    assert tons.sum() > 0
+
+@pytest.mark.parametrize('hub_network', ['centralized', 'decentralized'])
+def test_s2h_lines_match_the_old_lines(make_model, hub_network):
+    m = make_model(5, seed=6, hub_network=hub_network)
+    folium_map = folium.Map()
+    m.plotLines_s2h(folium_map)
+    [layer] = geojson_layers(folium_map)
+    lines = line_features(layer)
+    assert len(lines) == len(set(lines))
+    coords = {agent.unique_id: tuple(np.round(agent.coords, 5)) for agent in m.suppliers + m.hubs}
+    # the old code drew a line per supplier used by every macro hub (once per delivery) ...
+    old = {(coords[supplier_id], coords[hub.unique_id]) for hub in m.hubs for supplier_id in hub.supplier_ids}
+    assert len(old) > 0
+    # ... the layer also shows the deliveries from macro to micro hubs
+    hub_ids = set(coords) - {supplier.unique_id for supplier in m.suppliers}
+    macro_to_micro = {(coords[hub.unique_id], coords[client_id]) 
+                      for hub in m.hubs for client_id in hub.client_ids if client_id in hub_ids}
+    assert set(lines) == old | macro_to_micro
+    assert bool(macro_to_micro) == (hub_network == 'decentralized')
+    tons = [f['properties']['tons'] for f in layer.data['features']]
+    flows = m.get_flows()
+    flows = flows[flows.destination_id.isin(hub_ids)]
+    assert sorted(tons) == sorted(flows.tons.round(1))
+
+def test_s2c_lines_are_the_supplier_site_pairs_with_deliveries(make_model):
+    m = make_model(5, seed=6, hub_network='none')
+    folium_map = folium.Map()
+    m.plotLines_s2h(folium_map)
+    [layer] = geojson_layers(folium_map)
+    lines = line_features(layer)
+    coords = {agent.unique_id: tuple(np.round(agent.coords, 5)) for agent in m.suppliers + m.construction_sites}
+    # the old code drew every supplier / site pair, whether materials were delivered or not
+    flows = m.get_flows()
+    delivered = {(coords[origin_id], coords[destination_id]) 
+                 for origin_id, destination_id in zip(flows.origin_id, flows.destination_id)}
+    assert len(lines) == len(set(lines))
+    assert set(lines) == delivered
+    assert delivered <= {(coords[supplier.unique_id], coords[site.unique_id]) 
+                         for supplier in m.suppliers for site in m.construction_sites}
@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import model
+
+
+def totals(m):
+    return np.concatenate([m.pollutants_s2h, m.pollutants_h2c, m.roads_nTrips, m.roads_damage])
+
+@pytest.mark.parametrize('circularity_type', ['none', 'full'])
+def test_same_seed_gives_the_same_run(make_model, circularity_type):
+    a, b = (make_model(5, seed=11, circularity_type=circularity_type) for _ in range(2))
+    np.testing.assert_array_equal(totals(a), totals(b))
+    assert a.datacollector.get_model_vars_dataframe().drop(columns='zones').equals(
+        b.datacollector.get_model_vars_dataframe().drop(columns='zones'))
+    assert not np.array_equal(totals(a), totals(make_model(5, seed=12, circularity_type=circularity_type)))
+
+@pytest.mark.parametrize('hub_network', ['centralized', 'decentralized'])
+@pytest.mark.parametrize('circularity_type', ['none', 'full'])
+def test_dict_and_array_paths_give_the_same_run(make_model, hub_network, circularity_type):
+    dict_run = make_model(5, seed=5, hub_network=hub_network, circularity_type=circularity_type)
+    array_run = make_model(5, seed=5, array_state=True, hub_network=hub_network, circularity_type=circularity_type)
+    np.testing.assert_array_equal(dict_run.roads_nTrips, array_run.roads_nTrips)
+    np.testing.assert_array_equal(dict_run.roads_damage, array_run.roads_damage)
+    np.testing.assert_array_equal(dict_run.pollutants_s2h, array_run.pollutants_s2h)
+    np.testing.assert_array_equal(dict_run.pollutants_h2c, array_run.pollutants_h2c)
+
+script = '''
+import sys
+import numpy as np
+sys.path.insert(0, sys.argv[1])
+import model
+params = dict(hub_network='decentralized', network_type='road', truck_type='diesel', biobased_type='none',
+              modularity_type='none', circularity_type='full')
+m = model.Model(params, seed=3, data=model.ModelData(sys.argv[2], use_cache=False))
+for _ in range(5):
+    m.step()
+print(repr(np.concatenate([m.pollutants_s2h, m.pollutants_h2c, m.roads_damage]).tolist()))
+'''
+
+def test_runs_do_not_depend_on_the_string_hash_seed(data_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputs = []
+    for hash_seed in ['1', '2', '3']:
+        env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+        result = subprocess.run([sys.executable, '-c', script, root, data_path], env=env,
+                                capture_output=True, text=True, check=True)
+        outputs.append(result.stdout)
+    assert outputs[0] == outputs[1] == outputs[2]
+
+def test_runs_in_worker_processes_match_runs_in_process(data, params, monkeypatch):
+    monkeypatch.setattr(model, 'load_model_data', lambda *args, **kwargs: data)
+    param_grid = {key: [value] for key, value in params.items()}
+    sweep = model.run_sweep(param_grid, n_replicates=2, n_workers=2, seed=9, max_steps=50)
+    seeds = np.random.SeedSequence(9).spawn(2)
+    for replicate, seed in enumerate(seeds):
+        expected = model.run_scenario(model.make_scenarios(param_grid)[0], seed=int(seed.generate_state(1)[0]),
+                                      max_steps=50)
+        got = sweep[sweep.replicate == replicate].reset_index(drop=True)
+        np.testing.assert_array_equal(got.emissions_total.to_numpy(), expected.emissions_total.to_numpy())
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import model
+
+
+@pytest.mark.parametrize('array_state', [False, True])
+@pytest.mark.parametrize('circularity_type', ['none', 'full'])
+def test_road_log_replays_the_model_counters(make_model, array_state, circularity_type):
+    m = make_model(seed=1, array_state=array_state, circularity_type=circularity_type)
+    counters = []
+    for _ in range(6):
+        m.step()
+        counters.append((m.roads_nTrips.copy(), m.roads_damage.copy()))
+    assert len(m.road_log) == 6
+    for step, (nTrips, damage) in enumerate(counters):
+        replayed_nTrips, replayed_damage = m.road_log.cumulative(step)
+        np.testing.assert_array_equal(replayed_nTrips, nTrips)
+        np.testing.assert_allclose(replayed_damage, damage, rtol=1e-6) # steps are stored as float32
+    np.testing.assert_allclose(m.roads_used_at(5).damage.to_numpy(), m.roads_damage, rtol=1e-6)
+
+def test_step_changes_are_the_trips_of_one_step(make_model):
+    m = make_model(1, seed=1)
+    before = m.roads_damage.copy()
+    m.step()
+    edges, nTrips, damage = m.road_log.step_changes(1)
+    assert (edges.dtype, nTrips.dtype, damage.dtype) == (np.int32, np.int32, np.float32)
+    added = np.bincount(edges, weights=damage, minlength=len(m.roads_gdf))
+    np.testing.assert_allclose(before + added, m.roads_damage, rtol=1e-6)
+
+@pytest.mark.parametrize('hub_network', ['centralized', 'decentralized'])
+def test_steps_are_logged_once_per_loaded_road(make_model, hub_network):
+    m = make_model(seed=1, hub_network=hub_network)
+    n_roads = len(m.roads_gdf)
+    for step in range(4):
+        m.step()
+        edges, nTrips, damage = m.road_log.step_changes(step)
+        assert (np.diff(edges) > 0).all()
+        assert (nTrips > 0).all()
+        # smaller than a snapshot of the trips and damage of every road
+        assert sum(array.nbytes for array in (edges, nTrips, damage)) < n_roads * 16
+    assert m.road_log.nbytes < 4 * n_roads * 16
+
+def test_trips_without_loads_are_not_logged():
+    log = model.RoadUsageLog(5)
+    log.record(np.array([0, 1]), 0, 0.)
+    log.record(np.array([1, 2, 3]), np.array([0, 2, 0]), np.array([0., 5., 0.]))
+    log.record(np.array([2, 4]), 1, 2.5)
+    log.end_step()
+    edges, nTrips, damage = log.step_changes(0)
+    np.testing.assert_array_equal(edges, [2, 4])
+    np.testing.assert_array_equal(nTrips, [3, 1])
+    np.testing.assert_array_equal(damage, [7.5, 2.5])
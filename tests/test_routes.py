@@ -0,0 +1,48 @@
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import LineString
+
+import model
+
+
+def old_route(roads_gdf, road_ids):
+    '''rows of roads_gdf a route used to be matched to, with an isin mask on the osmid strings'''
+    road_ids_str = [','.join(map(str, r)) if isinstance(r, list) else str(r) for r in road_ids]
+    return np.flatnonzero(roads_gdf['osmid'].isin(road_ids_str))
+
+def make_roads(path):
+    # osmids as stored in the shapefile: lists of osmids joined with ',', and an osmid on two rows
+    osmids = ['1', '2', '5', '7,8', '9', '3', '5', '10,11,12']
+    roads_gdf = gpd.GeoDataFrame({'osmid': osmids}, crs='EPSG:4326', geometry=[
+        LineString([(4.9 + i / 100, 52.3), (4.9 + i / 100, 52.31)]) for i in range(len(osmids))])
+    roads_gdf.to_file(f'{path}/ams_roads_edges.shp')
+    return gpd.read_file(f'{path}/ams_roads_edges.shp')
+
+def make_road_matrix(rng, n_routes):
+    choices = [1, 2, 3, 5, 9, [7, 8], [10, 11, 12], 999, [8, 7]]
+    roadMatrix = np.empty((n_routes, 3), dtype=object)
+    for i in range(n_routes):
+        roadMatrix[i, 0], roadMatrix[i, 1] = 100 + i // 3, i % 3
+        # duplicates, as in the sets and lists of the road matrices
+        roadMatrix[i, 2] = [choices[j] for j in rng.integers(0, len(choices), rng.integers(0, 8))]
+    return roadMatrix
+
+def test_converted_routes_match_the_osmid_masks(tmp_path):
+    path = str(tmp_path)
+    roads_gdf = make_roads(path)
+    rng = np.random.default_rng(0)
+    matrices = {name: make_road_matrix(rng, 12) for name in ['h2hc', 'd2h']}
+    for name, roadMatrix in matrices.items():
+        np.save(f'{path}/roadOsmIds_matrix_{name}.npy', roadMatrix, allow_pickle=True)
+    model.convert_road_matrices(path)
+    assert not model.RouteStore.exists(path, 's2h')
+    osmid_positions = model.RouteStore.make_osmid_positions(roads_gdf)
+    assert osmid_positions['5'] == [2, 6]
+    for name, roadMatrix in matrices.items():
+        routes = model.RouteStore.load(path, name)
+        assert len(routes) == len(roadMatrix)
+        for origin_id, destination_id, road_ids in roadMatrix:
+            expected = old_route(roads_gdf, road_ids)
+            np.testing.assert_array_equal(routes[(origin_id, destination_id)], expected)
+            np.testing.assert_array_equal(
+                model.RouteStore.from_road_matrix(roadMatrix, osmid_positions)[(origin_id, destination_id)], expected)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import model
+
+
+def almost_finish_sites(hub):
+    '''sites served by hub need one last delivery, so the hub is done after the first step'''
+    for client in hub.clients.values():
+        site = client['agent']
+        for strucType, mat_amounts in site.materials_required.items():
+            for mat, required in mat_amounts.items():
+                site.materials_received[strucType][mat] = required * 0.95
+
+def almost_finished_model(make_model, array_state, circularity_type):
+    m = make_model(seed=7, array_state=array_state, circularity_type=circularity_type)
+    microHub = next(hub for hub in m.hubs if hub.hubType == 'micro' and hub.clients)
+    almost_finish_sites(microHub)
+    return m, microHub
+
+@pytest.mark.parametrize('array_state', [False, True])
+@pytest.mark.parametrize('circularity_type', ['none', 'full'])
+def test_run_until_complete_matches_stepping(make_model, array_state, circularity_type):
+    m, microHub = almost_finished_model(make_model, array_state, circularity_type)
+    n_steps = m.run_until_complete(max_steps=100)
+    assert m.outstanding_demand == 0
+    assert microHub.done and microHub not in m.schedule.agents
+
+    stepped, _ = almost_finished_model(make_model, array_state, circularity_type)
+    for _ in range(n_steps):
+        stepped.step()
+    assert stepped.outstanding_demand == 0
+    np.testing.assert_allclose(m.pollutants_s2h, stepped.pollutants_s2h)
+    np.testing.assert_allclose(m.pollutants_h2c, stepped.pollutants_h2c)
+    np.testing.assert_array_equal(m.roads_nTrips, stepped.roads_nTrips)
+    np.testing.assert_allclose(m.roads_damage, stepped.roads_damage)
+
+def test_every_scenario_of_the_default_grid_builds(make_model):
+    scenarios = model.make_scenarios()
+    unique = {tuple(sorted(scenario.items())) for scenario in scenarios}
+    assert len(unique) == len(scenarios) == 864
+    for scenario in scenarios:
+        m = make_model(**scenario)
+        assert m.construction_sites
+
+@pytest.mark.parametrize('circularity_type', ['semi', 'full', 'extreme'])
+def test_circularity_without_hubs_leaves_the_run_unchanged(make_model, circularity_type):
+    conventional = make_model(3, seed=7, hub_network='none')
+    circular = make_model(3, seed=7, hub_network='none', circularity_type=circularity_type)
+    np.testing.assert_array_equal(circular.pollutants_s2h, conventional.pollutants_s2h)
+    np.testing.assert_array_equal(circular.roads_nTrips, conventional.roads_nTrips)
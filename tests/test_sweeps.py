@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import model
+
+
+# two-sided 95 % / one-sided 95 % / two-sided 99 % quantiles from a t table
+t_table = {1: (12.706, 6.314, 63.657), 2: (4.303, 2.920, 9.925), 3: (3.182, 2.353, 5.841), 
+           4: (2.776, 2.132, 4.604), 5: (2.571, 2.015, 4.032), 10: (2.228, 1.812, 3.169), 
+           30: (2.042, 1.697, 2.750), 120: (1.980, 1.658, 2.617)}
+
+@pytest.mark.parametrize('dof', t_table)
+def test_t_quantiles_match_the_table(dof):
+    for p, expected in zip([0.975, 0.95, 0.995], t_table[dof]):
+        # exact for 1 and 2 degrees of freedom, Cornish-Fisher within 1 % from 3 on
+        assert model.t_quantile(p, dof) == pytest.approx(expected, rel=1e-3 if dof <= 2 else 1e-2, abs=1e-3)
+        assert model.t_quantile(1 - p, dof) == pytest.approx(-model.t_quantile(p, dof))
+
+def test_paired_differences_cancel_the_common_noise():
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 10, 8)
+    values = np.array([100 + noise, 90 + noise + rng.normal(0, 0.5, 8)])
+    summary = model.summarize_paired_differences(values, [{'name': 'a'}, {'name': 'b'}])
+    n, t = 8, model.t_quantile(0.975, 7)
+    difference = values[1] - values[0]
+    assert summary.mean_difference[1] == pytest.approx(difference.mean())
+    assert summary.ci_high[1] - summary.ci_low[1] == pytest.approx(2 * t * difference.std(ddof=1) / np.sqrt(n))
+    assert summary.ci_width_unpaired[1] == pytest.approx(
+        2 * t * np.sqrt((values[0].var(ddof=1) + values[1].var(ddof=1)) / n))
+    assert summary.ci_high[1] - summary.ci_low[1] < summary.ci_width_unpaired[1] / 5
+    assert list(summary.name) == ['a', 'b']
+
+@pytest.fixture
+def paired_grid(data, monkeypatch):
+    monkeypatch.setattr(model, 'load_model_data', lambda *args, **kwargs: data)
+    return dict(hub_network=['decentralized'], network_type=['road'], truck_type=['diesel', 'electric'],
+                biobased_type=['none'], modularity_type=['none'], circularity_type=['full'])
+
+def test_paired_sweep_stops_once_the_differences_are_precise(paired_grid):
+    summary, runs = model.run_paired_sweep(paired_grid, rel_ci_width=0.05, max_replicates=30, n_workers=2, seed=1)
+    n = summary.n_replicates[1]
+    assert 3 <= n < 30
+    assert len(runs) == 2 * n
+    width = summary.ci_high[1] - summary.ci_low[1]
+    assert width <= 0.05 * abs(summary.mean_difference[1])
+    # common random numbers: the paired interval is narrower than without pairing
+    assert width < summary.ci_width_unpaired[1]
+    # replicate r of both scenarios ran with the same seed
+    assert (runs.groupby('replicate').seed.nunique() == 1).all()
+
+def test_paired_sweep_adds_batches_up_to_max_replicates(paired_grid):
+    summary, runs = model.run_paired_sweep(paired_grid, ci_width=0, min_replicates=3, max_replicates=8,
+                                           n_workers=4, seed=1)
+    # a zero width is never reached: batches of 3, then 2 (4 workers / 2 scenarios), cut at max_replicates
+    assert list(summary.n_replicates) == [8, 8]
+    assert sorted(runs.replicate.unique()) == list(range(8))
+    assert runs.emissions_total.notna().all()
+
+def test_running_stats_match_numpy():
+    values = np.random.default_rng(2).lognormal(5, 1, size=(40, 3))
+    values[:, 2] = 0 # a metric that is always 0
+    stats = model.RunningStats(3)
+    assert np.isinf(stats.std).all() and np.isinf(stats.half_width()).all()
+    for n, row in enumerate(values, start=1):
+        stats.add(row)
+        np.testing.assert_allclose(stats.mean, values[:n].mean(axis=0))
+        if n > 1:
+            np.testing.assert_allclose(stats.std, values[:n].std(axis=0, ddof=1), atol=1e-12)
+            half_width = model.t_quantile(0.975, n - 1) * values[:n].std(axis=0, ddof=1) / np.sqrt(n)
+            np.testing.assert_allclose(stats.half_width(), half_width, atol=1e-12)
+    np.testing.assert_allclose(stats.rel_half_width()[:2], stats.half_width()[:2] / stats.mean[:2])
+    assert stats.rel_half_width()[2] == 0
+
+@pytest.fixture
+def replicate_params(data, params, monkeypatch):
+    monkeypatch.setattr(model, 'load_model_data', lambda *args, **kwargs: data)
+    params.update(circularity_type='full')
+    return params
+
+def test_replicates_stop_when_converged(replicate_params):
+    summary = model.run_replicates(replicate_params, rel_tol=0.05, max_reps=20, n_workers=2, seed=3)
+    total = summary[(summary.result_name == 'emissions_total') & (summary.area == 'whole model')].iloc[0]
+    assert total.converged and 3 <= total.n_replicates < 20
+    assert total.rel_half_width <= 0.05
+
+def test_replicates_stop_at_max_reps(replicate_params):
+    summary = model.run_replicates(replicate_params, rel_tol=0, max_reps=5, n_workers=2, seed=3)
+    assert (summary.n_replicates == 5).all() and not summary.converged.any()
+
+def test_replicates_do_not_depend_on_the_workers(replicate_params):
+    a = model.run_replicates(replicate_params, rel_tol=0, max_reps=6, n_workers=1, seed=4)
+    b = model.run_replicates(replicate_params, rel_tol=0, max_reps=6, n_workers=3, seed=4)
+    assert a.equals(b)
+
+def test_replicates_need_max_reps(replicate_params):
+    with pytest.raises(ValueError, match='max_reps'):
+        model.run_replicates(replicate_params, max_reps=0)
@@ -0,0 +1,31 @@
+import warnings
+
+import pytest
+from shapely.geometry import box
+
+import model
+
+
+def test_register_zone_does_not_change_the_shared_data(data, make_model):
+    names = list(data.road_zones.names)
+    m = make_model()
+    m.register_zone('west', box(4.80, 52.30, 4.90, 52.42))
+    m.step()
+    assert m.road_zones.names == names + ['west']
+    assert 'west' in m.zone_totals
+    assert data.road_zones.names == names
+    assert make_model().road_zones.names == names
+
+def test_zone_totals_cover_the_whole_network(make_model):
+    m = make_model(3)
+    assert m.zone_totals['MRA']['damage'] == pytest.approx(m.roads_damage.sum())
+    assert m.zone_totals['A10']['nTrips'] <= m.zone_totals['MRA']['nTrips']
+
+def test_register_zone_from_geodataframe_has_no_deprecation_warning(data):
+    zones = data.road_zones.copy()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        zones.register('A10 again', model.gpd.read_file(f'{data.data_path}/a10.shp'))
+    a10 = data.road_zones.names.index('A10')
+    again = zones.names.index('A10 again')
+    assert (zones.edges[zones.zone_ids == again] == data.road_zones.edges[data.road_zones.zone_ids == a10]).all()